@@ -0,0 +1,138 @@
+"""
+Benchmark of src/gapfill.py against the per-catchment loop of the analysis notebook on
+synthetic FSC/SLA time series.
+
+Usage:
+    python benchmarks/bench_gapfill.py --basins 3000 --reference-basins 100
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Add the project root directory to Python path
+sys.path.append(str(Path(__file__).absolute().parent.parent))
+
+from src.gapfill import gapfill_timeseries, prepare_timeseries
+
+
+def synthetic_timeseries(n_basins, first_year=2001, last_year=2024, missing_rows=0.1, missing_values=0.05, seed=0):
+    """
+    Exported-table-like DataFrame for n_basins basins with missing decades and missing values.
+    """
+    rng = np.random.default_rng(seed)
+    years = np.arange(first_year, last_year + 1)
+    n_steps = len(years) * 36
+    step = np.tile(np.arange(n_steps), n_basins)
+    basin = np.repeat(np.arange(n_basins), n_steps)
+
+    # Some basins start later
+    start_step = rng.integers(0, 36 * 4, n_basins) * (rng.random(n_basins) < 0.2)
+    keep = (step >= start_step[basin]) & (rng.random(step.size) >= missing_rows)
+    step, basin = step[keep], basin[keep]
+
+    year = first_year + step // 36
+    month = (step % 36) // 3 + 1
+    decade = step % 3 + 1
+    day = np.array([1, 11, 21])[decade - 1]
+    season = np.cos(2 * np.pi * (step % 36) / 36)
+
+    df = pd.DataFrame({
+        'system:index': np.arange(step.size).astype(str),
+        'Basin': np.char.add('BASIN', basin.astype(str)),
+        'Code': 10000 + basin,
+        'Name': np.char.add(np.char.add('BASIN', basin.astype(str)), np.char.add('_', (10000 + basin).astype(str))),
+        'Year-Month-Day': pd.to_datetime({'year': year, 'month': month, 'day': day}).dt.strftime('%Y-%m-%d'),
+        'decade': decade,
+        'fsc': np.clip(0.5 + 0.4 * season + rng.normal(0, 0.05, step.size), 0, 1),
+        'gla_area_below_sl50': np.clip(20 - 20 * season + rng.normal(0, 2, step.size), 0, None),
+        'gla_fsc': np.clip(0.7 + 0.3 * season, 0, 1),
+        'gla_fsc_below_sl50': np.clip(0.6 + 0.3 * season, 0, 1),
+        '.geo': '{"type":"Point","coordinates":[70,40]}',
+    })
+    for i, aspect in enumerate(['East', 'North', 'South', 'West']):
+        df[f'SLA_{aspect}'] = 3500 - 800 * season + 50 * i + rng.normal(0, 30, step.size)
+
+    value_columns = ['fsc', 'gla_area_below_sl50', 'gla_fsc', 'gla_fsc_below_sl50',
+                     'SLA_East', 'SLA_North', 'SLA_South', 'SLA_West']
+    for column in value_columns:
+        df.loc[rng.random(len(df)) < missing_values, column] = np.nan
+    return df
+
+
+def notebook_gapfill(df, end_year=2024):
+    """
+    Per-catchment loop of the analysis notebook (reference implementation).
+    """
+    results = []
+    for catchment_name in df['Name'].unique():
+        catchment_data = df[df['Name'] == catchment_name].copy()
+        catchment_data['year'] = catchment_data['date'].dt.year
+        catchment_data['month'] = catchment_data['date'].dt.month
+        decades = [1, 2, 3]
+        years = range(catchment_data['year'].min(), end_year + 1)
+        months = range(1, 13)
+        combinations = pd.DataFrame([
+            (year, month, decade) for year in years for month in months for decade in decades
+        ], columns=['year', 'month', 'decade'])
+        merged_df = pd.merge(combinations, catchment_data, on=['year', 'month', 'decade'], how='left')
+        merged_df['Name'] = catchment_name
+        decade_start_days = {1: 1, 2: 11, 3: 21}
+        merged_df['date'] = pd.to_datetime({
+            'year': merged_df['year'],
+            'month': merged_df['month'],
+            'day': merged_df['decade'].map(decade_start_days)
+        })
+        merged_df['Basin'] = merged_df['Basin'].ffill()
+        merged_df['Code'] = merged_df['Code'].ffill()
+        merged_df['.geo'] = merged_df['.geo'].ffill()
+        for column in ['SLA_East', 'SLA_North', 'SLA_South', 'SLA_West', 'fsc', 'gla_area_below_sl50', 'gla_fsc']:
+            merged_df[column] = merged_df[column].interpolate(method='linear')
+        merged_df['gla_fsc_below_sl50'] = merged_df['gla_fsc_below_sl50'].mask(
+            merged_df['gla_area_below_sl50'] == 0, 1
+        )
+        merged_df['gla_fsc_below_sl50'] = merged_df['gla_fsc_below_sl50'].interpolate(method='linear')
+        na_mask = merged_df['gla_fsc'].isna()
+        merged_df.loc[na_mask, 'gla_area_below_sl50'] = 0
+        merged_df.loc[na_mask, 'gla_fsc_below_sl50'] = 0
+        merged_df.loc[na_mask, 'gla_fsc'] = 0
+        results.append(merged_df)
+    return pd.concat(results, ignore_index=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--basins', type=int, default=3000, help='Number of synthetic basins')
+    parser.add_argument('--reference-basins', type=int, default=100,
+                        help='Number of basins timed with the notebook loop (extrapolated to --basins)')
+    args = parser.parse_args()
+
+    df = prepare_timeseries(synthetic_timeseries(args.basins))
+    print(f'{args.basins} basins, {len(df)} records')
+
+    start = time.perf_counter()
+    result = gapfill_timeseries(df)
+    vectorized = time.perf_counter() - start
+    print(f'Vectorized gap-filling: {vectorized:.2f} s ({len(result)} rows)')
+
+    subset = df[df['Name'].isin(df['Name'].unique()[:args.reference_basins])]
+    start = time.perf_counter()
+    reference = notebook_gapfill(subset)
+    loop = (time.perf_counter() - start) * args.basins / max(subset['Name'].nunique(), 1)
+    print(f'Notebook loop (extrapolated from {subset["Name"].nunique()} basins): {loop:.2f} s')
+    print(f'Speed-up: {loop / vectorized:.1f}x')
+
+    # Check that both give the same result on the reference subset
+    pd.testing.assert_frame_equal(
+        result[result['Name'].isin(subset['Name'].unique())].reset_index(drop=True),
+        reference,
+        check_dtype=False,
+    )
+    print('Results identical to the notebook loop')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Consistency check of the hypsometry snowline method against the edge method of
+src/snowline_local.py on a synthetic basin: both must fall back to the basin minimum
+elevation on snow-covered steps and to the maximum on snow-free steps (fully covered and
+bare, and with the snowline below or above the terrain), and the agreement on the seasonal
+cycle and the error against the true synthetic snowline are reported.
+
+Usage:
+    python benchmarks/check_snowline_methods.py --area 2000
+"""
+import argparse
+import sys
+from pathlib import Path
+
+import numpy as np
+
+# Add the project root directory to Python path
+sys.path.append(str(Path(__file__).absolute().parent.parent))
+
+from benchmarks.synthetic import ASPECT_KEYS, seasonal_snowline, synthetic_basin
+from src.snowline_local import compare_snowline_methods, get_snowline_elevation_local
+
+
+def extreme_steps(basin, seed=0):
+    """
+    (time, y, x) stack of one fully snow-covered, one snow-free, one mostly snow-covered
+    (snowline 300 m below the terrain) and one mostly snow-free (300 m above) step, with
+    clouds taken from the first synthetic steps.
+    """
+    rng = np.random.default_rng(seed)
+    dem = basin['dem']
+    clouds = np.isnan(basin['scf'][:4])
+    low, high = np.nanmin(dem), np.nanmax(dem)
+    noise = rng.normal(0, 150, (2,) + dem.shape)
+    steps = np.stack([
+        np.full(dem.shape, 100.0),
+        np.zeros(dem.shape),
+        100 / (1 + np.exp(-(dem - (low - 300) + noise[0]) / 120)),
+        100 / (1 + np.exp(-(dem - (high + 300) + noise[1]) / 120)),
+    ])
+    return np.where(clouds, np.nan, steps)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--area', type=float, default=2000, help='Basin area in km2')
+    args = parser.parse_args()
+
+    basin = synthetic_basin(args.area)
+    dem, aspect_coded, aoi = basin['dem'], basin['aspect_coded'], basin['aoi']
+    low, high = np.nanmin(dem[aoi]), np.nanmax(dem[aoi])
+
+    # Snow-covered and snow-free steps: both methods give the basin minimum / maximum
+    stack = extreme_steps(basin)
+    expected = np.array([low, high, low, high])
+    for method in ('edge', 'hypsometry'):
+        sla, _ = get_snowline_elevation_local(stack, dem, aspect_coded, aoi, aspectKeys=ASPECT_KEYS, method=method)
+        for key in ASPECT_KEYS:
+            np.testing.assert_allclose(sla[key], expected, err_msg=f'{method} {key}')
+    print('Both methods agree on snow-covered and snow-free steps')
+
+    # Seasonal cycle: agreement of the methods and error against the true snowline
+    scores = compare_snowline_methods(basin['scf'], dem, aspect_coded, aoi, aspectKeys=ASPECT_KEYS)
+    days = (np.arange(basin['scf'].shape[0]) + 0.5) * 365 / basin['scf'].shape[0]
+    truth = seasonal_snowline(days)
+    print(f"{'aspect':8s} {'bias':>8s} {'mae':>8s} {'r':>6s} {'edge err':>9s} {'hyps err':>9s}")
+    edge, _ = get_snowline_elevation_local(basin['scf'], dem, aspect_coded, aoi, aspectKeys=ASPECT_KEYS)
+    hyps, _ = get_snowline_elevation_local(basin['scf'], dem, aspect_coded, aoi, aspectKeys=ASPECT_KEYS,
+                                           method='hypsometry')
+    for key in ASPECT_KEYS:
+        s = scores[key]
+        print(f"{key:8s} {s['bias']:8.0f} {s['mae']:8.0f} {s['r']:6.2f} "
+              f"{np.nanmean(np.abs(edge[key] - truth)):9.0f} {np.nanmean(np.abs(hyps[key] - truth)):9.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+"""
+Benchmark suite of the local engines on synthetic basins from 100 km² to 50,000 km².
+
+Every stage is timed per basin size (best of --repeat runs) and the results are written as
+JSON. With --baseline, the run fails (exit code 1) when a stage is slower than the baseline
+by more than --threshold.
+
+Usage:
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/run_benchmarks.py --baseline results.json --threshold 0.25
+    python benchmarks/run_benchmarks.py --sizes 100 1000 --stages snowline_local compositor
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Add the project root directory to Python path
+sys.path.append(str(Path(__file__).absolute().parent.parent))
+
+from benchmarks.bench_gapfill import synthetic_timeseries
+from benchmarks.synthetic import ASPECT_KEYS, DAY_MS, glacier_features, snow_cover, synthetic_basin
+from src.compositor import interpolate_nearest, iter_composites
+from src.gapfill import gapfill_timeseries, prepare_timeseries
+from src.glacier_mask_local import build_glacier_mask_tiles, load_glaciers
+from src.modis_processing import decadal_intervals
+from src.qa_bits import decode_qa
+from src.snowline_local import Hypsometry, get_snowline_elevation_local
+
+DEFAULT_SIZES = [100, 1000, 10000, 50000]
+YEAR = 2021
+YEAR_START_MS = int(datetime.datetime(YEAR, 1, 1, tzinfo=datetime.timezone.utc).timestamp() * 1000)
+
+
+# ---------------------------------------------------------------------------
+# Stages: each returns (function to time, amount of work, unit of the work)
+# ---------------------------------------------------------------------------
+
+def stage_snowline_local(basin):
+    def run():
+        get_snowline_elevation_local(basin['scf'], basin['dem'], basin['aspect_coded'], basin['aoi'],
+                                     aspectKeys=ASPECT_KEYS)
+    return run, basin['scf'].size, 'pixel-steps'
+
+
+def stage_snowline_hypsometry(basin):
+    hypsometry = Hypsometry(basin['dem'], basin['aspect_coded'], basin['aoi'])
+
+    def run():
+        get_snowline_elevation_local(basin['scf'], basin['dem'], basin['aspect_coded'], basin['aoi'],
+                                     aspectKeys=ASPECT_KEYS, method='hypsometry', hypsometry=hypsometry)
+    return run, basin['scf'].size, 'pixel-steps'
+
+
+def stage_snowline_tiled(basin):
+    def run():
+        get_snowline_elevation_local(basin['scf'], basin['dem'], basin['aspect_coded'], basin['aoi'],
+                                     aspectKeys=ASPECT_KEYS, tile_size=256)
+    return run, basin['scf'].size, 'pixel-steps'
+
+
+def _daily_scenes(basin, n_days=365, n_distinct=8):
+    # A few distinct scenes, cycled, so that scene generation does not dominate the timing
+    dem = np.nan_to_num(basin['dem'], nan=1000)
+    distinct = [snow_cover(dem, d * 365 / n_distinct, 0.3, d) for d in range(n_distinct)]
+    return lambda: ((YEAR_START_MS + d * DAY_MS, distinct[d % n_distinct]) for d in range(n_days))
+
+
+def stage_compositor(basin):
+    scenes = _daily_scenes(basin)
+    intervals = decadal_intervals(YEAR, YEAR)
+
+    def run():
+        for _ in iter_composites(scenes(), intervals):
+            pass
+    return run, 365 * basin['dem'].size, 'pixel-days'
+
+
+def stage_interpolate(basin):
+    n_days = 60
+    stack = np.stack([scene for _, scene in _daily_scenes(basin, n_days)()])
+    times = YEAR_START_MS + np.arange(n_days) * DAY_MS
+    intervals = decadal_intervals(YEAR, YEAR)
+
+    def run():
+        interpolate_nearest(stack, times, intervals)
+    return run, stack.size, 'pixel-days'
+
+
+def stage_qa_decode(basin):
+    # QA at 250 m: twice the resolution of the 500 m grid
+    height, width = basin['shape']
+    qa = np.random.default_rng(0).integers(0, 2 ** 16, (10, 2 * height, 2 * width), dtype=np.uint16)
+
+    def run():
+        decode_qa(qa, 'qc_250m')
+    return run, qa.size, 'pixel-days'
+
+
+def stage_glacier_mask(basin):
+    features = glacier_features(np.nan_to_num(basin['dem'], nan=0))
+    directory = tempfile.mkdtemp(prefix='bench_glaciers_')
+    path = os.path.join(directory, 'glaciers.geojson')
+    with open(path, 'w') as f:
+        json.dump({'type': 'FeatureCollection', 'features': features}, f)
+    glaciers = load_glaciers(path)
+
+    def run():
+        build_glacier_mask_tiles(glaciers, os.path.join(directory, 'tiles'), max_workers=1)
+    return run, max(len(features), 1), 'glaciers'
+
+
+def stage_gapfill(basin):
+    # Number of basins proportional to the basin area, as a stand-in for the number of catchments
+    n_basins = max(10, basin['shape'][0] // 2)
+    df = prepare_timeseries(synthetic_timeseries(n_basins))
+
+    def run():
+        gapfill_timeseries(df)
+    return run, len(df), 'records'
+
+
+STAGES = {
+    'snowline_local': stage_snowline_local,
+    'snowline_hypsometry': stage_snowline_hypsometry,
+    'snowline_tiled': stage_snowline_tiled,
+    'compositor': stage_compositor,
+    'interpolate': stage_interpolate,
+    'qa_decode': stage_qa_decode,
+    'glacier_mask': stage_glacier_mask,
+    'gapfill': stage_gapfill,
+}
+
+
+# ---------------------------------------------------------------------------
+# Running and comparing
+# ---------------------------------------------------------------------------
+
+def run_suite(sizes, stages, repeat=3, verbose=True):
+    """
+    Time the stages on synthetic basins of the given sizes.
+
+    Returns:
+        list of result dictionaries (stage, area_km2, seconds, work, unit, throughput)
+    """
+    results = []
+    for area in sizes:
+        basin = synthetic_basin(area)
+        if verbose:
+            print(f'Basin {area} km² ({basin["shape"][0]} x {basin["shape"][1]} pixels)')
+        for name in stages:
+            run, work, unit = STAGES[name](basin)
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                run()
+                timings.append(time.perf_counter() - start)
+            seconds = min(timings)
+            results.append({
+                'stage': name,
+                'area_km2': area,
+                'seconds': seconds,
+                'work': int(work),
+                'unit': unit,
+                'throughput': work / seconds if seconds > 0 else None,
+            })
+            if verbose:
+                print(f'  {name:20s} {seconds:8.3f} s  {work / seconds:12.4g} {unit}/s')
+    return results
+
+
+def compare(results, baseline, threshold, min_delta=0.01):
+    """
+    Stages slower than the baseline by more than threshold (relative) and more than
+    min_delta seconds (to ignore timer noise of very fast stages).
+
+    Returns:
+        list of (stage, area_km2, baseline seconds, seconds)
+    """
+    reference = {(r['stage'], r['area_km2']): r['seconds'] for r in baseline['results']}
+    regressions = []
+    for r in results:
+        before = reference.get((r['stage'], r['area_km2']))
+        if before is not None and r['seconds'] > before * (1 + threshold) and r['seconds'] - before > min_delta:
+            regressions.append((r['stage'], r['area_km2'], before, r['seconds']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=float, nargs='+', default=DEFAULT_SIZES, help='Basin areas in km²')
+    parser.add_argument('--stages', nargs='+', default=list(STAGES), choices=list(STAGES), help='Stages to run')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per stage (the fastest counts)')
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON file of the results')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Allowed slowdown relative to the baseline (0.25 = 25%%)')
+    args = parser.parse_args()
+
+    results = run_suite(args.sizes, args.stages, args.repeat)
+    report = {
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results written to {args.output}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for stage, area, before, after in regressions:
+            print(f'REGRESSION {stage} ({area} km²): {before:.3f} s -> {after:.3f} s')
+        if regressions:
+            sys.exit(1)
+        print(f'No regression beyond {args.threshold:.0%}')
+
+
+if __name__ == '__main__':
+    main()
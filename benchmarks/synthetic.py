@@ -0,0 +1,171 @@
+"""
+Synthetic but realistic inputs for the benchmarks: DEM with ridges and valleys (and hence
+aspect structure), fractional snow cover following a seasonal snowline with clouds, daily
+scenes and MODIS QA values, and glacier outlines on the high terrain, for basins of a given
+area (100 km² to 50,000 km²).
+"""
+import math
+
+import numpy as np
+from scipy import ndimage
+
+ASPECT_KEYS = ['East', 'North', 'South', 'West', 'mixed']
+DAY_MS = 86400000
+
+
+def grid_shape(area_km2, scale=500):
+    """
+    (height, width) of a square grid covering area_km2 at the given pixel size in metres.
+    """
+    side = max(4, int(round(math.sqrt(area_km2 * 1e6) / scale)))
+    return side, side
+
+
+def synthetic_dem(shape, scale=500, seed=0):
+    """
+    Mountain terrain between ~1000 and ~6000 m: smoothed noise at several wavelengths plus a
+    main ridge, so that all aspects occur.
+
+    Returns:
+        (y, x) float array of elevations in metres
+    """
+    rng = np.random.default_rng(seed)
+    height, width = shape
+    dem = np.zeros(shape)
+    for wavelength_km, amplitude in [(40, 1200), (12, 600), (4, 250)]:
+        sigma = wavelength_km * 1000 / scale / 4
+        noise = ndimage.gaussian_filter(rng.normal(size=shape), sigma, mode='wrap')
+        dem += amplitude * noise / (noise.std() or 1)
+    y, x = np.mgrid[0:height, 0:width]
+    ridge = np.exp(-((y - height / 2) / (0.3 * height)) ** 2) * np.exp(-((x - width / 2) / (0.6 * width)) ** 2)
+    dem += 2500 * ridge
+    return np.clip(dem - dem.min() + 1000, 1000, 6500)
+
+
+def aspect_codes(dem, scale=500):
+    """
+    Coded aspect as in classify_aspect: 1-East, 2-North, 3-South, 4-West, 5-mixed (flat).
+    """
+    dzdy, dzdx = np.gradient(dem, scale)
+    # Aspect in degrees clockwise from north (rows increase southwards)
+    aspect = (np.degrees(np.arctan2(-dzdx, dzdy)) + 360) % 360
+    codes = np.full(dem.shape, 5, dtype=np.int8)
+    codes[(aspect > 315) | (aspect <= 45)] = 2
+    codes[(aspect > 45) & (aspect <= 135)] = 1
+    codes[(aspect > 135) & (aspect <= 225)] = 3
+    codes[(aspect > 225) & (aspect <= 315)] = 4
+    codes[np.hypot(dzdx, dzdy) < 1e-3] = 5
+    return codes
+
+
+def basin_mask(shape, seed=0):
+    """
+    Irregular basin outline inside the grid.
+    """
+    rng = np.random.default_rng(seed)
+    height, width = shape
+    y, x = np.mgrid[0:height, 0:width]
+    angle = np.arctan2(y - height / 2, x - width / 2)
+    radius = 0.45 * min(shape) * (1 + 0.15 * np.sin(3 * angle + rng.uniform(0, 6)) + 0.08 * np.sin(7 * angle))
+    return np.hypot(y - height / 2, x - width / 2) <= radius
+
+
+def seasonal_snowline(day_of_year):
+    """
+    Snowline elevation (m) over the year: low in winter, high in late summer.
+    """
+    return 3600 - 1400 * np.cos(2 * np.pi * (np.asarray(day_of_year) - 30) / 365)
+
+
+def snow_cover(dem, day_of_year, cloud_fraction=0.2, seed=0):
+    """
+    Fractional snow cover (0-100) of one day, with a transition zone around the snowline and
+    NaN for cloudy pixels.
+    """
+    rng = np.random.default_rng(seed)
+    snowline = seasonal_snowline(day_of_year)
+    scf = 100 / (1 + np.exp(-(dem - snowline + rng.normal(0, 150, dem.shape)) / 120))
+    clouds = ndimage.gaussian_filter(rng.random(dem.shape), 3) > np.quantile(
+        ndimage.gaussian_filter(rng.random(dem.shape), 3), 1 - cloud_fraction)
+    return np.where(clouds, np.nan, scf)
+
+
+def scf_stack(dem, n_steps=36, cloud_fraction=0.05, seed=0):
+    """
+    Decadal snow cover composites (time, y, x) of one year.
+    """
+    days = (np.arange(n_steps) + 0.5) * 365 / n_steps
+    return np.stack([snow_cover(dem, day, cloud_fraction, seed + i) for i, day in enumerate(days)])
+
+
+def daily_scenes(dem, year_start_ms, n_days=365, cloud_fraction=0.3, seed=0):
+    """
+    Generator of (time_ms, scene) daily snow cover scenes.
+    """
+    for day in range(n_days):
+        yield year_start_ms + day * DAY_MS, snow_cover(dem, day, cloud_fraction, seed + day)
+
+
+def qa_stack(shape, n_days=10, seed=0):
+    """
+    Random uint16 QA values (state_1km / QC_250m like) of n_days scenes.
+    """
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 2 ** 16, (n_days,) + tuple(shape), dtype=np.uint16)
+
+
+def glacier_features(dem, origin=(70.0, 40.0), scale=500, max_glaciers=2000, seed=0):
+    """
+    GeoJSON glacier features (roughly elliptical outlines) on the terrain above 4500 m.
+
+    Args:
+        dem: (y, x) elevation array
+        origin: lon/lat of the upper left corner of the grid
+        scale: Pixel size in metres
+
+    Returns:
+        list of GeoJSON Feature dictionaries with a 'glac_id' property
+    """
+    rng = np.random.default_rng(seed)
+    rows, cols = np.nonzero(dem > 4500)
+    if len(rows) == 0:
+        return []
+    pick = rng.choice(len(rows), size=min(max_glaciers, len(rows)), replace=False)
+    metres_per_degree = 6371007.181 * math.pi / 180
+    lat_scale = scale / metres_per_degree
+    lon_scale = scale / (metres_per_degree * math.cos(math.radians(origin[1])))
+    angles = np.linspace(0, 2 * np.pi, 33)
+    features = []
+    for i, k in enumerate(pick):
+        lon = origin[0] + (cols[k] + 0.5) * lon_scale
+        lat = origin[1] - (rows[k] + 0.5) * lat_scale
+        a, b = rng.uniform(0.2, 2.0), rng.uniform(0.2, 1.0)
+        wobble = 1 + 0.1 * np.sin(5 * angles + rng.uniform(0, 6))
+        ring = np.column_stack([lon + a * lon_scale * wobble * np.cos(angles),
+                                lat + b * lat_scale * wobble * np.sin(angles)])
+        ring[-1] = ring[0]
+        features.append({
+            'type': 'Feature',
+            'properties': {'glac_id': f'G{i:06d}'},
+            'geometry': {'type': 'Polygon', 'coordinates': [ring.tolist()]},
+        })
+    return features
+
+
+def synthetic_basin(area_km2, scale=500, n_steps=36, seed=0):
+    """
+    All inputs of a synthetic basin of the given area.
+
+    Returns:
+        dict with 'dem', 'aspect_coded', 'aoi', 'scf' (time, y, x) and the grid 'shape'
+    """
+    shape = grid_shape(area_km2, scale)
+    dem = synthetic_dem(shape, scale, seed)
+    aoi = basin_mask(shape, seed)
+    return {
+        'shape': shape,
+        'dem': np.where(aoi, dem, np.nan),
+        'aspect_coded': aspect_codes(dem, scale),
+        'aoi': aoi,
+        'scf': scf_stack(dem, n_steps, seed=seed),
+    }
@@ -34,9 +34,15 @@ dem = ee.ImageCollection("JAXA/ALOS/AW3D30/V3_2").select("DSM").mosaic()
 # Example function: fill MODIS gaps using AQUA
 # ---------------------------------------------
 
+# Pair each Terra image with the Aqua image of the same day in one join
+# (daily images are stamped at 00:00 UTC)
+modis_paired = ee.ImageCollection(ee.Join.saveFirst(matchKey='aqua', outer=True).apply(
+    modis_terra, modis_aqua,
+    ee.Filter.equals(leftField='system:time_start', rightField='system:time_start')
+))
+
 def fill_modis_with_aqua(terra_img):
-    date = terra_img.date()
-    aqua_img = modis_aqua.filterDate(date, date.advance(1, 'day')).first()
+    aqua_img = terra_img.get('aqua')
     aqua_ndsi = ee.Image(ee.Algorithms.If(aqua_img, ee.Image(aqua_img).select('NDSI_Snow_Cover'), ee.Image.constant(0)))
     
     terra_ndsi = terra_img.select('NDSI_Snow_Cover')
@@ -49,7 +55,7 @@ def fill_modis_with_aqua(terra_img):
 # Apply the gap-filling function
 # ---------------------------------------------
 
-filled_modis = modis_terra.map(fill_modis_with_aqua)
+filled_modis = modis_paired.map(fill_modis_with_aqua)
 
 # ---------------------------------------------
 # Example visualization on map
@@ -0,0 +1,170 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import ee
+
+from src.dem_processing import load_dem
+from src.export_pipeline import make_sla_export_task
+from src.task_backend import FINAL_STATES, EETaskBackend
+
+# Runs the per-basin work of the notebook loops (composites, DEM analysis, snowline and
+# glacier metrics, export) for many basins in parallel. Basins are fanned out over a process
+# pool whose workers initialise their Earth Engine session once; the number of basins in
+# flight is bounded, every basin is timed, and failed basins are retried at the end of the
+# batch instead of stopping it.
+
+RIVER_BASINS_ASSET = 'users/hydrosolutions/RiverBasins_CA_Jan2023_simple1000'
+GLIMS_AREA = 'Randolph Glacier Inventory; Umbrella RC for merging the RGI into GLIMS'
+
+# Objects built once per worker process (see worker_cached)
+_worker_cache = {}
+
+
+def init_ee_session(project=None):
+    """
+    Worker initializer: open the Earth Engine session of the process.
+    """
+    if project is None:
+        ee.Initialize()
+    else:
+        ee.Initialize(project=project)
+
+
+def worker_cached(factory, *args):
+    """
+    Return factory(*args), built once per worker process.
+    """
+    key = (factory, args)
+    if key not in _worker_cache:
+        _worker_cache[key] = factory(*args)
+    return _worker_cache[key]
+
+
+def _timed_call(job, basin):
+    start = time.perf_counter()
+    result = job(basin)
+    return result, time.perf_counter() - start
+
+
+def run_basins(basins, job, max_workers=4, max_in_flight=None, retries=1, initializer=init_ee_session,
+               initargs=(), executor='process', progress=None, verbose=True):
+    """
+    Run job(basin) for every basin in a pool of workers.
+
+    Args:
+        basins: Basin names (e.g. catchment_names)
+        job: Picklable callable taking a basin name (a top-level function or an ExportJob)
+        max_workers: Number of worker processes
+        max_in_flight: Maximum number of submitted, unfinished basins (default: 2 * max_workers)
+        retries: Number of additional rounds for the basins that failed
+        initializer: Called once in every worker (default: init_ee_session); None for no setup
+        initargs: Arguments of the initializer
+        executor: 'process' or 'thread' (threads share the session of the calling process)
+        progress: Optional callback progress(basin, status, seconds, done, total)
+        verbose: Print a line per finished basin
+
+    Returns:
+        dict with 'results' (basin -> result), 'timings' (basin -> seconds of the last attempt),
+        'failed' (basin -> error message of the last attempt) and 'attempts' (basin -> count)
+    """
+    max_in_flight = max_in_flight or 2 * max_workers
+    summary = {'results': {}, 'timings': {}, 'failed': {}, 'attempts': {}}
+    pending = list(basins)
+    total = len(pending)
+
+    if executor == 'process':
+        pool = ProcessPoolExecutor(max_workers=max_workers, initializer=initializer, initargs=initargs)
+    elif executor == 'thread':
+        pool = ThreadPoolExecutor(max_workers=max_workers, initializer=initializer, initargs=initargs)
+    else:
+        raise ValueError(f"Unknown executor '{executor}'")
+
+    with pool:
+        for attempt in range(retries + 1):
+            queue = pending
+            pending = []
+            in_flight = {}
+            while queue or in_flight:
+                while queue and len(in_flight) < max_in_flight:
+                    basin = queue.pop(0)
+                    summary['attempts'][basin] = summary['attempts'].get(basin, 0) + 1
+                    in_flight[pool.submit(_timed_call, job, basin)] = (basin, time.perf_counter())
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    basin, submitted = in_flight.pop(future)
+                    try:
+                        result, seconds = future.result()
+                    except Exception as e:
+                        seconds = time.perf_counter() - submitted
+                        summary['failed'][basin] = f'{type(e).__name__}: {e}'
+                        summary['timings'][basin] = seconds
+                        pending.append(basin)
+                        status = 'failed'
+                    else:
+                        summary['results'][basin] = result
+                        summary['timings'][basin] = seconds
+                        summary['failed'].pop(basin, None)
+                        status = 'done'
+                    n_done = len(summary['results'])
+                    if progress is not None:
+                        progress(basin, status, seconds, n_done, total)
+                    if verbose:
+                        print(f'[{n_done}/{total}] {basin}: {status} in {seconds:.1f} s'
+                              + (f" ({summary['failed'][basin]})" if status == 'failed' else ''))
+            if not pending:
+                break
+            if verbose and attempt < retries:
+                print(f'Retrying {len(pending)} failed basins')
+    return summary
+
+
+# ---------------------------------------------------------------------------
+# Export jobs
+# ---------------------------------------------------------------------------
+
+class ExportJob:
+    """
+    Per-basin job building the export task of a basin, starting it and waiting for its final
+    state. make_task_factory(*factory_args) must return a function basin -> (task, description);
+    it is called once per worker process, so collections and DEM are built once per worker.
+    With a LocalTaskBackend and a stub factory the runner works without Earth Engine.
+    """
+
+    def __init__(self, make_task_factory, factory_args=(), backend=None, poll_interval=30, timeout=None):
+        self.make_task_factory = make_task_factory
+        self.factory_args = tuple(factory_args)
+        self.backend = backend
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+
+    def __call__(self, basin):
+        make_task = worker_cached(self.make_task_factory, *self.factory_args)
+        backend = self.backend or EETaskBackend()
+        task, description = make_task(basin)
+        task_id = backend.start(task, description)
+
+        start = time.monotonic()
+        while True:
+            state = backend.status([task_id]).get(task_id)
+            if state in FINAL_STATES:
+                break
+            if self.timeout is not None and time.monotonic() - start > self.timeout:
+                raise TimeoutError(f'{description} still {state} after {self.timeout} s')
+            time.sleep(self.poll_interval)
+        if state != 'COMPLETED':
+            raise RuntimeError(f'{description} ended in state {state}')
+        return {'task_id': task_id, 'description': description, 'state': state}
+
+
+def sla_task_factory(asset_folder, year, decades=tuple(range(1, 37)), **kwargs):
+    """
+    make_task_factory for ExportJob exporting the decadal SLA table of one year per basin
+    (see export_pipeline.make_sla_export_task; kwargs are passed on to it), e.g.
+    run_basins(catchment_names, ExportJob(sla_task_factory, (asset_folder, 2024)), max_workers=8).
+    """
+    river_basins = ee.FeatureCollection(RIVER_BASINS_ASSET).map(
+        lambda ft: ft.set('NAME', ee.String(ft.get('BASIN')).cat(ee.String('_')).cat(ee.String(ft.get('CODE')))))
+    glims = ee.FeatureCollection('GLIMS/20230607').filter(ee.Filter.eq('geog_area', GLIMS_AREA))
+    make_task = make_sla_export_task(river_basins, glims, load_dem(), asset_folder, **kwargs)
+    return lambda basin: make_task(basin, year, list(decades))
@@ -0,0 +1,235 @@
+import numpy as np
+
+# Compact array representations for the local path. Snow cover fraction and NDSI values
+# (0-100) are stored as uint8 with SCF_NODATA for masked pixels (1 byte instead of 8 for
+# float64), elevations as int16 metres with DEM_NODATA (2 bytes), and boolean masks such as
+# binary snow or valid observations bit-packed along x (1 bit per pixel) in PackedMask.
+# The compositor, the snowline engine and the local glacier metrics accept these directly
+# and only decode the pixels they sample.
+
+SCF_NODATA = 255
+DEM_NODATA = np.iinfo(np.int16).min
+
+# Number of set bits of every byte value
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, np.newaxis], axis=1).sum(axis=1).astype(np.uint8)
+
+
+# ---------------------------------------------------------------------------
+# Snow cover fraction
+# ---------------------------------------------------------------------------
+
+def encode_scf(values):
+    """
+    Snow cover fraction (0-100, NaN where masked) as uint8, rounded to whole percent, with
+    SCF_NODATA for masked pixels. uint8 input is returned unchanged.
+    """
+    values = np.asarray(values)
+    if values.dtype == np.uint8:
+        return values
+    codes = np.full(values.shape, SCF_NODATA, dtype=np.uint8)
+    valid = ~np.isnan(values)
+    codes[valid] = np.clip(np.rint(values[valid]), 0, 100)
+    return codes
+
+
+def decode_scf(codes, dtype=np.float32):
+    """
+    Float snow cover fraction with NaN for SCF_NODATA (for small selections; the engines
+    work on the codes).
+    """
+    codes = np.asarray(codes)
+    if codes.dtype != np.uint8:
+        return codes.astype(dtype, copy=False)
+    values = codes.astype(dtype)
+    values[codes == SCF_NODATA] = np.nan
+    return values
+
+
+def scf_valid(scf):
+    """
+    Boolean mask of the observed pixels of a uint8 (SCF_NODATA) or float (NaN) array.
+    """
+    scf = np.asarray(scf)
+    if scf.dtype == np.uint8:
+        return scf != SCF_NODATA
+    return ~np.isnan(scf)
+
+
+def scf_above(scf, threshold):
+    """
+    Observed pixels with snow cover above threshold, without converting uint8 codes to
+    float. Rounded codes compare as the rounded fractions.
+    """
+    scf = np.asarray(scf)
+    if scf.dtype == np.uint8:
+        # Thresholds at or above 100 select nothing; the nodata code never counts as snow
+        if threshold >= 100:
+            return np.zeros(scf.shape, dtype=bool)
+        return (scf > threshold) & (scf != SCF_NODATA)
+    with np.errstate(invalid='ignore'):
+        return scf > threshold
+
+
+# ---------------------------------------------------------------------------
+# Elevation
+# ---------------------------------------------------------------------------
+
+def encode_dem(dem):
+    """
+    Elevation as int16 metres with DEM_NODATA where missing (NaN). int16 input is returned
+    unchanged.
+    """
+    dem = np.asarray(dem)
+    if dem.dtype == np.int16:
+        return dem
+    codes = np.full(dem.shape, DEM_NODATA, dtype=np.int16)
+    valid = np.isfinite(dem)
+    codes[valid] = np.clip(np.rint(dem[valid]), DEM_NODATA + 1, np.iinfo(np.int16).max)
+    return codes
+
+
+def decode_dem(dem, dtype=np.float64):
+    """
+    Float elevation with NaN for DEM_NODATA.
+    """
+    dem = np.asarray(dem)
+    if dem.dtype != np.int16:
+        return dem.astype(dtype, copy=False)
+    return np.where(dem == DEM_NODATA, np.nan, dem).astype(dtype)
+
+
+def dem_valid(dem):
+    """
+    Boolean mask of the pixels with elevation of an int16 (DEM_NODATA) or float (NaN) DEM.
+    """
+    dem = np.asarray(dem)
+    if dem.dtype == np.int16:
+        return dem != DEM_NODATA
+    return np.isfinite(dem)
+
+
+# ---------------------------------------------------------------------------
+# Bit-packed masks
+# ---------------------------------------------------------------------------
+
+class PackedMask:
+    """
+    Boolean (..., y, x) array packed to 1 bit per pixel along x (np.packbits). Logical
+    operators work on the packed bytes; single time steps are unpacked on indexing.
+
+    Args:
+        mask: Boolean array to pack
+    """
+
+    def __init__(self, mask):
+        mask = np.asarray(mask, dtype=bool)
+        self.shape = mask.shape
+        self.bits = np.packbits(mask, axis=-1)
+
+    @classmethod
+    def _from_bits(cls, bits, shape):
+        packed = cls.__new__(cls)
+        packed.bits = bits
+        packed.shape = tuple(shape)
+        return packed
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def unpack(self):
+        """
+        The whole boolean array.
+        """
+        return np.unpackbits(self.bits, axis=-1, count=self.shape[-1]).astype(bool)
+
+    def __getitem__(self, index):
+        """
+        Boolean array of the index along the first axis (e.g. one time step), unpacked.
+        """
+        bits = self.bits[index]
+        shape = np.empty(self.shape[:-1] + (1,), dtype=np.uint8)[index].shape[:-1] + self.shape[-1:]
+        return np.unpackbits(bits, axis=-1, count=self.shape[-1]).astype(bool).reshape(shape)
+
+    def count(self, axis=None):
+        """
+        Number of True pixels, in total or per index of the leading axes (axis=(-2, -1)).
+        """
+        counts = _POPCOUNT[self.bits]
+        if axis is None:
+            return int(counts.sum(dtype=np.int64))
+        return counts.sum(axis=axis, dtype=np.int64)
+
+    def _padding(self):
+        # Bits beyond the last column stay 0 after logical operations
+        n_pad = self.bits.shape[-1] * 8 - self.shape[-1]
+        return np.uint8((0xFF << n_pad) & 0xFF)
+
+    def __and__(self, other):
+        return PackedMask._from_bits(self.bits & _bits(other, self.shape), self.shape)
+
+    def __or__(self, other):
+        return PackedMask._from_bits(self.bits | _bits(other, self.shape), self.shape)
+
+    def __invert__(self):
+        bits = ~self.bits
+        bits[..., -1] &= self._padding()
+        return PackedMask._from_bits(bits, self.shape)
+
+    def any(self):
+        return bool(self.bits.any())
+
+
+def _bits(mask, shape):
+    if isinstance(mask, PackedMask):
+        if mask.shape[-2:] != shape[-2:]:
+            raise ValueError(f'Mask shapes {mask.shape} and {shape} do not match')
+        return mask.bits
+    return np.packbits(np.asarray(mask, dtype=bool), axis=-1)
+
+
+def pack_snow(scf, sc_th=50, aoi=None):
+    """
+    Bit-packed binary snow and valid masks of a snow cover stack, built one time step at a
+    time so that no full-size boolean or float stack is created.
+
+    Args:
+        scf: (time, y, x) uint8 or float snow cover fraction
+        sc_th: Snow cover threshold (0-100)
+        aoi: Optional boolean (y, x) area of interest
+
+    Returns:
+        tuple: (snow, valid) PackedMask, snow only on valid pixels
+    """
+    n_time = scf.shape[0]
+    n_bytes = -(-scf.shape[-1] // 8)
+    snow_bits = np.empty((n_time,) + scf.shape[1:-1] + (n_bytes,), dtype=np.uint8)
+    valid_bits = np.empty_like(snow_bits)
+    for t in range(n_time):
+        valid = scf_valid(scf[t])
+        if aoi is not None:
+            valid &= aoi
+        valid_bits[t] = np.packbits(valid, axis=-1)
+        snow_bits[t] = np.packbits(scf_above(scf[t], sc_th) & valid, axis=-1)
+    return PackedMask._from_bits(snow_bits, scf.shape), PackedMask._from_bits(valid_bits, scf.shape)
+
+
+def nbytes_report(n_time, height, width):
+    """
+    Bytes of a (time, y, x) stack per representation: float64, float32, uint8 SCF and a
+    bit-packed mask.
+    """
+    n = n_time * height * width
+    return {
+        'float64': 8 * n,
+        'float32': 4 * n,
+        'uint8': n,
+        'packed': n_time * height * -(-width // 8),
+    }
@@ -0,0 +1,218 @@
+import datetime
+
+import numpy as np
+
+from src.compact import decode_scf, encode_scf, scf_valid
+from src.raster_ops import focal_mean
+from src.tiling import focal_mean_tiled
+
+# Streaming local version of the interval compositing of modis_processing
+# (process_interval / process_interval_250). Daily scenes are consumed one at a time from a
+# generator and added to running sum/count accumulators of the open intervals; a composite is
+# emitted as soon as its interval has closed. Memory use is one scene plus one accumulator
+# pair per open interval (one for the contiguous decadal intervals), independent of the
+# number of days per interval. Masked pixels are NaN throughout, or SCF_NODATA for uint8
+# scenes and composites (compact.py), which are accumulated without converting the scene.
+
+DAY_MS = 86400000
+
+
+def _time_start(start_ms):
+    """
+    system:time_start and Year-Month-Day of a composite: the day of the interval start,
+    as ee.Date.fromYMD(year, month, day) in process_interval.
+    """
+    day_ms = start_ms - start_ms % DAY_MS
+    date = datetime.datetime.fromtimestamp(day_ms / 1000, tz=datetime.timezone.utc)
+    return day_ms, date.strftime('%Y-%m-%d')
+
+
+def _finish(interval, sums, counts, smooth_radius, tile_size=None, compact=False):
+    start, end = interval
+    with np.errstate(invalid='ignore', divide='ignore'):
+        value = np.where(counts > 0, sums / counts, np.nan)
+    if smooth_radius:
+        # Smooth and blend for filling gaps
+        valid = counts > 0
+        if tile_size:
+            smoothed = focal_mean_tiled(value, valid, smooth_radius, tile_size=tile_size)
+        else:
+            smoothed = focal_mean(value, valid, smooth_radius)
+        value = np.where(valid, value, smoothed)
+    if compact:
+        value = encode_scf(value)
+    time_start, ymd = _time_start(start)
+    return {
+        'system:time_start': time_start,
+        'Year-Month-Day': ymd,
+        'start': start,
+        'end': end,
+        'value': value,
+        'count': counts,
+    }
+
+
+def iter_composites(scenes, time_intervals, smooth_radius=2, tile_size=None, compact=False):
+    """
+    Mean composite per interval of a time-ordered stream of daily scenes.
+
+    Args:
+        scenes: Iterable of (time_ms, array) pairs in increasing time order; arrays have
+            the same (y, x) shape and NaN for masked pixels, or uint8 codes with SCF_NODATA
+        time_intervals: (start, end) pairs in milliseconds, e.g. decadal_intervals(...)
+        smooth_radius: Radius in pixels of the focal_mean(...).blend(...) gap smoothing of
+            process_interval; None or 0 for the plain mean of process_interval_250
+        tile_size: Run the gap smoothing in tiles of this size with halos (see tiling.py)
+        compact: Emit the composites as uint8 codes (compact.encode_scf) instead of float64
+
+    Yields:
+        dict with 'system:time_start', 'Year-Month-Day', 'start', 'end', 'value' (composite)
+        and 'count' (number of valid scenes per pixel), in interval order. Intervals without
+        any scene are skipped, like the empty composites filtered out on Earth Engine.
+    """
+    intervals = sorted(time_intervals)
+    next_interval = 0
+    # Open intervals in start order: [interval, sums, counts, n_scenes]
+    open_intervals = []
+    last_time = None
+
+    for time_ms, scene in scenes:
+        if last_time is not None and time_ms < last_time:
+            raise ValueError('Scenes must be ordered by time')
+        last_time = time_ms
+
+        # Emit the intervals that have closed
+        while open_intervals and open_intervals[0][0][1] <= time_ms:
+            interval, sums, counts, n_scenes = open_intervals.pop(0)
+            if n_scenes:
+                yield _finish(interval, sums, counts, smooth_radius, tile_size, compact)
+
+        # Open the intervals that have started (skipping those that are already over)
+        while next_interval < len(intervals) and intervals[next_interval][0] <= time_ms:
+            interval = intervals[next_interval]
+            next_interval += 1
+            if interval[1] > time_ms:
+                open_intervals.append([interval, None, None, 0])
+
+        if not open_intervals:
+            continue
+        scene = np.asarray(scene)
+        valid = scf_valid(scene)
+        for entry in open_intervals:
+            if not entry[0][0] <= time_ms < entry[0][1]:
+                continue
+            if entry[1] is None:
+                entry[1] = np.zeros(scene.shape, dtype=np.float64)
+                entry[2] = np.zeros(scene.shape, dtype=np.int32)
+            np.add(entry[1], scene, out=entry[1], where=valid)
+            entry[2] += valid
+            entry[3] += 1
+
+    for interval, sums, counts, n_scenes in open_intervals:
+        if n_scenes:
+            yield _finish(interval, sums, counts, smooth_radius, tile_size, compact)
+
+
+def interpolate_nearest(stack, times, time_intervals=None, window_days=5):
+    """
+    Local counterpart of interpolate_window for a whole daily stack at once: every pixel is
+    the mean of its nearest valid observation at or before and at or after its date. The
+    neighbours are found for all days in one pass with running maximum/minimum of the valid
+    day indices. With time_intervals, neighbours are searched up to window_days beyond the
+    bounds of the interval of the day (as on Earth Engine); otherwise up to window_days
+    around the day.
+
+    Args:
+        stack: (time, y, x) array of daily scenes with NaN for masked pixels, or uint8 codes
+            with SCF_NODATA (neighbours are found on the codes; only the gathered values are
+            decoded, as the result holds means of two scenes)
+        times: Scene times in milliseconds, increasing
+        time_intervals: Optional (start, end) pairs in milliseconds, e.g. decadal_intervals(...)
+        window_days: Search window in days
+
+    Returns:
+        (time, y, x) float64 array (float32 for uint8 input), NaN where one of the two
+        neighbours is missing
+    """
+    stack = np.asarray(stack)
+    if stack.dtype != np.uint8:
+        stack = stack.astype(np.float64, copy=False)
+    times = np.asarray(times, dtype=np.int64)
+    n = len(times)
+    window = window_days * DAY_MS
+
+    # Search bounds of every day
+    lower = times - window
+    upper = times + window + 1
+    if time_intervals is not None:
+        for start, end in time_intervals:
+            in_interval = (times >= start) & (times < end)
+            lower[in_interval] = start - window
+            upper[in_interval] = end + window
+
+    valid = scf_valid(stack)
+    # Smallest index type for the running maximum/minimum of the day indices
+    index_dtype = np.int16 if n < np.iinfo(np.int16).max else np.int32
+    index = np.arange(n, dtype=index_dtype).reshape((n,) + (1,) * (stack.ndim - 1))
+    prev_idx = np.maximum.accumulate(np.where(valid, index, -1), axis=0)
+    next_idx = np.minimum.accumulate(np.where(valid, index, n)[::-1], axis=0)[::-1]
+
+    has_prev = prev_idx >= 0
+    has_next = next_idx < n
+    prev_idx = np.where(has_prev, prev_idx, 0)
+    next_idx = np.where(has_next, next_idx, 0)
+    shape = (n,) + (1,) * (stack.ndim - 1)
+    # Window bounds as day indices (times are increasing), compared without gathering times
+    has_prev &= prev_idx >= np.searchsorted(times, lower).astype(index_dtype).reshape(shape)
+    has_next &= next_idx < np.searchsorted(times, upper).astype(index_dtype).reshape(shape)
+
+    prev_val = np.take_along_axis(stack, prev_idx, axis=0)
+    next_val = np.take_along_axis(stack, next_idx, axis=0)
+    if stack.dtype == np.uint8:
+        prev_val, next_val = decode_scf(prev_val), decode_scf(next_val)
+    # Mean of the two neighbours, in place
+    prev_val += next_val
+    prev_val /= 2
+    prev_val[~(has_prev & has_next)] = np.nan
+    return prev_val
+
+
+def fill_with_aqua(terra_scenes, aqua_scenes):
+    """
+    Pair two time-ordered scene streams by day and fill masked Terra pixels with the Aqua
+    scene of the same day (local counterpart of fill_modis_with_aqua_paired). Days without a
+    Terra scene are skipped, as on Earth Engine where Terra drives the pairing.
+
+    Args:
+        terra_scenes: Iterable of (time_ms, array) pairs in increasing time order (NaN or
+            SCF_NODATA for masked pixels)
+        aqua_scenes: Iterable of (time_ms, array) pairs in increasing time order, of the same
+            dtype as the Terra scenes
+
+    Yields:
+        (time_ms, array) pairs of gap-filled Terra scenes
+    """
+    aqua_iter = iter(aqua_scenes)
+    aqua = next(aqua_iter, None)
+    for time_ms, terra in terra_scenes:
+        day = time_ms // DAY_MS
+        while aqua is not None and aqua[0] // DAY_MS < day:
+            aqua = next(aqua_iter, None)
+        if aqua is not None and aqua[0] // DAY_MS == day:
+            terra = np.where(scf_valid(terra), terra, aqua[1])
+        yield time_ms, terra
+
+
+def composite_stack(scenes, time_intervals, smooth_radius=2):
+    """
+    Collect the composites of iter_composites into a (time, y, x) stack (the output is held
+    in memory, the daily scenes are not).
+
+    Returns:
+        tuple: (list of system:time_start in milliseconds, stack)
+    """
+    times, stack = [], []
+    for composite in iter_composites(scenes, time_intervals, smooth_radius):
+        times.append(composite['system:time_start'])
+        stack.append(composite['value'])
+    return times, np.stack(stack) if stack else np.empty((0, 0, 0))
@@ -0,0 +1,371 @@
+import json
+import os
+import re
+
+import ee
+import numpy as np
+
+from src.compact import SCF_NODATA, encode_scf
+from src.modis_processing import create_decadal_composites, create_decadal_composites_250
+
+# Local store of the decadal MODIS composites of a basin as (time, y, x) cubes, so that
+# snowline and glacier metric reruns read the composites from disk instead of recomputing
+# them on Earth Engine. Layout: <root>/<basin>/<product>/cube.json (shape, chunking, times,
+# pixel grid) plus one .npy file per (time, y, x) chunk. Chunks are memory-mapped, so a
+# read that falls inside one chunk returns a view of the file without copying.
+# Snow cover cubes can be stored as uint8 (compact.encode_scf, SCF_NODATA for masked pixels),
+# an eighth of float64, which the local engines read without decoding.
+
+DEFAULT_CHUNKS = (36, 256, 256)
+
+# Value used for masked pixels in the downloaded arrays
+NODATA = -9999
+
+
+def cube_path(root, basin, product):
+    """
+    Directory of the cube of a basin and product (e.g. 'scf_500' or 'nir_250').
+    """
+    return os.path.join(root, re.sub(r'[^A-Za-z0-9_.-]', '_', str(basin)), product)
+
+
+def rescale_grid(grid, scale):
+    """
+    computePixels grid with the same origin and extent as `grid` at another scale
+    (e.g. the 250 m grid of a 500 m DEM cache grid).
+    """
+    transform = grid['affineTransform']
+    factor = transform['scaleX'] / scale
+    grid = json.loads(json.dumps(grid))
+    grid['affineTransform'].update(scaleX=scale, scaleY=-scale)
+    grid['dimensions'] = {
+        'width': int(round(grid['dimensions']['width'] * factor)),
+        'height': int(round(grid['dimensions']['height'] * factor)),
+    }
+    return grid
+
+
+def _window_grid(grid, y0, x0, height, width):
+    """
+    Sub-grid of `grid` starting at pixel (y0, x0).
+    """
+    window = json.loads(json.dumps(grid))
+    transform = window['affineTransform']
+    transform['translateX'] += x0 * transform['scaleX']
+    transform['translateY'] += y0 * transform['scaleY']
+    window['dimensions'] = {'width': width, 'height': height}
+    return window
+
+
+def _as_slice(index, size):
+    if isinstance(index, (int, np.integer)):
+        index = slice(index, index + 1)
+    start, stop, step = index.indices(size)
+    if step != 1:
+        raise ValueError('Cube reads only support contiguous slices')
+    return start, max(start, stop)
+
+
+class DataCube:
+    """
+    Chunked, memory-mapped (time, y, x) array on disk.
+
+    Use DataCube.create to make a new cube and DataCube(path) to open an existing one.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'cube.json')) as f:
+            self.meta = json.load(f)
+        self.shape = tuple(self.meta['shape'])
+        self.chunks = tuple(self.meta['chunks'])
+        self.dtype = np.dtype(self.meta['dtype'])
+        self.fill_value = self.meta['fill_value']
+        self.times = self.meta.get('times')
+        self.grid = self.meta.get('grid')
+        self._open_chunks = {}
+
+    @classmethod
+    def create(cls, path, shape, chunks=DEFAULT_CHUNKS, dtype='float32', times=None, grid=None,
+               fill_value=np.nan, attrs=None):
+        """
+        Create an empty cube (no chunk is written until data is).
+
+        Args:
+            path: Directory of the cube
+            shape: (time, y, x) shape
+            chunks: (time, y, x) chunk shape
+            dtype: Data type of the values
+            times: Optional list of image times (system:time_start in milliseconds)
+            grid: Optional computePixels grid of the (y, x) plane
+            fill_value: Value of pixels that were never written
+            attrs: Optional dictionary of additional metadata
+
+        Returns:
+            DataCube
+        """
+        os.makedirs(path, exist_ok=True)
+        meta = {
+            'shape': [int(n) for n in shape],
+            'chunks': [int(min(c, n)) if n else int(c) for c, n in zip(chunks, shape)],
+            'dtype': np.dtype(dtype).str,
+            'fill_value': None if fill_value is None or np.isnan(fill_value) else fill_value,
+            'times': times,
+            'grid': grid,
+            'attrs': attrs or {},
+        }
+        with open(os.path.join(path, 'cube.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+        return cls(path)
+
+    # -----------------------------------------------------------------------
+    # Chunks
+    # -----------------------------------------------------------------------
+
+    @property
+    def n_chunks(self):
+        return tuple(-(-n // c) for n, c in zip(self.shape, self.chunks))
+
+    def chunk_bounds(self, index):
+        """
+        (start, stop) per axis of the chunk with index (ti, yi, xi).
+        """
+        return tuple((i * c, min((i + 1) * c, n)) for i, c, n in zip(index, self.chunks, self.shape))
+
+    def _chunk_file(self, index):
+        return os.path.join(self.path, 't{}_y{}_x{}.npy'.format(*index))
+
+    def has_chunk(self, index):
+        return os.path.exists(self._chunk_file(index))
+
+    def chunk(self, index):
+        """
+        Read-only memory map of a chunk, or None if the chunk was never written.
+        """
+        if index not in self._open_chunks:
+            if not self.has_chunk(index):
+                return None
+            self._open_chunks[index] = np.load(self._chunk_file(index), mmap_mode='r')
+        return self._open_chunks[index]
+
+    def iter_chunks(self):
+        """
+        Iterate over all chunk indices in (t, y, x) order.
+        """
+        return np.ndindex(*self.n_chunks)
+
+    def _missing(self, shape):
+        fill = np.nan if self.fill_value is None else self.fill_value
+        return np.full(shape, fill, dtype=self.dtype)
+
+    # -----------------------------------------------------------------------
+    # Read / write
+    # -----------------------------------------------------------------------
+
+    def write(self, data, t0=0, y0=0, x0=0):
+        """
+        Write a (time, y, x) block starting at (t0, y0, x0).
+        """
+        data = np.asarray(data, dtype=self.dtype)
+        lo = (t0, y0, x0)
+        hi = tuple(a + n for a, n in zip(lo, data.shape))
+        if any(h > n for h, n in zip(hi, self.shape)):
+            raise ValueError(f'Block {lo}-{hi} exceeds the cube shape {self.shape}')
+
+        first = tuple(a // c for a, c in zip(lo, self.chunks))
+        last = tuple((h - 1) // c for h, c in zip(hi, self.chunks))
+        for index in np.ndindex(*(b - a + 1 for a, b in zip(first, last))):
+            index = tuple(a + i for a, i in zip(first, index))
+            bounds = self.chunk_bounds(index)
+            shape = tuple(b - a for a, b in bounds)
+            file = self._chunk_file(index)
+            if os.path.exists(file):
+                target = np.load(file, mmap_mode='r+')
+            else:
+                target = np.lib.format.open_memmap(file, mode='w+', dtype=self.dtype, shape=shape)
+                target[...] = self._missing(shape)
+            src = tuple(slice(max(a, l) - l, min(b, h) - l) for (a, b), l, h in zip(bounds, lo, hi))
+            dst = tuple(slice(max(a, l) - a, min(b, h) - a) for (a, b), l, h in zip(bounds, lo, hi))
+            target[dst] = data[src]
+            target.flush()
+            del target
+            self._open_chunks.pop(index, None)
+
+    def read(self, t=slice(None), y=slice(None), x=slice(None)):
+        """
+        Read a block of the cube. A block inside a single chunk is returned as a read-only
+        view of the memory-mapped chunk (no copy); a block spanning several chunks is
+        assembled into a new array.
+
+        Args:
+            t, y, x: Integer or contiguous slice per axis
+
+        Returns:
+            (time, y, x) array
+        """
+        lo, hi = zip(*(_as_slice(i, n) for i, n in zip((t, y, x), self.shape)))
+        first = tuple(a // c for a, c in zip(lo, self.chunks))
+        last = tuple(max(a, h - 1) // c for a, h, c in zip(lo, hi, self.chunks))
+
+        if first == last:
+            chunk = self.chunk(first)
+            region = tuple(slice(a - i * c, h - i * c) for a, h, i, c in zip(lo, hi, first, self.chunks))
+            if chunk is None:
+                return self._missing(tuple(h - a for a, h in zip(lo, hi)))
+            return chunk[region]
+
+        out = self._missing(tuple(h - a for a, h in zip(lo, hi)))
+        for index in np.ndindex(*(b - a + 1 for a, b in zip(first, last))):
+            index = tuple(a + i for a, i in zip(first, index))
+            chunk = self.chunk(index)
+            if chunk is None:
+                continue
+            bounds = self.chunk_bounds(index)
+            src = tuple(slice(max(a, l) - a, min(b, h) - a) for (a, b), l, h in zip(bounds, lo, hi))
+            dst = tuple(slice(max(a, l) - l, min(b, h) - l) for (a, b), l, h in zip(bounds, lo, hi))
+            out[dst] = chunk[src]
+        return out
+
+    def extend_times(self, times):
+        """
+        Append time steps to the cube. The new times must continue the cube's times; chunk
+        files of a last, partial time chunk are removed so that they are downloaded again
+        with the new steps.
+
+        Args:
+            times: All image times of the extended cube (system:time_start in milliseconds)
+        """
+        times = list(times)
+        n_old = self.shape[0]
+        if self.times is None or times[:n_old] != list(self.times):
+            raise ValueError(f'Times do not extend the times of the cube at {self.path}')
+        if len(times) == n_old:
+            return
+        if n_old % self.chunks[0]:
+            for index in self.iter_chunks():
+                if index[0] == n_old // self.chunks[0] and self.has_chunk(index):
+                    os.remove(self._chunk_file(index))
+        self._open_chunks = {}
+        self.meta['shape'][0] = len(times)
+        self.meta['times'] = times
+        with open(os.path.join(self.path, 'cube.json'), 'w') as f:
+            json.dump(self.meta, f, indent=2)
+        self.shape = tuple(self.meta['shape'])
+        self.times = times
+
+
+# ---------------------------------------------------------------------------
+# Filling cubes from Earth Engine
+# ---------------------------------------------------------------------------
+
+def fill_cube_from_collection(cube, collection, band='value', overwrite=False, verbose=False):
+    """
+    Download an image collection into a cube, one computePixels request per chunk.
+    Chunks already on disk are skipped unless overwrite is set, so an interrupted fill
+    can be resumed.
+
+    Args:
+        cube: DataCube whose times and grid match the collection (uint8 cubes store the
+            values as compact.encode_scf codes)
+        collection: ee.ImageCollection with one image per cube time step
+        band: Band to store
+        overwrite: Download chunks that already exist
+        verbose: Print progress
+
+    Returns:
+        int: Number of downloaded chunks
+    """
+    images = collection.select([band]).toList(cube.shape[0])
+    downloaded = 0
+    for index in cube.iter_chunks():
+        if cube.has_chunk(index) and not overwrite:
+            continue
+        (t0, t1), (y0, y1), (x0, x1) = cube.chunk_bounds(index)
+        stack = ee.ImageCollection(images.slice(t0, t1)).toBands().unmask(NODATA).toFloat()
+        pixels = ee.data.computePixels({
+            'expression': stack,
+            'fileFormat': 'NUMPY_NDARRAY',
+            'grid': _window_grid(cube.grid, y0, x0, y1 - y0, x1 - x0),
+        })
+        data = np.stack([np.asarray(pixels[name], dtype=np.float64) for name in pixels.dtype.names])
+        data = np.where(data == NODATA, np.nan, data)
+        cube.write(encode_scf(data) if cube.dtype == np.uint8 else data, t0, y0, x0)
+        downloaded += 1
+        if verbose:
+            print(f'  Chunk {index} of {cube.n_chunks} written to {cube.path}')
+    return downloaded
+
+
+def build_cube(path, collection, grid, band='value', chunks=DEFAULT_CHUNKS, dtype='float32', fill_value=np.nan,
+               verbose=False):
+    """
+    Open the cube at path, or create it for the images of collection, and download the
+    missing chunks. An existing cube must hold the same grid and data type and its times
+    must be the first times of the collection; new composites (e.g. decades added since the
+    last run) are appended. Any other collection raises a ValueError, since the chunks are
+    filled by position.
+
+    Args:
+        path: Directory of the cube
+        collection: ee.ImageCollection of composites
+        grid: computePixels grid of the cube
+        band: Band to store
+        chunks: (time, y, x) chunk shape
+        dtype: Data type of a new cube ('uint8' for compact snow cover)
+        fill_value: Value of pixels that were never written (SCF_NODATA for uint8)
+        verbose: Print progress
+
+    Returns:
+        DataCube
+    """
+    times = collection.aggregate_array('system:time_start').getInfo()
+    shape = (len(times), grid['dimensions']['height'], grid['dimensions']['width'])
+    if os.path.exists(os.path.join(path, 'cube.json')):
+        cube = DataCube(path)
+        if cube.shape[1:] != shape[1:] or cube.dtype != np.dtype(dtype):
+            raise ValueError(f'Cube at {path} has shape {cube.shape} and dtype {cube.dtype}, '
+                             f'expected {shape[1:]} pixels of {np.dtype(dtype)}')
+        cube.extend_times(times)
+    else:
+        cube = DataCube.create(path, shape, chunks, dtype=dtype, times=times, grid=grid, fill_value=fill_value,
+                               attrs={'band': band})
+    fill_cube_from_collection(cube, collection, band, verbose=verbose)
+    return cube
+
+
+def build_basin_cubes(root, basin, aoi, start_year, end_year, grid, glacier_mask=None, time_intervals=None,
+                      chunks=DEFAULT_CHUNKS, compact=False, verbose=False):
+    """
+    Store the decadal composites of a basin: 500 m snow cover ('scf_500', from
+    create_decadal_composites) and 250 m NIR reflectance ('nir_250', from
+    create_decadal_composites_250).
+
+    Args:
+        root: Root directory of the cube store
+        basin: Basin identifier
+        aoi: Area of interest as an ee.Geometry
+        start_year: Starting year
+        end_year: Ending year
+        grid: 500 m computePixels grid, e.g. the 'grid' of the basin's DEM cache entry, so that
+            the snow cover cube lines up with the cached DEM arrays
+        glacier_mask: Glacier mask passed to create_decadal_composites_250
+        time_intervals: Optional (start, end) pairs in milliseconds
+        chunks: (time, y, x) chunk shape of the 500 m cube (the 250 m cube uses twice the
+            spatial chunk size)
+        compact: Store the snow cover as uint8 codes (see compact.py) instead of float32
+        verbose: Print progress
+
+    Returns:
+        dict: product name -> DataCube
+    """
+    scf = create_decadal_composites(aoi, start_year, end_year, time_intervals=time_intervals)
+    nir = create_decadal_composites_250(aoi, start_year, end_year, glacier_mask=glacier_mask,
+                                        time_intervals=time_intervals)
+    chunks_250 = (chunks[0], chunks[1] * 2, chunks[2] * 2)
+    scf_storage = {'dtype': 'uint8', 'fill_value': SCF_NODATA} if compact else {}
+    return {
+        'scf_500': build_cube(cube_path(root, basin, 'scf_500'), scf, grid, chunks=chunks, verbose=verbose,
+                              **scf_storage),
+        'nir_250': build_cube(cube_path(root, basin, 'nir_250'), nir, rescale_grid(grid, 250),
+                              chunks=chunks_250, verbose=verbose),
+    }
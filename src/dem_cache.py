@@ -0,0 +1,283 @@
+import hashlib
+import json
+import os
+import re
+
+import ee
+import numpy as np
+
+from src.compact import encode_dem
+from src.dem_processing import DEM_VERSION, analyze_dem_stats, classify_aspect, load_dem, reproject_dem
+from src.snowline_local import Hypsometry
+
+# On-disk cache of the static DEM products of a basin (reprojected DEM, aspect bands,
+# coded aspect and min/max/count statistics). The products only depend on the basin,
+# the target projection and scale, and the DEM version, so they are computed once and
+# reused by all later runs. Layout: <cache_dir>/<basin>/<key>.json (statistics and grid)
+# plus <key>.npz (pixel arrays for the local path).
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'glaciermapper-ca', 'dem')
+
+# Value used for masked pixels in the downloaded arrays
+NODATA = -9999
+
+
+def _basin_dir(cache_dir, basin):
+    return os.path.join(cache_dir, re.sub(r'[^A-Za-z0-9_.-]', '_', str(basin)))
+
+
+def dem_cache_key(projection_info, scale, dem_version=DEM_VERSION):
+    """
+    Cache key for a projection (as returned by ee.Projection.getInfo()), scale and DEM version.
+    """
+    identity = {
+        'crs': projection_info.get('crs', projection_info.get('wkt')),
+        'transform': projection_info.get('transform'),
+        'scale': scale,
+        'dem_version': dem_version,
+    }
+    return hashlib.sha1(json.dumps(identity, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def _build_products(aoi, modis_projection, scale, dem_version):
+    """
+    Earth Engine expressions of the DEM products. Building them does not trigger any computation.
+    """
+    dem = load_dem(dem_version)
+    reprojected_dem = reproject_dem(dem, modis_projection, scale)
+    aspects, aspect_coded = classify_aspect(dem, modis_projection, scale)
+    return dem, reprojected_dem, aspects, aspect_coded
+
+
+def _pixel_grid(projection_info, bounds, scale):
+    """
+    computePixels grid covering the AOI bounds (in projection units), aligned with the
+    origin of the projection transform, at the given scale.
+    """
+    transform = projection_info.get('transform') or [scale, 0, 0, 0, -scale, 0]
+    xs = [c[0] for c in bounds]
+    ys = [c[1] for c in bounds]
+    x0 = transform[2] + np.floor((min(xs) - transform[2]) / scale) * scale
+    y0 = transform[5] - np.floor((transform[5] - max(ys)) / scale) * scale
+    grid = {
+        'dimensions': {
+            'width': int(np.ceil((max(xs) - x0) / scale)),
+            'height': int(np.ceil((y0 - min(ys)) / scale)),
+        },
+        'affineTransform': {
+            'scaleX': scale, 'shearX': 0, 'translateX': float(x0),
+            'shearY': 0, 'scaleY': -scale, 'translateY': float(y0),
+        },
+    }
+    if projection_info.get('crs'):
+        grid['crsCode'] = projection_info['crs']
+    else:
+        grid['crsWkt'] = projection_info['wkt']
+    return grid
+
+
+def _download_arrays(aoi, reprojected_dem, aspects, aspect_coded, grid):
+    """
+    Download the DEM products on the given grid as NumPy arrays (one request).
+    """
+    image = reprojected_dem.select([0], ['DSM']) \
+        .addBands(aspects.select(['North', 'East', 'South', 'West'])) \
+        .addBands(aspect_coded.rename('aspect_coded')) \
+        .addBands(ee.Image.constant(1).clip(aoi).rename('aoi')) \
+        .unmask(NODATA).toFloat()
+    pixels = ee.data.computePixels({
+        'expression': image,
+        'fileFormat': 'NUMPY_NDARRAY',
+        'grid': grid,
+    })
+    arrays = {}
+    for name in pixels.dtype.names:
+        band = np.asarray(pixels[name], dtype=np.float64)
+        arrays[name] = np.where(band == NODATA, np.nan, band)
+    arrays['aoi'] = arrays['aoi'] == 1
+    arrays['aspect_coded'] = np.nan_to_num(arrays['aspect_coded'], nan=0).astype(np.int8)
+    return arrays
+
+
+def get_dem_products(basin, aoi, modis_projection, scale, tile_scale, aspect_keys, dem_version=DEM_VERSION,
+                     cache_dir=DEFAULT_CACHE_DIR, download_arrays=True):
+    """
+    Cached replacement for reproject_and_analyze_dem + classify_aspect.
+    On the first call for a basin the min/max/count statistics are computed with one combined
+    reduction and, if requested, the reprojected DEM, aspect bands and aspect_coded are downloaded
+    to disk. Later calls return the statistics as constants, so no reduction is sent again.
+
+    Args:
+        basin: Basin identifier, e.g. the NAME property of the river basins
+        aoi: Area of interest as Earth Engine Geometry
+        modis_projection: Projection object from MODIS imagery
+        scale: Scale for DEM processing in meters
+        tile_scale: Tile scale parameter for Earth Engine processing
+        aspect_keys: List of aspect categories
+        dem_version: AW3D30 version, part of the cache key
+        cache_dir: Root directory of the cache
+        download_arrays: Also store the products as arrays for the local path
+
+    Returns:
+        tuple: (reprojected_dem, min_dem_dict, max_dem_dict, n_grid, aspects, aspect_coded)
+    """
+    entry = load_dem_cache_entry(basin, aoi, modis_projection, scale, tile_scale, dem_version, cache_dir,
+                                 download_arrays)
+    _, reprojected_dem, aspects, aspect_coded = _build_products(aoi, modis_projection, scale, dem_version)
+
+    min_dem_dict = ee.Dictionary.fromLists(aspect_keys, [entry['min']] * len(aspect_keys))
+    max_dem_dict = ee.Dictionary.fromLists(aspect_keys, [entry['max']] * len(aspect_keys))
+    n_grid = ee.Number(entry['count'])
+    return reprojected_dem, min_dem_dict, max_dem_dict, n_grid, aspects, aspect_coded
+
+
+def load_dem_cache_entry(basin, aoi, modis_projection, scale, tile_scale=1, dem_version=DEM_VERSION,
+                         cache_dir=DEFAULT_CACHE_DIR, download_arrays=True):
+    """
+    Return the cache entry of a basin, computing and storing it if missing or stale.
+
+    Args:
+        basin: Basin identifier
+        aoi: Area of interest as Earth Engine Geometry
+        modis_projection: ee.Projection, or its getInfo() dictionary to avoid a round-trip
+        scale: Scale for DEM processing in meters
+        tile_scale: Tile scale parameter for Earth Engine processing
+        dem_version: AW3D30 version
+        cache_dir: Root directory of the cache
+        download_arrays: Also store the products as arrays for the local path
+
+    Returns:
+        dict with 'min', 'max', 'count', 'grid', 'dem_version' and, if stored, the path of the arrays ('arrays')
+    """
+    if isinstance(modis_projection, dict):
+        projection_info = modis_projection
+        modis_projection = ee.Projection(projection_info.get('crs', projection_info.get('wkt')),
+                                         projection_info.get('transform'))
+    else:
+        projection_info = modis_projection.getInfo()
+
+    key = dem_cache_key(projection_info, scale, dem_version)
+    basin_dir = _basin_dir(cache_dir, basin)
+    json_path = os.path.join(basin_dir, f'{key}.json')
+    npz_path = os.path.join(basin_dir, f'{key}.npz')
+
+    entry = None
+    if os.path.exists(json_path):
+        with open(json_path) as f:
+            entry = json.load(f)
+        if entry.get('dem_version') != dem_version:
+            entry = None
+    if entry is not None and (not download_arrays or os.path.exists(npz_path)):
+        return entry
+
+    _, reprojected_dem, aspects, aspect_coded = _build_products(aoi, modis_projection, scale, dem_version)
+
+    if entry is None:
+        # Statistics and AOI bounds in one round-trip
+        info = ee.Dictionary({
+            'stats': analyze_dem_stats(reprojected_dem, aoi, scale, tile_scale),
+            'bounds': aoi.bounds(1, ee.Projection(modis_projection.crs())).coordinates().get(0),
+        }).getInfo()
+        entry = {
+            'basin': str(basin),
+            'dem_version': dem_version,
+            'scale': scale,
+            'projection': projection_info,
+            'min': info['stats']['min'],
+            'max': info['stats']['max'],
+            'count': info['stats']['count'],
+            'grid': _pixel_grid(projection_info, info['bounds'], scale),
+        }
+
+    os.makedirs(basin_dir, exist_ok=True)
+    if download_arrays:
+        arrays = _download_arrays(aoi, reprojected_dem, aspects, aspect_coded, entry['grid'])
+        np.savez_compressed(npz_path, **arrays)
+        entry['arrays'] = npz_path
+
+    with open(json_path, 'w') as f:
+        json.dump(entry, f, indent=2)
+    return entry
+
+
+def load_dem_arrays(entry, compact=False):
+    """
+    Load the cached arrays of an entry returned by load_dem_cache_entry.
+
+    Args:
+        entry: Entry returned by load_dem_cache_entry (with download_arrays=True)
+        compact: Return the DSM as int16 metres (compact.encode_dem) and the aspect bands as
+            booleans instead of float64
+
+    Returns:
+        dict with 'DSM', 'North', 'East', 'South', 'West', 'aspect_coded' and 'aoi' arrays
+    """
+    with np.load(entry['arrays']) as data:
+        arrays = {name: data[name] for name in data.files}
+    if compact:
+        arrays['DSM'] = encode_dem(arrays['DSM'])
+        for name in ('North', 'East', 'South', 'West'):
+            if name in arrays:
+                arrays[name] = arrays[name] == 1
+    return arrays
+
+
+def load_hypsometry(entry, bin_size=50):
+    """
+    Hypsometry (pixel counts by aspect and elevation bin) of a cache entry with arrays,
+    computed on first use and stored next to the arrays as <key>_hypsometry_<bin_size>.npz.
+
+    Args:
+        entry: Entry returned by load_dem_cache_entry (with download_arrays=True)
+        bin_size: Elevation bin size in meters
+
+    Returns:
+        Hypsometry for get_snowline_elevation_local(..., method='hypsometry')
+    """
+    path = entry['arrays'].replace('.npz', f'_hypsometry_{bin_size:g}.npz')
+    if os.path.exists(path):
+        return Hypsometry.load(path)
+    arrays = load_dem_arrays(entry)
+    hypsometry = Hypsometry(arrays['DSM'], arrays['aspect_coded'], arrays['aoi'], bin_size)
+    hypsometry.save(path)
+    return hypsometry
+
+
+def invalidate_dem_cache(cache_dir=DEFAULT_CACHE_DIR, keep_version=None, basin=None):
+    """
+    Remove cache entries. Call with keep_version=DEM_VERSION after switching the DEM version
+    (e.g. from AW3D30 V3_2 to V4_1) to drop all entries built from another version.
+
+    Args:
+        cache_dir: Root directory of the cache
+        keep_version: If given, only entries of other DEM versions are removed
+        basin: If given, only entries of this basin are considered
+
+    Returns:
+        int: Number of removed entries
+    """
+    if not os.path.isdir(cache_dir):
+        return 0
+    basin_dirs = [_basin_dir(cache_dir, basin)] if basin is not None else \
+        [os.path.join(cache_dir, d) for d in os.listdir(cache_dir)]
+
+    removed = 0
+    for basin_dir in basin_dirs:
+        if not os.path.isdir(basin_dir):
+            continue
+        for name in os.listdir(basin_dir):
+            if not name.endswith('.json'):
+                continue
+            json_path = os.path.join(basin_dir, name)
+            with open(json_path) as f:
+                version = json.load(f).get('dem_version')
+            if keep_version is not None and version == keep_version:
+                continue
+            os.remove(json_path)
+            key = name[:-len('.json')]
+            for other in os.listdir(basin_dir):
+                # Arrays and derived hypsometries of the entry
+                if other == f'{key}.npz' or other.startswith(f'{key}_hypsometry_'):
+                    os.remove(os.path.join(basin_dir, other))
+            removed += 1
+    return removed
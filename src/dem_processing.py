@@ -1,10 +1,16 @@
 import ee
 
-def load_dem():
+# Version of the ALOS AW3D30 DSM used throughout the project
+DEM_VERSION = 'V4_1'
+
+def load_dem(version=DEM_VERSION):
     """
     Load and mosaic ALOS DSM elevation data.
+
+    Args:
+        version: AW3D30 collection version, e.g. 'V4_1' or 'V3_2'
     """
-    dem = ee.ImageCollection("JAXA/ALOS/AW3D30/V4_1").select("DSM")
+    dem = ee.ImageCollection(f"JAXA/ALOS/AW3D30/{version}").select("DSM")
     dem = dem.mosaic().setDefaultProjection(dem.first().select(0).projection())
     return dem
 
@@ -41,6 +47,19 @@ def classify_aspect(dem, modis_projection, scale):
     return aspects, aspect_coded
 
 
+def reproject_dem(dem, modis_projection, scale_dem):
+    """
+    Reproject the DEM to the MODIS projection, averaging the DEM pixels within each output pixel.
+    """
+    return dem.reduceResolution(
+        reducer=ee.Reducer.mean(),
+        maxPixels=1024
+    ).reproject(
+        crs=modis_projection,
+        scale=scale_dem
+    )
+
+
 def reproject_and_analyze_dem(dem, modis_projection, aoi, scale_dem, tile_scale, aspect_keys):
     """
     Reproject DEM to MODIS projection and compute min/max elevation values.
@@ -57,44 +76,45 @@ def reproject_and_analyze_dem(dem, modis_projection, aoi, scale_dem, tile_scale,
         tuple: (reprojected_dem, min_dem_dict, max_dem_dict)
     """
     # Reproject the DEM to the MODIS projection with the MODIS scale
-    reprojected_dem = dem.reduceResolution(
-        reducer=ee.Reducer.mean(),
-        maxPixels=1024
-    ).reproject(
-        crs=modis_projection,
-        scale=scale_dem
-    )
+    reprojected_dem = reproject_dem(dem, modis_projection, scale_dem)
     
-    # Get minimum DEM value in the AOI
-    min_dem_value = reprojected_dem.reduceRegion(
-        reducer=ee.Reducer.min(),
-        geometry=aoi,
-        scale=scale_dem,
-        tileScale=tile_scale,
-        maxPixels=1e13
-    ).get(reprojected_dem.bandNames().get(0))
+    # Get minimum, maximum and number of grid cells in the AOI in one reduction
+    dem_stats = analyze_dem_stats(reprojected_dem, aoi, scale_dem, tile_scale)
     
-    # Build dictionary: each aspect key gets the same minimum value
-    min_dem_dict = ee.Dictionary.fromLists(aspect_keys, ee.List.repeat(min_dem_value, len(aspect_keys)))
+    # Build dictionaries: each aspect key gets the same minimum / maximum value
+    min_dem_dict = ee.Dictionary.fromLists(aspect_keys, ee.List.repeat(dem_stats.get('min'), len(aspect_keys)))
+    max_dem_dict = ee.Dictionary.fromLists(aspect_keys, ee.List.repeat(dem_stats.get('max'), len(aspect_keys)))
+    
+    #count number of grid cells
+    n_grid = dem_stats.get('count')
+    return reprojected_dem, min_dem_dict, max_dem_dict, n_grid
+
+
+def analyze_dem_stats(reprojected_dem, aoi, scale_dem, tile_scale):
+    """
+    Compute minimum, maximum and pixel count of the DEM over the AOI with a single combined reducer.
     
-    # Get maximum DEM value in the AOI
-    max_dem_value = reprojected_dem.reduceRegion(
-        reducer=ee.Reducer.max(),
+    Args:
+        reprojected_dem: DEM reprojected to the MODIS projection
+        aoi: Area of interest as Earth Engine Geometry
+        scale_dem: Scale for DEM processing in meters
+        tile_scale: Tile scale parameter for Earth Engine processing
+        
+    Returns:
+        ee.Dictionary with keys 'min', 'max' and 'count'
+    """
+    reducer = ee.Reducer.min() \
+        .combine(ee.Reducer.max(), '', True) \
+        .combine(ee.Reducer.count(), '', True)
+    stats = reprojected_dem.select([0], ['DSM']).reduceRegion(
+        reducer=reducer,
         geometry=aoi,
         scale=scale_dem,
         tileScale=tile_scale,
         maxPixels=1e13
-    ).get(reprojected_dem.bandNames().get(0))
-    
-    # Build dictionary: each aspect key gets the same maximum value
-    max_dem_dict = ee.Dictionary.fromLists(aspect_keys, ee.List.repeat(max_dem_value, len(aspect_keys)))
-    
-    #count number of grid cells
-    n_grid=reprojected_dem.reduceRegion(
-        reducer= 'count',
-        geometry= aoi,
-        scale= scale_dem,
-        tileScale= tile_scale,
-        maxPixels= 1e13,
-    ).values().get(0)
-    return reprojected_dem, min_dem_dict, max_dem_dict,n_grid
\ No newline at end of file
+    )
+    return ee.Dictionary({
+        'min': stats.get('DSM_min'),
+        'max': stats.get('DSM_max'),
+        'count': stats.get('DSM_count'),
+    })
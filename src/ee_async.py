@@ -0,0 +1,401 @@
+import asyncio
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import ee
+
+from src.getinfo_cache import _serialized_key
+from src.task_backend import FINAL_STATES, EETaskBackend, LocalTaskBackend
+
+# Asyncio layer for the three kinds of Earth Engine requests of the pipelines: evaluations
+# (getInfo), export task starts and task status polls. All requests of a client share one
+# semaphore (at most max_concurrent in flight) and a rate limit per endpoint; requests
+# failing with a quota error ("Too many concurrent aggregations", HTTP 429, too many
+# queued tasks, ...) are retried with exponential backoff and full jitter, outside the
+# semaphore. Evaluations of the same serialized expression that are in flight at the
+# same time share one request.
+#
+# The requests go through a transport: EETransport runs the blocking earthengine-api
+# calls in worker threads, HTTPTransport posts JSON to an HTTP endpoint such as the local
+# StandInServer, which emulates the concurrency limit of Earth Engine.
+
+ENDPOINTS = ('compute', 'start', 'status')
+
+# Requests per second of every endpoint
+DEFAULT_RATES = {'compute': 10.0, 'start': 2.0, 'status': 1.0}
+
+QUOTA_MESSAGES = (
+    'too many concurrent aggregations',
+    'too many requests',
+    'quota exceeded',
+    'rate limit',
+    'too many tasks already in the queue',
+    '429',
+)
+
+
+def is_quota_error(error):
+    """
+    True for errors that go away by waiting: concurrency, rate and queue limits.
+    """
+    message = str(error).lower()
+    return any(text in message for text in QUOTA_MESSAGES)
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0, rng=random):
+    """
+    Delay before retry number attempt (0-based): uniform in [0, min(cap, base * 2**attempt)]
+    ("full jitter"), so that clients throttled together do not retry together.
+    """
+    return rng.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class AsyncRateLimiter:
+    """
+    Asyncio limiter allowing at most `rate` calls per second (see task_backend.RateLimiter).
+    """
+
+    def __init__(self, rate, clock=time.monotonic, sleep=asyncio.sleep):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.clock = clock
+        self.sleep = sleep
+        self._next = 0.0
+
+    async def wait(self):
+        now = self.clock()
+        start = max(now, self._next)
+        self._next = start + self.interval
+        if start > now:
+            await self.sleep(start - now)
+
+
+# ---------------------------------------------------------------------------
+# Transports
+# ---------------------------------------------------------------------------
+
+class EETransport:
+    """
+    Earth Engine requests through the earthengine-api, run in worker threads.
+
+    Args:
+        backend: Task backend for starts and status polls (default: EETaskBackend)
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or EETaskBackend()
+
+    async def compute(self, obj, serialized):
+        return await asyncio.to_thread(obj.getInfo)
+
+    async def start(self, task, description):
+        return await asyncio.to_thread(self.backend.start, task, description)
+
+    async def status(self, task_ids):
+        return await asyncio.to_thread(self.backend.status, task_ids)
+
+
+class HTTPTransport:
+    """
+    Requests as JSON POSTs to <base_url>/compute, /start and /status. Error responses
+    raise ee.EEException with the HTTP status and the message of the response.
+
+    Args:
+        base_url: URL of the service, e.g. StandInServer.url
+        timeout: Timeout of a request in seconds
+    """
+
+    def __init__(self, base_url, timeout=60):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def _post(self, endpoint, payload):
+        request = urllib.request.Request(f'{self.base_url}/{endpoint}', data=json.dumps(payload).encode(),
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())['result']
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read()).get('error', e.reason)
+            except ValueError:
+                message = e.reason
+            raise ee.EEException(f'{e.code}: {message}') from None
+
+    async def compute(self, obj, serialized):
+        return await asyncio.to_thread(self._post, 'compute', {'expression': serialized})
+
+    async def start(self, task, description):
+        return await asyncio.to_thread(self._post, 'start', {'description': description})
+
+    async def status(self, task_ids):
+        return await asyncio.to_thread(self._post, 'status', {'ids': list(task_ids)})
+
+
+class StandInServer:
+    """
+    Local HTTP stand-in of Earth Engine for HTTPTransport, run in a background thread.
+    Requests beyond max_concurrent in flight are answered with HTTP 429 "Too many concurrent
+    aggregations", as Earth Engine does. Use as a context manager.
+
+    Args:
+        evaluate: Function serialized expression -> result (default: the parsed JSON)
+        max_concurrent: Concurrent requests allowed (None: unlimited)
+        latency: Seconds every request takes
+        backend: Task backend behind /start and /status (default: LocalTaskBackend())
+    """
+
+    def __init__(self, evaluate=None, max_concurrent=4, latency=0.0, backend=None):
+        self.evaluate = evaluate or json.loads
+        self.max_concurrent = max_concurrent
+        self.latency = latency
+        self.backend = backend or LocalTaskBackend()
+        self.stats = {'requests': 0, 'rejected': 0, 'max_in_flight': 0}
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def _handle(self, endpoint, payload):
+        with self._lock:
+            self.stats['requests'] += 1
+            if self.max_concurrent is not None and self._in_flight >= self.max_concurrent:
+                self.stats['rejected'] += 1
+                return 429, {'error': 'Too many concurrent aggregations.'}
+            self._in_flight += 1
+            self.stats['max_in_flight'] = max(self.stats['max_in_flight'], self._in_flight)
+        try:
+            time.sleep(self.latency)
+            if endpoint == 'compute':
+                result = self.evaluate(payload['expression'])
+            elif endpoint == 'start':
+                result = self.backend.start(None, payload['description'])
+            elif endpoint == 'status':
+                result = self.backend.status(payload['ids'])
+            else:
+                return 404, {'error': f'Unknown endpoint {endpoint}'}
+            return 200, {'result': result}
+        except ee.EEException as e:
+            return 429 if is_quota_error(e) else 400, {'error': str(e)}
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                code, body = server._handle(self.path.strip('/'), json.loads(self.rfile.read(length) or b'{}'))
+                data = json.dumps(body).encode()
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+# ---------------------------------------------------------------------------
+# Client
+# ---------------------------------------------------------------------------
+
+class AsyncEEClient:
+    """
+    Concurrent Earth Engine requests with a global concurrency limit, per-endpoint rate
+    limits, retries with jittered exponential backoff on quota errors and coalescing of
+    identical in-flight evaluations.
+
+    Args:
+        transport: EETransport (default), HTTPTransport or any object with async compute,
+            start and status methods
+        max_concurrent: Requests in flight at a time, over all endpoints
+        rates: Dictionary endpoint -> requests per second (missing endpoints: DEFAULT_RATES)
+        retries: Retries per request after a quota error
+        backoff: Maximum delay in seconds before the first retry, doubled for every further retry
+        max_backoff: Cap of the retry delay in seconds
+        seed: Seed of the jitter
+        sleep: Async sleep function, replaceable in tests
+    """
+
+    def __init__(self, transport=None, max_concurrent=8, rates=None, retries=5, backoff=1.0, max_backoff=60.0,
+                 seed=None, sleep=asyncio.sleep):
+        self.transport = transport or EETransport()
+        self.max_concurrent = max_concurrent
+        self.rates = {**DEFAULT_RATES, **(rates or {})}
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.sleep = sleep
+        self.rng = random.Random(seed)
+        self.stats = {'requests': 0, 'retries': 0, 'coalesced': 0, 'failed': 0}
+        self._loop = None
+
+    def _bind(self):
+        # Semaphore, limiters and in-flight table belong to the running event loop
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+            self._limiters = {endpoint: AsyncRateLimiter(self.rates.get(endpoint), sleep=self.sleep)
+                              for endpoint in ENDPOINTS}
+            self._in_flight = {}
+
+    async def _request(self, endpoint, *args):
+        self._bind()
+        for attempt in range(self.retries + 1):
+            # Rate limit before taking a concurrency slot, so that the semaphore only holds
+            # requests in flight and not requests waiting for their endpoint's rate
+            await self._limiters[endpoint].wait()
+            async with self._semaphore:
+                self.stats['requests'] += 1
+                try:
+                    return await getattr(self.transport, endpoint)(*args)
+                except ee.EEException as e:
+                    if not is_quota_error(e) or attempt == self.retries:
+                        self.stats['failed'] += 1
+                        raise
+            # Wait outside the semaphore so that other requests can proceed
+            self.stats['retries'] += 1
+            await self.sleep(backoff_delay(attempt, self.backoff, self.max_backoff, self.rng))
+
+    async def compute(self, obj):
+        """
+        getInfo() of an Earth Engine object. Concurrent calls for the same expression share
+        one request.
+        """
+        self._bind()
+        serialized = obj.serialize()
+        key = _serialized_key(serialized)
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.stats['coalesced'] += 1
+            return await asyncio.shield(future)
+        future = asyncio.ensure_future(self._request('compute', obj, serialized))
+        self._in_flight[key] = future
+        future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def compute_all(self, objs):
+        """
+        getInfo() of many objects concurrently, in the order of objs (exceptions are returned
+        in place of failed results).
+        """
+        return await asyncio.gather(*(self.compute(obj) for obj in objs), return_exceptions=True)
+
+    async def start(self, task, description=None):
+        """
+        Start an export task and return its id.
+        """
+        return await self._request('start', task, description)
+
+    async def status(self, task_ids):
+        """
+        Dictionary task id -> state, in one request.
+        """
+        if not task_ids:
+            return {}
+        return await self._request('status', list(task_ids))
+
+    async def start_tasks(self, jobs, verbose=False):
+        """
+        Start export tasks concurrently (see task_backend.start_tasks).
+
+        Args:
+            jobs: Iterable of (description, make_task) pairs; make_task() builds the task
+            verbose: Print every started or failed task
+
+        Returns:
+            dict with 'started' (description -> task id) and 'failed' (description -> error message)
+        """
+        jobs = list(jobs)
+        results = await asyncio.gather(*(self.start(make_task(), description) for description, make_task in jobs),
+                                       return_exceptions=True)
+        summary = {'started': {}, 'failed': {}}
+        for (description, _), result in zip(jobs, results):
+            if isinstance(result, Exception):
+                summary['failed'][description] = str(result)
+                if verbose:
+                    print(f'  Export task failed: {description}: {result}')
+            else:
+                summary['started'][description] = result
+                if verbose:
+                    print(f'  Export task started: {description}')
+        return summary
+
+    async def wait_for_tasks(self, task_ids, poll_interval=30, batch_size=100):
+        """
+        Poll task states until all tasks are final.
+
+        Args:
+            task_ids: Task ids to wait for
+            poll_interval: Seconds between polls
+            batch_size: Task ids per status request (batches are polled concurrently)
+
+        Returns:
+            dict task id -> final state
+        """
+        pending = list(task_ids)
+        states = {}
+        while pending:
+            batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+            for batch_states in await asyncio.gather(*(self.status(batch) for batch in batches)):
+                states.update(batch_states)
+            pending = [task_id for task_id in pending if states.get(task_id) not in FINAL_STATES]
+            if pending:
+                await self.sleep(poll_interval)
+        return states
+
+
+def run(coroutine):
+    """
+    Run a coroutine to completion from synchronous code, also inside Jupyter where an event
+    loop is already running (the coroutine then runs in its own loop in a helper thread).
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    result = {}
+
+    def target():
+        try:
+            result['value'] = asyncio.run(coroutine)
+        except BaseException as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+    if 'error' in result:
+        raise result['error']
+    return result['value']
@@ -0,0 +1,2035 @@
+import contextlib
+import datetime
+import importlib
+import json
+import math
+import re
+
+import numpy as np
+from scipy import ndimage
+
+from src.raster_ops import canny_edges, disk_footprint, focal_mean
+
+# In-process stand-in for the subset of the Earth Engine API used by src/, backed by
+# NumPy arrays on a single pixel grid. Inside `with emulated(shape, scale):` the `ee`
+# name of the src modules refers to this module, so functions such as
+# get_snowline_elevation, calculate_glacier_metrics, classify_aspect or process_interval
+# run unchanged on local fixtures (image_from_arrays, collection_from_arrays,
+# geometry_from_mask, register_asset).
+#
+# Objects are lazy: every call adds a node to the graph of the session, and identical
+# calls on identical inputs map to the same node (common subexpressions are shared).
+# Values are computed on evaluation (getInfo, evaluate, to_numpy) and memoized per node,
+# so repeated subgraphs are computed once.
+#
+# Simplifications: all images live on the session grid (reproject, reduceResolution and
+# setDefaultProjection return their input, scale arguments are ignored), masks are
+# binary and reductions are unweighted.
+
+DEFAULT_MODULES = ('src.dem_processing', 'src.modis_processing', 'src.qa_bits', 'src.snowline',
+                   'src.export_pipeline', 'src.glacier_mask_tiles')
+
+DAY_MS = 86400000
+
+_session = None
+
+
+class EEException(Exception):
+    pass
+
+
+# ---------------------------------------------------------------------------
+# Values
+# ---------------------------------------------------------------------------
+
+class ImageValue:
+    """
+    Evaluated image: band names, data (bands, y, x) float64, mask (bands, y, x) bool
+    and properties.
+    """
+
+    def __init__(self, names, data, mask, props=None):
+        self.names = list(names)
+        self.data = data
+        self.mask = mask
+        self.props = dict(props or {})
+
+    def band(self, index):
+        return ImageValue([self.names[index]], self.data[index:index + 1], self.mask[index:index + 1])
+
+
+class FeatureValue:
+    """
+    Evaluated feature: GeometryValue (or None) and properties.
+    """
+
+    def __init__(self, geometry, props=None):
+        self.geometry = geometry
+        self.props = dict(props or {})
+
+
+class GeometryValue:
+    """
+    Evaluated geometry as a boolean mask on the session grid; point is the (row, col) of
+    point geometries.
+    """
+
+    def __init__(self, mask, point=None):
+        self.mask = mask
+        self.point = point
+
+
+class DateValue:
+    def __init__(self, millis):
+        self.millis = int(millis)
+
+    @property
+    def datetime(self):
+        return datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc) + \
+            datetime.timedelta(milliseconds=self.millis)
+
+
+class ProjectionValue:
+    def __init__(self, crs, scale):
+        self.crs = crs
+        self.scale = scale
+
+
+class Session:
+    """
+    Graph, memo and fixtures of an emulated Earth Engine session.
+
+    Args:
+        shape: (y, x) shape of the pixel grid
+        scale: Pixel size in meters
+        seed: Default seed of the random sampling
+        transform: Optional (lon0, lat0, dlon, dlat) of the upper left corner and the
+            pixel size in degrees, for ee.Geometry.Point
+    """
+
+    def __init__(self, shape, scale=500, seed=0, transform=None):
+        self.shape = tuple(shape)
+        self.scale = scale
+        self.seed = seed
+        self.transform = transform
+        self.assets = {}
+        self.ids = {}
+        self.nodes = []
+        self.memo = {}
+        self.refs = []
+        self.stats = {'calls': 0, 'nodes': 0, 'evaluated': 0, 'hits': 0}
+
+    def clear(self):
+        """
+        Drop the memoized values (the graph is kept).
+        """
+        self.memo = {}
+
+    def _key(self, value):
+        if isinstance(value, ComputedObject):
+            return ('n', value._node)
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return ('c', type(value).__name__, value)
+        if isinstance(value, (list, tuple)):
+            return ('l', tuple(self._key(v) for v in value))
+        if isinstance(value, dict):
+            return ('d', tuple((k, self._key(v)) for k, v in sorted(value.items(), key=lambda kv: str(kv[0]))))
+        if isinstance(value, (Reducer, Filter)):
+            return ('s', type(value).__name__, self._key(value._spec))
+        # Arrays, functions and evaluated values: by identity, kept alive so ids stay unique
+        self.refs.append(value)
+        return ('o', id(value))
+
+    def node(self, op, args=(), kwargs=None):
+        """
+        Node id of op(*args, **kwargs), shared by identical calls.
+        """
+        kwargs = {k: v for k, v in (kwargs or {}).items()}
+        key = (op, self._key(list(args)), self._key(kwargs))
+        self.stats['calls'] += 1
+        if key not in self.ids:
+            self.ids[key] = len(self.nodes)
+            self.nodes.append((op, tuple(args), kwargs))
+            self.stats['nodes'] += 1
+        return self.ids[key]
+
+    def evaluate(self, value):
+        """
+        Value of an emulated object (recursively through lists and dictionaries).
+        """
+        if isinstance(value, ComputedObject):
+            return self._evaluate_node(value._node)
+        if isinstance(value, (list, tuple)):
+            return [self.evaluate(v) for v in value]
+        if isinstance(value, dict):
+            return {k: self.evaluate(v) for k, v in value.items()}
+        return value
+
+    def _evaluate_node(self, node):
+        if node in self.memo:
+            self.stats['hits'] += 1
+            return self.memo[node]
+        op, args, kwargs = self.nodes[node]
+        impl, lazy = _OPS[op]
+        if lazy:
+            value = impl(self, *args, **kwargs)
+        else:
+            value = impl(*[self.evaluate(a) for a in args], **{k: self.evaluate(v) for k, v in kwargs.items()})
+        self.memo[node] = value
+        self.stats['evaluated'] += 1
+        return value
+
+    def describe(self, node):
+        """
+        JSON-serializable description of the graph below a node in the compact form of
+        Earth Engine: {'result': id, 'values': {id: {'op', 'args', 'kwargs'}}}, with one
+        entry per distinct node and arguments referring to nodes as {'valueReference': id}.
+        """
+        values = {}
+
+        def describe_arg(value):
+            if isinstance(value, ComputedObject):
+                visit(value._node)
+                return {'valueReference': str(value._node)}
+            if value is None or isinstance(value, (bool, int, float, str)):
+                return value
+            if isinstance(value, (list, tuple)):
+                return [describe_arg(v) for v in value]
+            if isinstance(value, dict):
+                return {str(k): describe_arg(v) for k, v in value.items()}
+            if isinstance(value, (Reducer, Filter)):
+                return {type(value).__name__: describe_arg(value._spec)}
+            return f'<{type(value).__name__} {id(value)}>'
+
+        def visit(n):
+            if str(n) in values:
+                return
+            op, args, kwargs = self.nodes[n]
+            values[str(n)] = None
+            values[str(n)] = {'op': op, 'args': describe_arg(list(args)), 'kwargs': describe_arg(kwargs)}
+
+        visit(node)
+        return {'result': str(node), 'values': values}
+
+
+def current_session():
+    if _session is None:
+        raise RuntimeError('No emulated session; use `with emulated(shape, scale):`')
+    return _session
+
+
+# ---------------------------------------------------------------------------
+# Operations: name -> (implementation, lazy). Lazy implementations get the session and
+# the unevaluated arguments.
+# ---------------------------------------------------------------------------
+
+_OPS = {}
+
+
+def _op(name, lazy=False):
+    def register(impl):
+        _OPS[name] = (impl, lazy)
+        return impl
+    return register
+
+
+def _call(cls, op, *args, **kwargs):
+    obj = cls.__new__(cls)
+    obj._node = current_session().node(op, args, kwargs)
+    return obj
+
+
+def _truthy(value):
+    if value is None:
+        return False
+    if isinstance(value, (bool, int, float)):
+        return bool(value) and not (isinstance(value, float) and math.isnan(value))
+    if isinstance(value, (str, list, dict)):
+        return len(value) > 0
+    return True
+
+
+def _wrap_value(value):
+    """
+    Typed emulated object holding an evaluated value (elements in map and iterate).
+    """
+    if isinstance(value, ImageValue):
+        cls = Image
+    elif isinstance(value, FeatureValue):
+        cls = Feature
+    elif isinstance(value, GeometryValue):
+        cls = Geometry
+    elif isinstance(value, DateValue):
+        cls = Date
+    elif isinstance(value, (bool, int, float)):
+        cls = Number
+    elif isinstance(value, str):
+        cls = String
+    elif isinstance(value, list):
+        cls = List
+    elif isinstance(value, dict):
+        cls = Dictionary
+    else:
+        cls = ComputedObject
+    return _call(cls, 'constant', value)
+
+
+@_op('constant')
+def _constant(value):
+    return value
+
+
+@_op('asset')
+def _asset(asset_id):
+    assets = current_session().assets
+    if asset_id not in assets:
+        raise EEException(f"Asset '{asset_id}' is not registered (see register_asset)")
+    return current_session().evaluate(assets[asset_id])
+
+
+def _info(value):
+    if isinstance(value, ImageValue):
+        return {'type': 'Image', 'bands': [{'id': name} for name in value.names], 'properties': _info(value.props)}
+    if isinstance(value, FeatureValue):
+        geometry = None
+        if value.geometry is not None:
+            geometry = _info(value.geometry)
+        return {'type': 'Feature', 'geometry': geometry, 'properties': _info(value.props)}
+    if isinstance(value, GeometryValue):
+        if value.point is not None:
+            return {'type': 'Point', 'pixel': list(value.point)}
+        return {'type': 'Mask', 'pixels': int(value.mask.sum())}
+    if isinstance(value, DateValue):
+        return {'type': 'Date', 'value': value.millis}
+    if isinstance(value, ProjectionValue):
+        return {'type': 'Projection', 'crs': value.crs, 'scale': value.scale}
+    if isinstance(value, list):
+        return [_info(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _info(v) for k, v in value.items()}
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class ComputedObject:
+    """
+    Lazy emulated object: a node of the session graph.
+    """
+
+    def __init__(self, value=None):
+        if isinstance(value, ComputedObject):
+            self._node = value._node
+        else:
+            self._node = current_session().node('constant', (value,))
+
+    def getInfo(self):
+        return _info(current_session().evaluate(self))
+
+    def evaluate(self):
+        """
+        Evaluated value (ImageValue, FeatureValue, list, dict, number, ...).
+        """
+        return current_session().evaluate(self)
+
+    def serialize(self):
+        return json.dumps(current_session().describe(self._node), sort_keys=True)
+
+    def __repr__(self):
+        op = current_session().nodes[self._node][0] if _session is not None else '?'
+        return f'<{type(self).__name__} {op}#{self._node}>'
+
+
+# ---------------------------------------------------------------------------
+# Reducers
+# ---------------------------------------------------------------------------
+
+def _percentile(values, p):
+    return float(np.percentile(values, p)) if len(values) else None
+
+
+_SIMPLE_REDUCERS = {
+    'mean': lambda v: float(np.mean(v)) if len(v) else None,
+    'median': lambda v: float(np.median(v)) if len(v) else None,
+    'min': lambda v: float(np.min(v)) if len(v) else None,
+    'max': lambda v: float(np.max(v)) if len(v) else None,
+    'sum': lambda v: float(np.sum(v)),
+    'count': lambda v: int(len(v)),
+    'stdDev': lambda v: float(np.std(v)) if len(v) else None,
+    'first': lambda v: v[0] if len(v) else None,
+    'firstNonNull': lambda v: next((x for x in v if x is not None), None),
+    'mode': lambda v: _mode(v),
+}
+
+
+def _mode(values):
+    if not len(values):
+        return None
+    uniques, counts = np.unique(np.asarray(values), return_counts=True)
+    return uniques[np.argmax(counts)].item()
+
+
+class Reducer:
+    """
+    Emulated ee.Reducer: a list of (output name, function of a value sequence), optionally
+    grouped.
+    """
+
+    def __init__(self, spec):
+        self._spec = spec
+
+    @property
+    def outputs(self):
+        kind = self._spec[0]
+        if kind == 'simple':
+            return [(self._spec[1], _SIMPLE_REDUCERS[self._spec[1]])]
+        if kind == 'percentile':
+            _, percentiles, names = self._spec
+            names = names or [f'p{p:g}' for p in percentiles]
+            return [(name, lambda v, p=p: _percentile(v, p)) for name, p in zip(names, percentiles)]
+        if kind == 'combine':
+            _, first, second, prefix = self._spec
+            return first.outputs + [(prefix + name, f) for name, f in second.outputs]
+        raise ValueError('Grouped reducers have no plain outputs')
+
+    def apply(self, values):
+        """
+        Dictionary of output name -> reduced value of a sequence.
+        """
+        return {name: f(values) for name, f in self.outputs}
+
+    @staticmethod
+    def _simple(name):
+        return Reducer(('simple', name))
+
+    @staticmethod
+    def mean():
+        return Reducer._simple('mean')
+
+    @staticmethod
+    def median(maxBuckets=None, minBucketWidth=None, maxRaw=None):
+        return Reducer._simple('median')
+
+    @staticmethod
+    def min(numInputs=1):
+        return Reducer._simple('min')
+
+    @staticmethod
+    def max(numInputs=1):
+        return Reducer._simple('max')
+
+    @staticmethod
+    def sum():
+        return Reducer._simple('sum')
+
+    @staticmethod
+    def count():
+        return Reducer._simple('count')
+
+    @staticmethod
+    def stdDev():
+        return Reducer._simple('stdDev')
+
+    @staticmethod
+    def first():
+        return Reducer._simple('first')
+
+    @staticmethod
+    def firstNonNull():
+        return Reducer._simple('firstNonNull')
+
+    @staticmethod
+    def mode(maxBuckets=None, minBucketWidth=None, maxRaw=None):
+        return Reducer._simple('mode')
+
+    @staticmethod
+    def percentile(percentiles, outputNames=None, maxBuckets=None, minBucketWidth=None, maxRaw=None):
+        return Reducer(('percentile', list(percentiles), list(outputNames) if outputNames else None))
+
+    def combine(self, reducer2, outputPrefix='', sharedInputs=False):
+        return Reducer(('combine', self, reducer2, outputPrefix))
+
+    def group(self, groupField=0, groupName='group'):
+        return Reducer(('group', self, groupField, groupName))
+
+
+def _reducer(reducer):
+    # reduceRegion also accepts the name of a simple reducer
+    return Reducer._simple(reducer) if isinstance(reducer, str) else reducer
+
+
+# ---------------------------------------------------------------------------
+# Filters
+# ---------------------------------------------------------------------------
+
+_COMPARISONS = {
+    'eq': lambda a, b: a == b,
+    'neq': lambda a, b: a != b,
+    'gt': lambda a, b: a is not None and a > b,
+    'gte': lambda a, b: a is not None and a >= b,
+    'lt': lambda a, b: a is not None and a < b,
+    'lte': lambda a, b: a is not None and a <= b,
+}
+
+
+class Filter:
+    """
+    Emulated ee.Filter on element properties.
+    """
+
+    def __init__(self, spec):
+        self._spec = spec
+
+    def matches(self, props, session):
+        kind = self._spec[0]
+        if kind in _COMPARISONS:
+            _, name, value = self._spec
+            return _COMPARISONS[kind](props.get(name), _plain(session.evaluate(value)))
+        if kind == 'inList':
+            _, name, values = self._spec
+            return props.get(name) in _plain(session.evaluate(values))
+        if kind == 'notNull':
+            return all(props.get(name) is not None for name in self._spec[1])
+        if kind == 'date':
+            _, start, end = self._spec
+            time = props.get('system:time_start')
+            return time is not None and _millis(session.evaluate(start)) <= time < _millis(session.evaluate(end))
+        if kind == 'calendarRange':
+            _, start, end, field = self._spec
+            time = props.get('system:time_start')
+            if time is None:
+                return False
+            value = _date_field(DateValue(time), field)
+            end = start if end is None else end
+            return start <= value <= end if start <= end else (value >= start or value <= end)
+        if kind == 'and':
+            return all(f.matches(props, session) for f in self._spec[1])
+        if kind == 'or':
+            return any(f.matches(props, session) for f in self._spec[1])
+        if kind == 'not':
+            return not self._spec[1].matches(props, session)
+        raise ValueError(f'Unknown filter {kind}')
+
+    def Not(self):
+        return Filter(('not', self))
+
+    @staticmethod
+    def eq(name, value):
+        return Filter(('eq', name, value))
+
+    @staticmethod
+    def neq(name, value):
+        return Filter(('neq', name, value))
+
+    @staticmethod
+    def gt(name, value):
+        return Filter(('gt', name, value))
+
+    @staticmethod
+    def gte(name, value):
+        return Filter(('gte', name, value))
+
+    @staticmethod
+    def lt(name, value):
+        return Filter(('lt', name, value))
+
+    @staticmethod
+    def lte(name, value):
+        return Filter(('lte', name, value))
+
+    @staticmethod
+    def inList(leftField, rightValue):
+        return Filter(('inList', leftField, rightValue))
+
+    @staticmethod
+    def notNull(properties):
+        return Filter(('notNull', list(properties)))
+
+    @staticmethod
+    def date(start, end=None):
+        return Filter(('date', start, end if end is not None else Date(start).advance(1, 'millisecond')))
+
+    @staticmethod
+    def calendarRange(start, end=None, field='day_of_year'):
+        return Filter(('calendarRange', start, end, field))
+
+    @staticmethod
+    def dayOfYear(start, end):
+        return Filter(('calendarRange', start, end, 'day_of_year'))
+
+    @staticmethod
+    def And(*filters):
+        return Filter(('and', list(filters[0]) if len(filters) == 1 and isinstance(filters[0], list) else list(filters)))
+
+    @staticmethod
+    def Or(*filters):
+        return Filter(('or', list(filters[0]) if len(filters) == 1 and isinstance(filters[0], list) else list(filters)))
+
+
+def _plain(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, list):
+        return [_plain(v) for v in value]
+    return value
+
+
+# ---------------------------------------------------------------------------
+# Numbers, strings, lists, dictionaries and dates
+# ---------------------------------------------------------------------------
+
+def _number_binary(name, fn):
+    @_op(f'Number.{name}')
+    def impl(a, b):
+        return fn(a, b)
+
+    def method(self, right):
+        return _call(Number, f'Number.{name}', self, right)
+    method.__name__ = name
+    return method
+
+
+def _safe_divide(a, b):
+    return 0 if b == 0 else a / b
+
+
+class Number(ComputedObject):
+    add = _number_binary('add', lambda a, b: a + b)
+    subtract = _number_binary('subtract', lambda a, b: a - b)
+    multiply = _number_binary('multiply', lambda a, b: a * b)
+    divide = _number_binary('divide', _safe_divide)
+    pow = _number_binary('pow', lambda a, b: a ** b)
+    mod = _number_binary('mod', lambda a, b: math.fmod(a, b))
+    min = _number_binary('min', lambda a, b: min(a, b))
+    max = _number_binary('max', lambda a, b: max(a, b))
+    gt = _number_binary('gt', lambda a, b: int(a > b))
+    gte = _number_binary('gte', lambda a, b: int(a >= b))
+    lt = _number_binary('lt', lambda a, b: int(a < b))
+    lte = _number_binary('lte', lambda a, b: int(a <= b))
+    eq = _number_binary('eq', lambda a, b: int(a == b))
+    neq = _number_binary('neq', lambda a, b: int(a != b))
+    And = _number_binary('And', lambda a, b: int(bool(a) and bool(b)))
+    Or = _number_binary('Or', lambda a, b: int(bool(a) or bool(b)))
+
+    def _unary(self, name):
+        return _call(Number, f'Number.{name}', self)
+
+    def Not(self):
+        return self._unary('Not')
+
+    def int(self):
+        return self._unary('int')
+
+    def toInt(self):
+        return self._unary('int')
+
+    def float(self):
+        return self._unary('float')
+
+    def toFloat(self):
+        return self._unary('float')
+
+    def abs(self):
+        return self._unary('abs')
+
+    def sqrt(self):
+        return self._unary('sqrt')
+
+    def ceil(self):
+        return self._unary('ceil')
+
+    def floor(self):
+        return self._unary('floor')
+
+    def round(self):
+        return self._unary('round')
+
+    def exp(self):
+        return self._unary('exp')
+
+    def log(self):
+        return self._unary('log')
+
+    def format(self, pattern=None):
+        return _call(String, 'Number.format', self, pattern)
+
+
+for _name, _fn in {
+    'Not': lambda a: int(not a),
+    'int': lambda a: int(a),
+    'float': lambda a: float(a),
+    'abs': abs,
+    'sqrt': math.sqrt,
+    'ceil': lambda a: float(math.ceil(a)),
+    'floor': lambda a: float(math.floor(a)),
+    'round': lambda a: float(round(a)),
+    'exp': math.exp,
+    'log': math.log,
+}.items():
+    _op(f'Number.{_name}')(_fn)
+
+
+@_op('Number.format')
+def _number_format(value, pattern):
+    if pattern is not None:
+        return pattern % value
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+class String(ComputedObject):
+    def cat(self, string2):
+        return _call(String, 'String.cat', self, string2)
+
+    def length(self):
+        return _call(Number, 'String.length', self)
+
+    def equals(self, target):
+        return _call(Number, 'String.equals', self, target)
+
+
+_op('String.cat')(lambda a, b: str(a) + str(b))
+_op('String.length')(len)
+_op('String.equals')(lambda a, b: int(a == b))
+
+
+class List(ComputedObject):
+    def __init__(self, value=None):
+        if isinstance(value, ComputedObject):
+            self._node = value._node
+        else:
+            self._node = current_session().node('List', (list(value),))
+
+    def get(self, index):
+        return _call(ComputedObject, 'List.get', self, index)
+
+    def size(self):
+        return _call(Number, 'List.size', self)
+
+    def length(self):
+        return self.size()
+
+    def add(self, element):
+        return _call(List, 'List.add', self, element)
+
+    def cat(self, other):
+        return _call(List, 'List.cat', self, other)
+
+    def removeAll(self, other):
+        return _call(List, 'List.removeAll', self, other)
+
+    def contains(self, element):
+        return _call(Number, 'List.contains', self, element)
+
+    def slice(self, start, end=None, step=1):
+        return _call(List, 'List.slice', self, start, end, step)
+
+    def sort(self):
+        return _call(List, 'List.sort', self)
+
+    def distinct(self):
+        return _call(List, 'List.distinct', self)
+
+    def flatten(self):
+        return _call(List, 'List.flatten', self)
+
+    def reduce(self, reducer):
+        return _call(ComputedObject, 'List.reduce', self, reducer)
+
+    def map(self, baseAlgorithm):
+        return _call(List, 'List.map', self, baseAlgorithm)
+
+    def iterate(self, function, first):
+        return _call(ComputedObject, 'List.iterate', self, function, first)
+
+    @staticmethod
+    def sequence(start, end=None, step=1, count=None):
+        return _call(List, 'List.sequence', start, end, step, count)
+
+    @staticmethod
+    def repeat(value, count):
+        return _call(List, 'List.repeat', value, count)
+
+
+_op('List')(lambda values: list(values))
+_op('List.get')(lambda values, index: values[int(index)])
+_op('List.size')(len)
+_op('List.add')(lambda values, element: values + [element])
+_op('List.cat')(lambda values, other: values + list(other))
+_op('List.removeAll')(lambda values, other: [v for v in values if v not in other])
+_op('List.contains')(lambda values, element: int(element in values))
+_op('List.slice')(lambda values, start, end, step: values[int(start):None if end is None else int(end):int(step)])
+_op('List.sort')(lambda values: sorted(values))
+_op('List.distinct')(lambda values: list(dict.fromkeys(values)))
+_op('List.flatten')(lambda values: [w for v in values for w in (v if isinstance(v, list) else [v])])
+_op('List.repeat')(lambda value, count: [value] * int(count))
+
+
+@_op('List.sequence')
+def _list_sequence(start, end, step, count):
+    if count is not None:
+        return [start + i * step for i in range(int(count))]
+    if end is None:
+        start, end = 0, start
+    n = int(math.floor((end - start) / step)) + 1
+    return [start + i * step for i in range(max(n, 0))]
+
+
+@_op('List.reduce')
+def _list_reduce(values, reducer):
+    outputs = reducer.apply([v for v in values if v is not None])
+    return next(iter(outputs.values())) if len(outputs) == 1 else outputs
+
+
+@_op('List.map', lazy=True)
+def _list_map(session, values, function):
+    return [session.evaluate(function(_wrap_value(v))) for v in session.evaluate(values)]
+
+
+@_op('List.iterate', lazy=True)
+def _list_iterate(session, values, function, first):
+    previous = session.evaluate(first)
+    for value in session.evaluate(values):
+        previous = session.evaluate(function(_wrap_value(value), _wrap_value(previous)))
+    return previous
+
+
+class Dictionary(ComputedObject):
+    def __init__(self, value=None):
+        if isinstance(value, ComputedObject):
+            self._node = value._node
+        else:
+            self._node = current_session().node('Dictionary', (dict(value or {}),))
+
+    def get(self, key, defaultValue=None):
+        if defaultValue is None:
+            return _call(ComputedObject, 'Dictionary.get', self, key)
+        return _call(ComputedObject, 'Dictionary.getDefault', self, key, defaultValue)
+
+    def set(self, key, value):
+        return _call(Dictionary, 'Dictionary.set', self, key, value)
+
+    def combine(self, second, overwrite=True):
+        return _call(Dictionary, 'Dictionary.combine', self, second, overwrite)
+
+    def values(self, keys=None):
+        return _call(List, 'Dictionary.values', self, keys)
+
+    def keys(self):
+        return _call(List, 'Dictionary.keys', self)
+
+    def contains(self, key):
+        return _call(Number, 'Dictionary.contains', self, key)
+
+    def size(self):
+        return _call(Number, 'Dictionary.size', self)
+
+    def remove(self, selectors, ignoreMissing=False):
+        return _call(Dictionary, 'Dictionary.remove', self, selectors, ignoreMissing)
+
+    def select(self, selectors, ignoreMissing=False):
+        return _call(Dictionary, 'Dictionary.select', self, selectors, ignoreMissing)
+
+    @staticmethod
+    def fromLists(keys, values):
+        return _call(Dictionary, 'Dictionary.fromLists', keys, values)
+
+
+@_op('Dictionary.get')
+def _dictionary_get(values, key):
+    if key not in values:
+        raise EEException(f"Dictionary does not contain key: '{key}'")
+    return values[key]
+
+
+_op('Dictionary')(lambda values: dict(values))
+_op('Dictionary.getDefault')(lambda values, key, default: values.get(key, default))
+_op('Dictionary.set')(lambda values, key, value: {**values, key: value})
+_op('Dictionary.combine')(lambda values, second, overwrite: {**values, **second} if overwrite else {**second, **values})
+_op('Dictionary.values')(lambda values, keys: [values[k] for k in (sorted(values) if keys is None else keys)])
+_op('Dictionary.keys')(lambda values: sorted(values))
+_op('Dictionary.contains')(lambda values, key: int(key in values))
+_op('Dictionary.size')(len)
+_op('Dictionary.remove')(lambda values, keys, ignore: {k: v for k, v in values.items() if k not in keys})
+_op('Dictionary.select')(lambda values, keys, ignore: {k: values[k] for k in keys if k in values or not ignore})
+_op('Dictionary.fromLists')(lambda keys, values: dict(zip(keys, values)))
+
+
+_UNITS_MS = {'millisecond': 1, 'second': 1000, 'minute': 60000, 'hour': 3600000, 'day': DAY_MS, 'week': 7 * DAY_MS}
+
+
+def _millis(value):
+    if isinstance(value, DateValue):
+        return value.millis
+    if isinstance(value, str):
+        date = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+        if date.tzinfo is None:
+            date = date.replace(tzinfo=datetime.timezone.utc)
+        return int(date.timestamp() * 1000)
+    return int(value)
+
+
+def _date_field(date, unit):
+    dt = date.datetime
+    return {
+        'year': dt.year, 'month': dt.month, 'day': dt.day, 'hour': dt.hour, 'minute': dt.minute,
+        'second': dt.second, 'day_of_year': dt.timetuple().tm_yday, 'day_of_month': dt.day,
+        'month_of_year': dt.month, 'week': dt.isocalendar()[1],
+    }[unit]
+
+
+def _advance(millis, delta, unit):
+    unit = unit[:-1] if unit.endswith('s') else unit
+    if unit in _UNITS_MS:
+        return int(millis + delta * _UNITS_MS[unit])
+    if unit not in ('month', 'year'):
+        raise ValueError(f"Unknown date unit '{unit}'")
+    dt = DateValue(millis).datetime
+    month = dt.month - 1 + int(delta * 12 if unit == 'year' else delta)
+    year, month = dt.year + month // 12, month % 12 + 1
+    # Clamp the day to the end of the target month
+    next_month = datetime.datetime(year + month // 12, month % 12 + 1, 1, tzinfo=datetime.timezone.utc)
+    day = min(dt.day, (next_month - datetime.timedelta(days=1)).day)
+    return int(dt.replace(year=year, month=month, day=day).timestamp() * 1000)
+
+
+def _format_date(date, pattern):
+    dt = date.datetime
+    if pattern is None:
+        return dt.strftime('%Y-%m-%dT%H:%M:%S')
+    tokens = {'yyyy': '%Y', 'YYYY': '%Y', 'MM': '%m', 'dd': '%d', 'DDD': '%j', 'HH': '%H', 'mm': '%M', 'ss': '%S'}
+    return dt.strftime(re.sub('|'.join(tokens), lambda m: tokens[m.group(0)], pattern))
+
+
+class Date(ComputedObject):
+    def __init__(self, date, tz=None):
+        self._node = current_session().node('Date', (date,))
+
+    def get(self, unit, timeZone=None):
+        return _call(Number, 'Date.get', self, unit)
+
+    def getRelative(self, unit, inUnit, timeZone=None):
+        return _call(Number, 'Date.getRelative', self, unit, inUnit)
+
+    def millis(self):
+        return _call(Number, 'Date.millis', self)
+
+    def format(self, format=None, timeZone=None):
+        return _call(String, 'Date.format', self, format)
+
+    def advance(self, delta, unit, timeZone=None):
+        return _call(Date, 'Date.advance', self, delta, unit)
+
+    def difference(self, start, unit):
+        return _call(Number, 'Date.difference', self, start, unit)
+
+    @staticmethod
+    def fromYMD(year, month, day, timeZone=None):
+        return _call(Date, 'Date.fromYMD', year, month, day)
+
+
+_op('Date')(lambda value: DateValue(_millis(value)))
+_op('Date.get')(_date_field)
+_op('Date.millis')(lambda date: date.millis)
+_op('Date.format')(_format_date)
+_op('Date.advance')(lambda date, delta, unit: DateValue(_advance(date.millis, delta, unit)))
+_op('Date.difference')(lambda date, start, unit: (date.millis - _millis(start)) / _UNITS_MS[unit.rstrip('s')])
+
+
+@_op('Date.getRelative')
+def _date_get_relative(date, unit, in_unit):
+    dt = date.datetime
+    if unit == 'day' and in_unit == 'year':
+        return dt.timetuple().tm_yday - 1
+    if unit == 'day' and in_unit == 'month':
+        return dt.day - 1
+    if unit == 'month' and in_unit == 'year':
+        return dt.month - 1
+    raise ValueError(f'getRelative({unit}, {in_unit}) is not emulated')
+
+
+@_op('Date.fromYMD')
+def _date_from_ymd(year, month, day):
+    start = datetime.datetime(int(year), 1, 1, tzinfo=datetime.timezone.utc)
+    millis = _advance(int(start.timestamp() * 1000), int(month) - 1, 'month')
+    # Days beyond the end of the month roll over, as in Earth Engine
+    return DateValue(millis + (int(day) - 1) * DAY_MS)
+
+
+class Projection(ComputedObject):
+    def __init__(self, crs, transform=None, transformWkt=None):
+        self._node = current_session().node('Projection', (crs,))
+
+    def nominalScale(self):
+        return _call(Number, 'Projection.nominalScale', self)
+
+    def crs(self):
+        return _call(String, 'Projection.crs', self)
+
+    def atScale(self, meters):
+        return _call(Projection, 'Projection.atScale', self, meters)
+
+
+_op('Projection')(lambda crs: ProjectionValue(crs, current_session().scale))
+_op('Projection.nominalScale')(lambda projection: projection.scale)
+_op('Projection.crs')(lambda projection: projection.crs)
+_op('Projection.atScale')(lambda projection, meters: ProjectionValue(projection.crs, meters))
+
+
+# ---------------------------------------------------------------------------
+# Algorithms
+# ---------------------------------------------------------------------------
+
+@_op('If', lazy=True)
+def _if(session, condition, trueCase, falseCase):
+    return session.evaluate(trueCase if _truthy(session.evaluate(condition)) else falseCase)
+
+
+@_op('IsEqual')
+def _is_equal(left, right):
+    if isinstance(left, DateValue) and isinstance(right, DateValue):
+        return int(left.millis == right.millis)
+    if isinstance(left, (ImageValue, FeatureValue, GeometryValue)) or isinstance(right, (ImageValue, FeatureValue,
+                                                                                          GeometryValue)):
+        return int(left is right)
+    return int(left == right)
+
+
+class Algorithms:
+    @staticmethod
+    def If(condition, trueCase, falseCase):
+        return _call(ComputedObject, 'If', condition, trueCase, falseCase)
+
+    @staticmethod
+    def IsEqual(left, right):
+        return _call(Number, 'IsEqual', left, right)
+
+    @staticmethod
+    def CannyEdgeDetector(image, threshold, sigma=1):
+        return _call(Image, 'CannyEdgeDetector', image, threshold, sigma)
+
+
+# ---------------------------------------------------------------------------
+# Geometries and features
+# ---------------------------------------------------------------------------
+
+class Geometry(ComputedObject):
+    def centroid(self, maxError=None, proj=None):
+        return _call(Geometry, 'Geometry.centroid', self)
+
+    def area(self, maxError=None, proj=None):
+        return _call(Number, 'Geometry.area', self)
+
+    def buffer(self, distance, maxError=None, proj=None):
+        return _call(Geometry, 'Geometry.buffer', self, distance)
+
+    def bounds(self, maxError=None, proj=None):
+        return _call(Geometry, 'Geometry.bounds', self)
+
+    def dissolve(self, maxError=None, proj=None):
+        return self
+
+    def intersects(self, right, maxError=None, proj=None):
+        return _call(Number, 'Geometry.intersects', self, right)
+
+    def union(self, right, maxError=None, proj=None):
+        return _call(Geometry, 'Geometry.union', self, right)
+
+    @staticmethod
+    def Point(coords, proj=None):
+        return _call(Geometry, 'Geometry.Point', list(coords))
+
+
+def _point(row, col):
+    mask = np.zeros(current_session().shape, dtype=bool)
+    mask[row, col] = True
+    return GeometryValue(mask, (row, col))
+
+
+@_op('Geometry.Point')
+def _geometry_point(coords):
+    transform = current_session().transform
+    if transform is None:
+        raise ValueError('ee.Geometry.Point needs a session transform (lon0, lat0, dlon, dlat)')
+    lon0, lat0, dlon, dlat = transform
+    height, width = current_session().shape
+    row = min(max(int((lat0 - coords[1]) / dlat), 0), height - 1)
+    col = min(max(int((coords[0] - lon0) / dlon), 0), width - 1)
+    return _point(row, col)
+
+
+@_op('Geometry.centroid')
+def _geometry_centroid(geometry):
+    if geometry.point is not None:
+        return geometry
+    rows, cols = np.nonzero(geometry.mask)
+    if not len(rows):
+        return geometry
+    return _point(int(round(rows.mean())), int(round(cols.mean())))
+
+
+@_op('Geometry.bounds')
+def _geometry_bounds(geometry):
+    rows, cols = np.nonzero(geometry.mask)
+    mask = np.zeros_like(geometry.mask)
+    if len(rows):
+        mask[rows.min():rows.max() + 1, cols.min():cols.max() + 1] = True
+    return GeometryValue(mask)
+
+
+@_op('Geometry.buffer')
+def _geometry_buffer(geometry, distance):
+    radius = distance / current_session().scale
+    if radius >= 1:
+        mask = ndimage.binary_dilation(geometry.mask, structure=disk_footprint(radius))
+    elif radius <= -1:
+        mask = ndimage.binary_erosion(geometry.mask, structure=disk_footprint(-radius))
+    else:
+        mask = geometry.mask
+    return GeometryValue(mask)
+
+
+_op('Geometry.area')(lambda geometry: float(geometry.mask.sum()) * current_session().scale ** 2)
+_op('Geometry.intersects')(lambda left, right: int((left.mask & right.mask).any()))
+_op('Geometry.union')(lambda left, right: GeometryValue(left.mask | right.mask))
+
+
+def _props_args(args):
+    # set(key, value, ...) or set(dict)
+    if len(args) == 1:
+        return args[0]
+    return dict(zip(args[::2], args[1::2]))
+
+
+class Element(ComputedObject):
+    def set(self, *args):
+        return _call(type(self), 'Element.set', self, list(args))
+
+    def get(self, property):
+        return _call(ComputedObject, 'Element.get', self, property)
+
+    def propertyNames(self):
+        return _call(List, 'Element.propertyNames', self)
+
+    def toDictionary(self, properties=None):
+        return _call(Dictionary, 'Element.toDictionary', self, properties)
+
+    def copyProperties(self, source=None, properties=None, exclude=None):
+        return _call(type(self), 'Element.copyProperties', self, source, properties, exclude)
+
+
+def _with_props(element, props):
+    if isinstance(element, ImageValue):
+        return ImageValue(element.names, element.data, element.mask, props)
+    if isinstance(element, FeatureValue):
+        return FeatureValue(element.geometry, props)
+    raise TypeError(f'Cannot set properties of {type(element).__name__}')
+
+
+@_op('Element.set')
+def _element_set(element, args):
+    props = dict(element.props)
+    for key, value in _props_args(args).items():
+        if value is None:
+            # Null properties are dropped
+            props.pop(key, None)
+        else:
+            props[key] = value
+    return _with_props(element, props)
+
+
+@_op('Element.copyProperties')
+def _element_copy_properties(element, source, properties, exclude):
+    if source is None:
+        return element
+    copied = {k: v for k, v in source.props.items()
+              if (properties is None or k in properties) and (exclude is None or k not in exclude)}
+    if properties is None:
+        copied = {k: v for k, v in copied.items() if not k.startswith('system:')}
+    return _with_props(element, {**element.props, **copied})
+
+
+_op('Element.get')(lambda element, name: element.props.get(name))
+_op('Element.propertyNames')(lambda element: list(element.props))
+_op('Element.toDictionary')(lambda element, names: {k: v for k, v in element.props.items()
+                                                    if (names is None or k in names) and not k.startswith('system:')})
+
+
+class Feature(Element):
+    def __init__(self, geom, opt_properties=None):
+        if isinstance(geom, ComputedObject) and not isinstance(geom, Geometry) and opt_properties is None:
+            self._node = geom._node
+        else:
+            self._node = current_session().node('Feature', (geom, opt_properties))
+
+    def geometry(self, maxError=None, proj=None, geodesics=None):
+        return _call(Geometry, 'Feature.geometry', self)
+
+    def area(self, maxError=None, proj=None):
+        return self.geometry().area()
+
+    def centroid(self, maxError=None, proj=None):
+        return _call(Feature, 'Feature.centroid', self)
+
+
+@_op('Feature')
+def _feature(geometry, props):
+    if isinstance(geometry, FeatureValue):
+        return FeatureValue(geometry.geometry, {**geometry.props, **(props or {})})
+    return FeatureValue(geometry, props)
+
+
+_op('Feature.geometry')(lambda feature: feature.geometry)
+_op('Feature.centroid')(lambda feature: FeatureValue(_geometry_centroid(feature.geometry), feature.props))
+
+
+# ---------------------------------------------------------------------------
+# Images
+# ---------------------------------------------------------------------------
+
+def _grid_zeros(n_bands, value=0.0):
+    shape = (n_bands,) + current_session().shape
+    return np.full(shape, value, dtype=np.float64), np.ones(shape, dtype=bool)
+
+
+def _constant_image(values, names=None):
+    values = list(values) if isinstance(values, (list, tuple)) else [values]
+    data, mask = _grid_zeros(len(values))
+    for i, value in enumerate(values):
+        data[i] = value
+    if names is None:
+        names = ['constant'] if len(values) == 1 else [f'constant_{i}' for i in range(len(values))]
+    return ImageValue(names, data, mask)
+
+
+def _as_image(value):
+    if isinstance(value, ImageValue):
+        return value
+    return _constant_image(value)
+
+
+def _image_binary(name, fn):
+    @_op(f'Image.{name}')
+    def impl(left, right):
+        left, right = _as_image(left), _as_image(right)
+        n_left, n_right = len(left.names), len(right.names)
+        if n_left != n_right and 1 not in (n_left, n_right):
+            raise ValueError(f'Image.{name}: band counts {n_left} and {n_right} do not match')
+        names = left.names if n_left >= n_right else right.names
+        with np.errstate(all='ignore'):
+            data = np.asarray(fn(left.data, right.data), dtype=np.float64)
+        return ImageValue(names, data, left.mask & right.mask)
+
+    def method(self, image2):
+        return _call(Image, f'Image.{name}', self, image2)
+    method.__name__ = name
+    return method
+
+
+def _image_unary(name, fn):
+    @_op(f'Image.{name}')
+    def impl(image):
+        with np.errstate(all='ignore'):
+            data = np.asarray(fn(image.data), dtype=np.float64)
+        return ImageValue(image.names, data, image.mask)
+
+    def method(self):
+        return _call(Image, f'Image.{name}', self)
+    method.__name__ = name
+    return method
+
+
+def _divide(a, b):
+    return np.where(b == 0, 0.0, a / np.where(b == 0, 1, b))
+
+
+def _select_names(names, selectors):
+    indices = []
+    for selector in selectors:
+        if isinstance(selector, (int, np.integer)):
+            indices.append(int(selector))
+            continue
+        matches = [i for i, name in enumerate(names) if re.fullmatch(selector, name)]
+        if not matches:
+            raise ValueError(f"Band '{selector}' not found in {names}")
+        indices.extend(matches)
+    return indices
+
+
+def _band_arguments(args):
+    # select('a', 'b'), select(['a', 'b']) or select(['a'], ['new'])
+    if len(args) == 2 and isinstance(args[0], list) and isinstance(args[1], list):
+        return args[0], args[1]
+    if len(args) == 1 and isinstance(args[0], list):
+        return args[0], None
+    return list(args), None
+
+
+class Image(Element):
+    def __init__(self, args=None, version=None):
+        if isinstance(args, ComputedObject):
+            self._node = args._node
+        elif isinstance(args, str):
+            self._node = current_session().node('asset', (args,))
+        else:
+            self._node = current_session().node('Image.constant', (0 if args is None else args,))
+
+    # Arithmetic, comparison and logical operators
+    add = _image_binary('add', np.add)
+    subtract = _image_binary('subtract', np.subtract)
+    multiply = _image_binary('multiply', np.multiply)
+    divide = _image_binary('divide', _divide)
+    pow = _image_binary('pow', np.power)
+    max = _image_binary('max', np.maximum)
+    min = _image_binary('min', np.minimum)
+    gt = _image_binary('gt', np.greater)
+    gte = _image_binary('gte', np.greater_equal)
+    lt = _image_binary('lt', np.less)
+    lte = _image_binary('lte', np.less_equal)
+    eq = _image_binary('eq', np.equal)
+    neq = _image_binary('neq', np.not_equal)
+    And = _image_binary('And', lambda a, b: (a != 0) & (b != 0))
+    Or = _image_binary('Or', lambda a, b: (a != 0) | (b != 0))
+    bitwiseAnd = _image_binary('bitwiseAnd', lambda a, b: a.astype(np.int64) & b.astype(np.int64))
+    bitwiseOr = _image_binary('bitwiseOr', lambda a, b: a.astype(np.int64) | b.astype(np.int64))
+    rightShift = _image_binary('rightShift', lambda a, b: a.astype(np.int64) >> b.astype(np.int64))
+    leftShift = _image_binary('leftShift', lambda a, b: a.astype(np.int64) << b.astype(np.int64))
+    Not = _image_unary('Not', lambda a: a == 0)
+    abs = _image_unary('abs', np.abs)
+    sqrt = _image_unary('sqrt', np.sqrt)
+    exp = _image_unary('exp', np.exp)
+    log = _image_unary('log', np.log)
+    int = _image_unary('int', np.trunc)
+    toInt = _image_unary('toInt', np.trunc)
+    toFloat = _image_unary('toFloat', lambda a: a)
+    float = _image_unary('float', lambda a: a)
+    double = _image_unary('double', lambda a: a)
+
+    # Bands
+    def rename(self, *names):
+        return _call(Image, 'Image.rename', self, list(names[0]) if len(names) == 1 and isinstance(
+            names[0], (list, tuple)) else list(names))
+
+    def select(self, *args):
+        selectors, new_names = _band_arguments(list(args))
+        return _call(Image, 'Image.select', self, selectors, new_names)
+
+    def addBands(self, srcImg, names=None, overwrite=False):
+        return _call(Image, 'Image.addBands', self, srcImg, names, overwrite)
+
+    def bandNames(self):
+        return _call(List, 'Image.bandNames', self)
+
+    # Masks
+    def mask(self, mask=None):
+        if mask is None:
+            return _call(Image, 'Image.mask', self)
+        return self.updateMask(mask)
+
+    def updateMask(self, mask):
+        return _call(Image, 'Image.updateMask', self, mask)
+
+    def unmask(self, value=None, sameFootprint=True):
+        return _call(Image, 'Image.unmask', self, 0 if value is None else value)
+
+    def selfMask(self):
+        return _call(Image, 'Image.selfMask', self)
+
+    def clip(self, geometry):
+        return _call(Image, 'Image.clip', self, geometry)
+
+    def where(self, test, value):
+        return _call(Image, 'Image.where', self, test, value)
+
+    def blend(self, top):
+        return _call(Image, 'Image.blend', self, top)
+
+    # Neighbourhoods
+    def focal_min(self, radius=1.5, kernelType='circle', units='pixels', iterations=1, kernel=None):
+        return _call(Image, 'Image.focal', self, 'min', radius, units, iterations)
+
+    def focal_max(self, radius=1.5, kernelType='circle', units='pixels', iterations=1, kernel=None):
+        return _call(Image, 'Image.focal', self, 'max', radius, units, iterations)
+
+    def focal_mean(self, radius=1.5, kernelType='circle', units='pixels', iterations=1, kernel=None):
+        return _call(Image, 'Image.focal', self, 'mean', radius, units, iterations)
+
+    def connectedPixelCount(self, maxSize=100, eightConnected=True):
+        return _call(Image, 'Image.connectedPixelCount', self, maxSize, eightConnected)
+
+    # Projections (single grid)
+    def projection(self):
+        return _call(Projection, 'Image.projection', self)
+
+    def reproject(self, crs=None, crsTransform=None, scale=None):
+        return self
+
+    def reduceResolution(self, reducer=None, bestEffort=False, maxPixels=64):
+        return self
+
+    def setDefaultProjection(self, crs=None, crsTransform=None, scale=None):
+        return self
+
+    def date(self):
+        return Date(self.get('system:time_start'))
+
+    # Reductions
+    def reduceRegion(self, reducer, geometry=None, scale=None, crs=None, crsTransform=None, bestEffort=False,
+                     maxPixels=None, tileScale=1):
+        return _call(Dictionary, 'Image.reduceRegion', self, reducer, geometry)
+
+    def reduceRegions(self, collection, reducer, scale=None, crs=None, crsTransform=None, tileScale=1):
+        return _call(FeatureCollection, 'Image.reduceRegions', self, collection, reducer)
+
+    def stratifiedSample(self, numPoints, classBand=None, region=None, scale=None, projection=None, seed=0,
+                         classValues=None, classPoints=None, dropNulls=True, tileScale=1, geometries=False):
+        return _call(FeatureCollection, 'Image.stratifiedSample', self, numPoints, classBand, region, seed,
+                     classValues, classPoints, dropNulls, geometries)
+
+    @staticmethod
+    def constant(value):
+        return _call(Image, 'Image.constant', value)
+
+    @staticmethod
+    def pixelArea():
+        return _call(Image, 'Image.pixelArea')
+
+    @staticmethod
+    def cat(*images):
+        images = list(images[0]) if len(images) == 1 and isinstance(images[0], (list, tuple)) else list(images)
+        return _call(Image, 'Image.cat', images)
+
+
+@_op('Image.constant')
+def _image_constant(value):
+    if isinstance(value, ImageValue):
+        return value
+    return _constant_image(value)
+
+
+@_op('Image.pixelArea')
+def _image_pixel_area():
+    return _constant_image(float(current_session().scale) ** 2, ['area'])
+
+
+@_op('Image.cat')
+def _image_cat(images):
+    images = [_as_image(image) for image in images]
+    return ImageValue(sum((image.names for image in images), []),
+                      np.concatenate([image.data for image in images]),
+                      np.concatenate([image.mask for image in images]))
+
+
+@_op('Image.rename')
+def _image_rename(image, names):
+    if len(names) != len(image.names):
+        raise ValueError(f'rename: {len(names)} names for {len(image.names)} bands')
+    return ImageValue(names, image.data, image.mask, image.props)
+
+
+@_op('Image.select')
+def _image_select(image, selectors, new_names):
+    indices = _select_names(image.names, selectors)
+    names = [image.names[i] for i in indices] if new_names is None else list(new_names)
+    return ImageValue(names, image.data[indices], image.mask[indices], image.props)
+
+
+@_op('Image.addBands')
+def _image_add_bands(image, source, names, overwrite):
+    source = _as_image(source)
+    indices = range(len(source.names)) if names is None else _select_names(source.names, names)
+    result = ImageValue(image.names, image.data, image.mask, image.props)
+    for i in indices:
+        name = source.names[i]
+        if name in result.names:
+            if not overwrite:
+                raise ValueError(f"addBands: duplicate band name '{name}'")
+            k = result.names.index(name)
+            data, mask = result.data.copy(), result.mask.copy()
+            data[k], mask[k] = source.data[i], source.mask[i]
+            result = ImageValue(result.names, data, mask, result.props)
+        else:
+            result = ImageValue(result.names + [name], np.concatenate([result.data, source.data[i:i + 1]]),
+                                np.concatenate([result.mask, source.mask[i:i + 1]]), result.props)
+    return result
+
+
+_op('Image.bandNames')(lambda image: list(image.names))
+_op('Image.mask')(lambda image: ImageValue(image.names, image.mask.astype(np.float64), np.ones_like(image.mask)))
+_op('Image.projection')(lambda image: ProjectionValue('emulated', current_session().scale))
+
+
+def _mask_of(mask_image, n_bands):
+    mask_image = _as_image(mask_image)
+    valid = mask_image.mask & (mask_image.data != 0)
+    if valid.shape[0] not in (1, n_bands):
+        raise ValueError('Mask band count does not match the image')
+    return valid
+
+
+@_op('Image.updateMask')
+def _image_update_mask(image, mask):
+    return ImageValue(image.names, image.data, image.mask & _mask_of(mask, len(image.names)), image.props)
+
+
+@_op('Image.unmask')
+def _image_unmask(image, value):
+    fill = _as_image(value)
+    return ImageValue(image.names, np.where(image.mask, image.data, fill.data), np.ones_like(image.mask),
+                      image.props)
+
+
+_op('Image.selfMask')(lambda image: ImageValue(image.names, image.data, image.mask & (image.data != 0),
+                                              image.props))
+_op('Image.clip')(lambda image, geometry: ImageValue(image.names, image.data, image.mask & geometry.mask,
+                                                    image.props))
+
+
+@_op('Image.where')
+def _image_where(image, test, value):
+    test, value = _as_image(test), _as_image(value)
+    replace = test.mask & (test.data != 0)
+    return ImageValue(image.names, np.where(replace, value.data, image.data),
+                      np.where(replace, image.mask & value.mask, image.mask), image.props)
+
+
+@_op('Image.blend')
+def _image_blend(image, top):
+    top = _as_image(top)
+    return ImageValue(image.names, np.where(top.mask, top.data, image.data), image.mask | top.mask)
+
+
+@_op('Image.focal')
+def _image_focal(image, kind, radius, units, iterations):
+    if units == 'meters':
+        radius = radius / current_session().scale
+    footprint = disk_footprint(radius)
+    data, mask = image.data, image.mask
+    for _ in range(int(iterations)):
+        new_data, new_mask = np.empty_like(data), np.empty_like(mask)
+        for b in range(data.shape[0]):
+            if kind == 'mean':
+                mean = focal_mean(data[b], mask[b], radius)
+                new_data[b], new_mask[b] = np.nan_to_num(mean), np.isfinite(mean)
+                continue
+            # Masked pixels and pixels outside the grid do not take part in the min/max
+            fill = np.inf if kind == 'min' else -np.inf
+            filt = ndimage.minimum_filter if kind == 'min' else ndimage.maximum_filter
+            result = filt(np.where(mask[b], data[b], fill), footprint=footprint, mode='constant', cval=fill)
+            new_mask[b] = np.isfinite(result)
+            new_data[b] = np.where(new_mask[b], result, 0)
+        data, mask = new_data, new_mask
+    return ImageValue(image.names, data, mask)
+
+
+@_op('Image.connectedPixelCount')
+def _image_connected_pixel_count(image, max_size, eight_connected):
+    structure = ndimage.generate_binary_structure(2, 2 if eight_connected else 1)
+    data = np.zeros_like(image.data)
+    for b in range(data.shape[0]):
+        valid = image.mask[b]
+        for value in np.unique(image.data[b][valid]):
+            labels, _ = ndimage.label(valid & (image.data[b] == value), structure=structure)
+            sizes = np.bincount(labels.ravel())
+            sizes[0] = 0
+            data[b] += sizes[labels]
+        data[b] = np.minimum(data[b], max_size)
+    return ImageValue(image.names, data, image.mask.copy())
+
+
+@_op('CannyEdgeDetector')
+def _canny(image, threshold, sigma):
+    data = canny_edges(np.where(image.mask, image.data, 0), threshold, sigma)
+    return ImageValue(image.names, data, image.mask.copy())
+
+
+def _output_names(band_names, reducer):
+    names = [name for name, _ in reducer.outputs]
+    if len(names) == 1:
+        return [[band] for band in band_names], names
+    return [[f'{band}_{name}' for name in names] for band in band_names], names
+
+
+def _reduce_pixels(image, reducer, region_mask):
+    reducer = _reducer(reducer)
+    keys, names = _output_names(image.names, reducer)
+    result = {}
+    for b in range(len(image.names)):
+        valid = image.mask[b] if region_mask is None else image.mask[b] & region_mask
+        outputs = reducer.apply(image.data[b][valid])
+        for key, name in zip(keys[b], names):
+            result[key] = outputs[name]
+    return result
+
+
+_op('Image.reduceRegion')(lambda image, reducer, geometry: _reduce_pixels(
+    image, reducer, None if geometry is None else geometry.mask))
+
+
+@_op('Image.reduceRegions')
+def _image_reduce_regions(image, features, reducer):
+    return [FeatureValue(f.geometry, {**f.props, **_reduce_pixels(image, reducer, f.geometry.mask)})
+            for f in features]
+
+
+@_op('Image.stratifiedSample')
+def _image_stratified_sample(image, num_points, class_band, region, seed, class_values, class_points, drop_nulls,
+                             geometries):
+    class_index = 0 if class_band is None else image.names.index(class_band)
+    valid = image.mask.all(axis=0) if drop_nulls else image.mask[class_index].copy()
+    if region is not None:
+        valid &= region.mask
+    classes = np.trunc(image.data[class_index])
+    rng = np.random.default_rng(seed)
+    features = []
+    for value in np.unique(classes[valid]):
+        rows, cols = np.nonzero(valid & (classes == value))
+        n = num_points
+        if class_values is not None and value in class_values:
+            n = class_points[list(class_values).index(value)]
+        if len(rows) > n:
+            pick = np.sort(rng.choice(len(rows), size=n, replace=False))
+            rows, cols = rows[pick], cols[pick]
+        for row, col in zip(rows, cols):
+            props = {name: image.data[b, row, col].item() for b, name in enumerate(image.names)}
+            props[image.names[class_index]] = int(value)
+            features.append(FeatureValue(_point(row, col) if geometries else None, props))
+    return features
+
+
+# ---------------------------------------------------------------------------
+# Collections
+# ---------------------------------------------------------------------------
+
+def _collection_reduce(images, kind):
+    if not images:
+        return ImageValue([], *_grid_zeros(0))
+    names = images[0].names
+    data = np.stack([image.data for image in images])
+    mask = np.stack([image.mask for image in images])
+    count = mask.sum(axis=0)
+    with np.errstate(all='ignore'):
+        if kind == 'mean':
+            values = np.where(mask, data, 0).sum(axis=0) / np.maximum(count, 1)
+        elif kind == 'sum':
+            values = np.where(mask, data, 0).sum(axis=0)
+        elif kind == 'max':
+            values = np.where(mask, data, -np.inf).max(axis=0)
+        elif kind == 'min':
+            values = np.where(mask, data, np.inf).min(axis=0)
+        elif kind == 'median':
+            values = np.nan_to_num(np.nanmedian(np.where(mask, data, np.nan), axis=0))
+        elif kind == 'count':
+            values = count.astype(np.float64)
+        elif kind in ('mosaic', 'firstNonNull'):
+            order = range(len(images)) if kind == 'mosaic' else reversed(range(len(images)))
+            values = np.zeros_like(data[0])
+            for i in order:
+                values = np.where(mask[i], data[i], values)
+        else:
+            raise ValueError(f'Unknown collection reduction {kind}')
+    if kind == 'count':
+        return ImageValue(names, values, np.ones_like(count, dtype=bool))
+    return ImageValue(names, np.where(count > 0, values, 0), count > 0)
+
+
+class Collection(Element):
+    def filter(self, filter):
+        return _call(type(self), 'Collection.filter', self, filter)
+
+    def filterBounds(self, geometry):
+        return _call(type(self), 'Collection.filterBounds', self, geometry)
+
+    def filterDate(self, start, end=None):
+        return self.filter(Filter.date(start, end))
+
+    def map(self, algorithm, dropNulls=False):
+        return _call(type(self), 'Collection.map', self, algorithm, dropNulls)
+
+    def size(self):
+        return _call(Number, 'Collection.size', self)
+
+    def toList(self, count, offset=0):
+        return _call(List, 'Collection.toList', self, count, offset)
+
+    def sort(self, property, ascending=True):
+        return _call(type(self), 'Collection.sort', self, property, ascending)
+
+    def limit(self, max, property=None, ascending=True):
+        return _call(type(self), 'Collection.limit', self, max, property, ascending)
+
+    def aggregate_array(self, property):
+        return _call(List, 'Collection.aggregate_array', self, property)
+
+    def _aggregate(self, property, kind):
+        return _call(Number, 'Collection.aggregate', self, property, kind)
+
+    def aggregate_mean(self, property):
+        return self._aggregate(property, 'mean')
+
+    def aggregate_sum(self, property):
+        return self._aggregate(property, 'sum')
+
+    def aggregate_min(self, property):
+        return self._aggregate(property, 'min')
+
+    def aggregate_max(self, property):
+        return self._aggregate(property, 'max')
+
+    def aggregate_count(self, property):
+        return self._aggregate(property, 'count')
+
+
+@_op('Collection.filter')
+def _collection_filter(elements, filter):
+    session = current_session()
+    return [e for e in elements if filter.matches(e.props, session)]
+
+
+@_op('Collection.filterBounds')
+def _collection_filter_bounds(elements, geometry):
+    kept = []
+    for element in elements:
+        if isinstance(element, ImageValue):
+            footprint = element.props.get('system:footprint')
+            if footprint is None or (footprint.mask & geometry.mask).any():
+                kept.append(element)
+        elif element.geometry is not None and (element.geometry.mask & geometry.mask).any():
+            kept.append(element)
+    return kept
+
+
+@_op('Collection.map', lazy=True)
+def _collection_map(session, elements, algorithm, drop_nulls):
+    results = [session.evaluate(algorithm(_wrap_value(e))) for e in session.evaluate(elements)]
+    return [r for r in results if r is not None] if drop_nulls else results
+
+
+_op('Collection.size')(len)
+_op('Collection.toList')(lambda elements, count, offset: elements[int(offset):int(offset) + int(count)])
+_op('Collection.sort')(lambda elements, name, ascending: sorted(elements, key=lambda e: e.props.get(name),
+                                                               reverse=not ascending))
+_op('Collection.aggregate_array')(lambda elements, name: [e.props[name] for e in elements
+                                                          if e.props.get(name) is not None])
+
+
+@_op('Collection.limit')
+def _collection_limit(elements, n, name, ascending):
+    if name is not None:
+        elements = sorted(elements, key=lambda e: e.props.get(name), reverse=not ascending)
+    return elements[:int(n)]
+
+
+@_op('Collection.aggregate')
+def _collection_aggregate(elements, name, kind):
+    values = [e.props[name] for e in elements if e.props.get(name) is not None]
+    return _SIMPLE_REDUCERS[kind](values)
+
+
+class ImageCollection(Collection):
+    def __init__(self, args):
+        if isinstance(args, ComputedObject):
+            self._node = args._node
+        elif isinstance(args, str):
+            self._node = current_session().node('asset', (args,))
+        else:
+            self._node = current_session().node('List', (list(args),))
+
+    def _reduce(self, kind):
+        return _call(Image, 'ImageCollection.reduce', self, kind)
+
+    def mean(self):
+        return self._reduce('mean')
+
+    def median(self):
+        return self._reduce('median')
+
+    def max(self):
+        return self._reduce('max')
+
+    def min(self):
+        return self._reduce('min')
+
+    def sum(self):
+        return self._reduce('sum')
+
+    def count(self):
+        return self._reduce('count')
+
+    def mosaic(self):
+        return self._reduce('mosaic')
+
+    def reduce(self, reducer, parallelScale=1):
+        # Per-pixel reduction with a simple reducer; outputs are named <band>_<reducer>
+        return _call(Image, 'ImageCollection.reduceWith', self, reducer)
+
+    def first(self):
+        return _call(Image, 'ImageCollection.first', self)
+
+    def select(self, *args):
+        selectors, new_names = _band_arguments(list(args))
+        return self.map(lambda image: image.select(selectors, new_names) if new_names is not None
+                        else image.select(selectors))
+
+    def getInfo(self):
+        return {'type': 'ImageCollection', 'features': _info(current_session().evaluate(self))}
+
+    @staticmethod
+    def fromImages(images):
+        return ImageCollection(List(images) if not isinstance(images, ComputedObject) else images)
+
+
+_op('ImageCollection.reduce')(_collection_reduce)
+_op('ImageCollection.first')(lambda images: images[0] if images else None)
+
+
+@_op('ImageCollection.reduceWith')
+def _image_collection_reduce_with(images, reducer):
+    name = reducer._spec[1] if reducer._spec[0] == 'simple' else None
+    if name not in ('mean', 'median', 'max', 'min', 'sum', 'count', 'firstNonNull'):
+        raise ValueError('ImageCollection.reduce is emulated for simple reducers only')
+    image = _collection_reduce(images, name)
+    return ImageValue([f'{band}_{name}' for band in image.names], image.data, image.mask)
+
+
+class FeatureCollection(Collection):
+    def __init__(self, args, opt_column=None):
+        if isinstance(args, ComputedObject) and not isinstance(args, Feature):
+            self._node = args._node
+        elif isinstance(args, str):
+            self._node = current_session().node('asset', (args,))
+        elif isinstance(args, Feature):
+            self._node = current_session().node('List', ([args],))
+        else:
+            self._node = current_session().node('List', (list(args),))
+
+    def first(self):
+        return _call(Feature, 'FeatureCollection.first', self)
+
+    def geometry(self, maxError=None):
+        return _call(Geometry, 'FeatureCollection.geometry', self)
+
+    def reduceColumns(self, reducer, selectors, weightSelectors=None):
+        return _call(Dictionary, 'FeatureCollection.reduceColumns', self, reducer, list(selectors))
+
+    def reduceToImage(self, properties, reducer):
+        return _call(Image, 'FeatureCollection.reduceToImage', self, list(properties), reducer)
+
+    def select(self, propertySelectors, newProperties=None, retainGeometry=True):
+        return _call(FeatureCollection, 'FeatureCollection.select', self, list(propertySelectors),
+                     None if newProperties is None else list(newProperties))
+
+    def flatten(self):
+        return _call(FeatureCollection, 'FeatureCollection.flatten', self)
+
+    def getInfo(self):
+        return {'type': 'FeatureCollection', 'features': _info(current_session().evaluate(self))}
+
+
+_op('FeatureCollection.first')(lambda features: features[0] if features else None)
+_op('FeatureCollection.flatten')(lambda collections: [f for c in collections for f in c])
+
+
+@_op('FeatureCollection.geometry')
+def _feature_collection_geometry(features):
+    mask = np.zeros(current_session().shape, dtype=bool)
+    for feature in features:
+        if feature.geometry is not None:
+            mask |= feature.geometry.mask
+    return GeometryValue(mask)
+
+
+@_op('FeatureCollection.select')
+def _feature_collection_select(features, selectors, new_names):
+    names = [name for name in selectors]
+    new_names = new_names or names
+    return [FeatureValue(f.geometry, {new: f.props.get(old) for old, new in zip(names, new_names)})
+            for f in features]
+
+
+@_op('FeatureCollection.reduceColumns')
+def _feature_collection_reduce_columns(features, reducer, selectors):
+    columns = [[f.props.get(name) for f in features] for name in selectors]
+    if reducer._spec[0] != 'group':
+        rows = [v for v in columns[0] if v is not None]
+        return reducer.apply(rows)
+    _, inner, group_field, group_name = reducer._spec
+    groups = {}
+    for value, key in zip(columns[0 if group_field != 0 else 1], columns[group_field]):
+        if value is not None and key is not None:
+            groups.setdefault(key, []).append(value)
+    return {'groups': [{group_name: key, **inner.apply(values)} for key, values in sorted(groups.items())]}
+
+
+@_op('FeatureCollection.reduceToImage')
+def _feature_collection_reduce_to_image(features, properties, reducer):
+    name = reducer._spec[1]
+    shape = current_session().shape
+    values = [[] for _ in range(shape[0] * shape[1])]
+    for feature in features:
+        value = feature.props.get(properties[0])
+        if feature.geometry is None or value is None:
+            continue
+        for index in np.flatnonzero(feature.geometry.mask):
+            values[index].append(value)
+    data = np.zeros(len(values))
+    mask = np.zeros(len(values), dtype=bool)
+    for index, pixel_values in enumerate(values):
+        if pixel_values:
+            data[index] = _SIMPLE_REDUCERS[name](pixel_values)
+            mask[index] = True
+    return ImageValue([name], data.reshape((1,) + shape), mask.reshape((1,) + shape))
+
+
+# ---------------------------------------------------------------------------
+# Terrain
+# ---------------------------------------------------------------------------
+
+class Terrain:
+    @staticmethod
+    def aspect(input):
+        return _call(Image, 'Terrain.aspect', input)
+
+    @staticmethod
+    def slope(input):
+        return _call(Image, 'Terrain.slope', input)
+
+
+def _gradients(dem):
+    data = np.where(dem.mask[0], dem.data[0], np.nan)
+    dzdy, dzdx = np.gradient(data, current_session().scale)
+    return dzdy, dzdx
+
+
+@_op('Terrain.aspect')
+def _terrain_aspect(dem):
+    # Degrees clockwise from north (rows increase southwards)
+    dzdy, dzdx = _gradients(dem)
+    aspect = (np.degrees(np.arctan2(-dzdx, dzdy)) + 360) % 360
+    valid = np.isfinite(aspect)
+    return ImageValue(['aspect'], np.nan_to_num(aspect)[np.newaxis], valid[np.newaxis])
+
+
+@_op('Terrain.slope')
+def _terrain_slope(dem):
+    dzdy, dzdx = _gradients(dem)
+    slope = np.degrees(np.arctan(np.hypot(dzdx, dzdy)))
+    valid = np.isfinite(slope)
+    return ImageValue(['slope'], np.nan_to_num(slope)[np.newaxis], valid[np.newaxis])
+
+
+# ---------------------------------------------------------------------------
+# Fixtures and session
+# ---------------------------------------------------------------------------
+
+def image_from_arrays(bands, properties=None):
+    """
+    Image from NumPy arrays on the session grid.
+
+    Args:
+        bands: Dictionary of band name -> (y, x) array (NaN where masked) or (array, mask)
+        properties: Image properties, e.g. {'system:time_start': millis}
+
+    Returns:
+        Image
+    """
+    names, data, mask = [], [], []
+    for name, band in bands.items():
+        values, valid = band if isinstance(band, tuple) else (band, None)
+        values = np.asarray(values, dtype=np.float64)
+        valid = np.isfinite(values) if valid is None else np.asarray(valid, dtype=bool) & np.isfinite(values)
+        names.append(name)
+        data.append(np.where(valid, values, 0))
+        mask.append(valid)
+    value = ImageValue(names, np.stack(data), np.stack(mask), properties)
+    return _call(Image, 'constant', value)
+
+
+def collection_from_arrays(stack, times, band='value', properties=None):
+    """
+    ImageCollection from a (time, y, x) stack (NaN where masked) and times in milliseconds.
+    """
+    images = []
+    for i, (scene, time) in enumerate(zip(stack, times)):
+        props = {'system:time_start': int(time), 'system:index': str(i)}
+        props.update((properties or [{}] * len(stack))[i] if properties is not None else {})
+        images.append(image_from_arrays({band: scene}, props))
+    return ImageCollection(images)
+
+
+def geometry_from_mask(mask):
+    """
+    Geometry covering the True pixels of a (y, x) boolean array.
+    """
+    return _call(Geometry, 'constant', GeometryValue(np.asarray(mask, dtype=bool)))
+
+
+def feature_collection_from_masks(masks, properties=None):
+    """
+    FeatureCollection with one feature per (y, x) boolean mask and its properties.
+    """
+    properties = properties or [{} for _ in masks]
+    features = [FeatureValue(GeometryValue(np.asarray(mask, dtype=bool)), props)
+                for mask, props in zip(masks, properties)]
+    return _call(FeatureCollection, 'constant', features)
+
+
+def register_asset(asset_id, obj):
+    """
+    Make ee.Image(asset_id), ee.ImageCollection(asset_id) or ee.FeatureCollection(asset_id)
+    return obj in the current session.
+    """
+    current_session().assets[asset_id] = obj
+
+
+def evaluate(obj):
+    """
+    Evaluated value of an emulated object.
+    """
+    return current_session().evaluate(obj)
+
+
+def to_numpy(image, band=None):
+    """
+    Pixels of an emulated image as a float array (bands, y, x) or (y, x) for one band,
+    with NaN where masked.
+    """
+    value = current_session().evaluate(image)
+    data = np.where(value.mask, value.data, np.nan)
+    if band is not None:
+        return data[value.names.index(band) if isinstance(band, str) else band]
+    return data
+
+
+@contextlib.contextmanager
+def emulated(shape, scale=500, modules=DEFAULT_MODULES, seed=0, transform=None):
+    """
+    Run the given src modules against the emulator: inside the block their `ee` refers to
+    this module and a new Session holds the graph and the fixtures.
+
+    Args:
+        shape: (y, x) shape of the pixel grid
+        scale: Pixel size in meters
+        modules: Names of the modules whose `ee` is replaced
+        seed: Default sampling seed
+        transform: Optional (lon0, lat0, dlon, dlat) for ee.Geometry.Point
+
+    Yields:
+        Session (stats, memo, assets)
+    """
+    global _session
+    import sys
+    emulator = sys.modules[__name__]
+    previous_session = _session
+    _session = Session(shape, scale, seed, transform)
+    replaced = []
+    try:
+        for name in modules:
+            module = importlib.import_module(name)
+            if hasattr(module, 'ee'):
+                replaced.append((module, module.ee))
+                module.ee = emulator
+        yield _session
+    finally:
+        for module, original in replaced:
+            module.ee = original
+        _session = previous_session
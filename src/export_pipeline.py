@@ -0,0 +1,454 @@
+import datetime
+import hashlib
+import json
+import math
+import os
+import time
+
+import ee
+
+from src.dem_processing import classify_aspect, reproject_and_analyze_dem
+from src.modis_processing import create_decadal_composites, create_decadal_composites_250, decadal_intervals
+from src.snowline import calculate_glacier_metrics, get_snowline_elevation, glacier_raster
+from src.task_backend import ACTIVE_STATES, EETaskBackend
+
+# Resumable, incremental export of the decadal SLA/FSC tables.
+# A work unit is one (basin, year, decade) triple, with decades numbered 1-36 within a
+# year (three per month starting on the 1st, 11th and 21st). A JSON manifest records the
+# outcome of every unit, so a run after a crash or a quota error only submits the units
+# that are missing or stale. All decades of a basin and year live in one table asset, so a
+# re-export of some decades also rewrites the completed decades of that year (see
+# group_units) and no decade is ever left behind in an outdated asset.
+# The NIR table of all basins is built from one set of 250 m composites over the union of
+# the basins, reduced over all basins at once (build_nir_table).
+
+DECADE_START_DAYS = (1, 11, 21)
+
+
+def decade_bounds(year, decade):
+    """
+    Start (inclusive) and end (exclusive) of a decade of the year as UTC datetimes.
+
+    Args:
+        year: Year
+        decade: Decade of the year (1-36)
+
+    Returns:
+        tuple: (start, end) datetime.datetime
+    """
+    month, part = divmod(decade - 1, 3)
+    start = datetime.datetime(year, month + 1, DECADE_START_DAYS[part], tzinfo=datetime.timezone.utc)
+    if decade == 36:
+        end = datetime.datetime(year + 1, 1, 1, tzinfo=datetime.timezone.utc)
+    else:
+        end = decade_bounds(year, decade + 1)[0]
+    return start, end
+
+
+def decade_of_year(date):
+    """
+    Decade of the year (1-36) of a composite start date, consistent with the 'decade' property
+    of the exports (ceil((day + 2) / 10) within the month).
+    """
+    return (date.month - 1) * 3 + math.ceil((date.day + 2) / 10)
+
+
+def intervals_for_decades(year, decades, agg_interval=10):
+    """
+    Composite intervals (see decadal_intervals) of the given decades of a year.
+    """
+    intervals = []
+    for start, end in decadal_intervals(year, year, agg_interval):
+        date = datetime.datetime.fromtimestamp(start / 1000, datetime.timezone.utc)
+        if date.year == year and decade_of_year(date) in decades:
+            intervals.append((start, end))
+    return intervals
+
+
+def unit_key(basin, year, decade):
+    return f'{basin}|{year}|{decade}'
+
+
+def params_fingerprint(params):
+    """
+    Short hash of the processing parameters; units exported with other parameters are stale.
+    """
+    return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:12]
+
+
+def load_manifest(path):
+    """
+    Load the manifest of exported units, or an empty one if the file does not exist.
+    """
+    if not os.path.exists(path):
+        return {'units': {}, 'tasks': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, path):
+    """
+    Write the manifest atomically, so an interrupted run never leaves a truncated file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def plan_units(manifest, basins, years, fingerprint, now=None, settle_days=5):
+    """
+    List the (basin, year, decade) units that need to be exported.
+    A unit is due if its decade has ended and it was never exported successfully, was exported
+    with other parameters, or was exported before its data was final (less than settle_days after
+    the end of the decade, when late MODIS scenes may still arrive). Units of a basin and year
+    with a task still running are not due, since that task rewrites the year's asset.
+
+    Args:
+        manifest: Manifest as returned by load_manifest
+        basins: Basin names
+        years: Years to cover
+        fingerprint: Fingerprint of the processing parameters (params_fingerprint)
+        now: Current time as timezone-aware datetime (default: now)
+        settle_days: Days after the end of a decade until its data is considered final
+
+    Returns:
+        list of (basin, year, decade) tuples
+    """
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    settle = datetime.timedelta(days=settle_days)
+    units = []
+    for basin in basins:
+        for year in years:
+            if any(manifest['units'].get(unit_key(basin, year, decade), {}).get('state') in ACTIVE_STATES
+                   for decade in range(1, 37)):
+                continue
+            for decade in range(1, 37):
+                end = decade_bounds(year, decade)[1]
+                if end > now:
+                    break
+                record = manifest['units'].get(unit_key(basin, year, decade))
+                if record is not None:
+                    if (record['state'] == 'COMPLETED' and record.get('fingerprint') == fingerprint
+                            and datetime.datetime.fromisoformat(record['completed']) >= end + settle):
+                        continue
+                units.append((basin, year, decade))
+    return units
+
+
+def group_units(units, manifest=None):
+    """
+    Group units by (basin, year); each group is exported as one task to the asset of its
+    basin and year. With a manifest, the decades of the year that were already exported
+    (COMPLETED) are added to the group, since the new export replaces the year's asset.
+
+    Returns:
+        list of (basin, year, [decades]) tuples
+    """
+    groups = {}
+    for basin, year, decade in units:
+        groups.setdefault((basin, year), set()).add(decade)
+    if manifest is not None:
+        for (basin, year), decades in groups.items():
+            decades.update(decade for decade in range(1, 37)
+                           if manifest['units'].get(unit_key(basin, year, decade), {}).get('state') == 'COMPLETED')
+    return [(basin, year, sorted(decades)) for (basin, year), decades in groups.items()]
+
+
+def run_incremental_exports(basins, years, make_task, manifest_path, params=None, backend=None, max_concurrent=10,
+                            poll_interval=30, settle_days=5, now=None, sleep=time.sleep, verbose=True):
+    """
+    Export all missing or stale (basin, year, decade) units and record the task outcomes.
+    Tasks are submitted per (basin, year) with at most max_concurrent tasks active at a time.
+    The manifest is saved after every change, so the run can be interrupted and resumed.
+
+    Args:
+        basins: Basin names
+        years: Years to cover
+        make_task: Function (basin, year, decades) -> (task, description) creating an export task
+        manifest_path: Path of the JSON manifest
+        params: Processing parameters; changing them makes all units stale
+        backend: Task backend (default: EETaskBackend)
+        max_concurrent: Maximum number of active tasks
+        poll_interval: Seconds between task status polls
+        settle_days: Days after the end of a decade until its data is considered final
+        now: Current time as timezone-aware datetime (default: now)
+        sleep: Sleep function, replaceable when running against a local backend
+        verbose: Print progress
+
+    Returns:
+        dict: Number of units per final state in this run ('COMPLETED', 'FAILED', ...)
+    """
+    backend = backend or EETaskBackend()
+    manifest = load_manifest(manifest_path)
+    fingerprint = params_fingerprint(params or {})
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+
+    def record(task_id, state, error=None):
+        task = manifest['tasks'][task_id]
+        task['state'] = state
+        if error:
+            task['error'] = error
+        for basin, year, decade in task['units']:
+            manifest['units'][unit_key(basin, year, decade)] = {
+                'state': state,
+                'task_id': task_id,
+                'fingerprint': task['fingerprint'],
+                'completed': datetime.datetime.now(datetime.timezone.utc).isoformat() if state == 'COMPLETED' else None,
+            }
+
+    def poll(task_ids):
+        for task_id, state in backend.status(task_ids).items():
+            if state not in ACTIVE_STATES:
+                record(task_id, state)
+        save_manifest(manifest, manifest_path)
+
+    # Refresh tasks left running by a previous run
+    active = [task_id for task_id, task in manifest['tasks'].items() if task['state'] in ACTIVE_STATES]
+    if active:
+        poll(active)
+
+    groups = group_units(plan_units(manifest, basins, years, fingerprint, now, settle_days), manifest)
+    if verbose:
+        print(f'{sum(len(g[2]) for g in groups)} units due in {len(groups)} tasks')
+
+    outcome = {}
+    in_flight = []
+    while groups or in_flight:
+        # Submit while there is room
+        while groups and len(in_flight) < max_concurrent:
+            basin, year, decades = groups.pop(0)
+            task, description = make_task(basin, year, decades)
+            units = [[basin, year, decade] for decade in decades]
+            try:
+                task_id = backend.start(task, description)
+            except ee.EEException as e:
+                task_id = f'failed-start:{description}'
+                manifest['tasks'][task_id] = {'description': description, 'units': units, 'fingerprint': fingerprint}
+                record(task_id, 'FAILED', str(e))
+                outcome['FAILED'] = outcome.get('FAILED', 0) + len(units)
+                if verbose:
+                    print(f'  Could not start {description}: {e}')
+                continue
+            manifest['tasks'][task_id] = {'description': description, 'units': units, 'fingerprint': fingerprint}
+            record(task_id, 'READY')
+            in_flight.append(task_id)
+            if verbose:
+                print(f'  Started {description} ({len(decades)} decades)')
+        save_manifest(manifest, manifest_path)
+
+        if not in_flight:
+            continue
+        sleep(poll_interval)
+        poll(in_flight)
+        still_running = []
+        for task_id in in_flight:
+            state = manifest['tasks'][task_id]['state']
+            if state in ACTIVE_STATES:
+                still_running.append(task_id)
+            else:
+                outcome[state] = outcome.get(state, 0) + len(manifest['tasks'][task_id]['units'])
+                if verbose:
+                    print(f"  {manifest['tasks'][task_id]['description']}: {state}")
+        in_flight = still_running
+
+    return outcome
+
+
+def build_sla_features(modis_ic, aoi, dem, reprojected_dem, aspects, aspect_coded, min_dem_dict, max_dem_dict, n_grid,
+                       glims, scale=500, sc_th=50, tile_scale=2,
+                       aspect_keys=['East', 'North', 'South', 'West', 'mixed'], glacier_filter=None):
+    """
+    Snowline, fractional snow cover and glacier metrics for every composite, as exported to
+    the decadal_SLA assets. glacier_filter optionally selects the glaciers of the AOI by id.
+
+    Returns:
+        ee.FeatureCollection with one feature per composite located at the AOI centroid
+    """
+    # Glacier raster of the basin, shared by all composites
+    glacier_image = glacier_raster(glims, aoi, glacier_filter)
+
+    def create_feature_with_properties(img):
+        # Get snowline elevation for this image
+        current_snowline_stats, current_fsc = get_snowline_elevation(
+            img, reprojected_dem, aspect_coded, aoi, min_dem_dict, max_dem_dict, n_grid,
+            scale=scale, scale_dem=scale, sc_th=sc_th, canny_threshold=0.7,
+            canny_sigma=0.7, ppha=10, tile_scale=1, point2sample=1000,
+            aspectKeys=aspect_keys
+        )
+
+        # Calculate glacier metrics
+        current_glacier_metrics = calculate_glacier_metrics(
+            glims, aoi, img, sc_th, current_snowline_stats, dem, aspect_keys, tile_scale, aspects,
+            glacier_image=glacier_image
+        )
+
+        # Get date info
+        img_date = ee.Date(img.get('system:time_start'))
+        img_decade = ee.Number(img_date.get('day')).add(2).divide(10).ceil()
+
+        # Create feature with all properties
+        feature = ee.Feature(aoi.centroid(1000)).set(
+            'Year-Month-Day', img_date.format('YYYY-MM-dd'),
+            'year', img_date.get('year'),
+            'decade', img_decade,
+            'gla_fsc', current_glacier_metrics['glims_fsc'],
+            'gla_fsc_below_sl50', current_glacier_metrics['glims_fsc_below_sl'],
+            'gla_area_below_sl50', current_glacier_metrics['glims_area_below_sl'],
+            'fsc', current_fsc
+        )
+
+        # Add aspect-specific properties (excluding 'mixed')
+        for aspect in aspect_keys[:-1]:
+            feature = feature.set(ee.String('SLA_').cat(aspect), current_snowline_stats.get(aspect))
+
+        return feature
+
+    return ee.FeatureCollection(modis_ic.map(create_feature_with_properties))
+
+
+def make_sla_export_task(river_basins, glims, dem, asset_folder, scale=500, tile_scale=2, sc_th=50,
+                         aspect_keys=['East', 'North', 'South', 'West', 'mixed'],
+                         export_layer_name='decadal_SLA', glacier_index=None):
+    """
+    Task factory for run_incremental_exports exporting the decadal SLA table of the given
+    decades of one basin and year. Every basin and year has one asset, overwritten by each
+    export, so the decades passed must be all decades of the year that the asset should hold
+    (run_incremental_exports adds the completed ones, see group_units).
+
+    Args:
+        river_basins: FeatureCollection of river basins with a NAME property
+        glims: GLIMS FeatureCollection
+        dem: DEM as returned by load_dem
+        asset_folder: Asset folder of the exported tables
+        glacier_index: Optional GlacierIndex with the basins as regions; the glaciers of a basin
+            are then selected by id instead of filterBounds
+
+    Returns:
+        Function (basin, year, decades) -> (task, description)
+    """
+    def make_task(basin, year, decades):
+        aoi = river_basins.filter(ee.Filter.eq('NAME', basin)).geometry()
+        glacier_filter = glacier_index.glacier_filter(basin) if glacier_index is not None else None
+
+        # Composites of the requested decades only
+        modis_ic = create_decadal_composites(aoi, year, year, agg_interval=10,
+                                             time_intervals=intervals_for_decades(year, decades))
+
+        modis_projection = modis_ic.first().projection()
+        reprojected_dem, min_dem_dict, max_dem_dict, n_grid = reproject_and_analyze_dem(
+            dem, modis_projection, aoi, scale, tile_scale, aspect_keys)
+        aspects, aspect_coded = classify_aspect(dem, modis_projection, scale)
+
+        table_to_export = build_sla_features(modis_ic, aoi, dem, reprojected_dem, aspects, aspect_coded,
+                                             min_dem_dict, max_dem_dict, n_grid, glims, scale, sc_th, tile_scale,
+                                             aspect_keys, glacier_filter)
+
+        name = f"{export_layer_name}_{basin.replace('.', '')}_{year}"
+        task = ee.batch.Export.table.toAsset(
+            collection=table_to_export.set('NAME', basin),
+            description=name,
+            assetId=f'{asset_folder}/{name}',
+            overwrite=True
+        )
+        return task, name
+
+    return make_task
+
+
+# ---------------------------------------------------------------------------
+# Multi-basin NIR table
+# ---------------------------------------------------------------------------
+
+def build_nir_table(modis_ic, basins, glacier_mask, name_property='NAME', scale=250, tile_scale=1):
+    """
+    Tidy table of the glacier mean NIR reflectance of every basin and composite: every
+    composite is reduced over all basins with a single reduceRegions.
+
+    Args:
+        modis_ic: 250 m composites (band 'value') covering all basins, e.g. from
+            create_decadal_composites_250 over basins.geometry()
+        basins: FeatureCollection of basins
+        glacier_mask: Glacier mask image (e.g. the max of the glacier mask collection)
+        name_property: Property of basins with the basin name
+        scale: Scale of the reduction in meters
+        tile_scale: Tile scale of the reduction
+
+    Returns:
+        ee.FeatureCollection with one feature per (basin, composite) located at the basin
+        centroid, with 'basin', 'Year-Month-Day', 'year', 'decade', 'mean_NIR' (-9999 without
+        glacier pixels), 'cc_fraction' (fraction of glacier pixels of the basin without a
+        composite value) and 'cc_fraction2' (copied from the composite, if set)
+    """
+    # Basin names and centroids once, not per composite
+    basins = basins.map(lambda ft: ee.Feature(ft.geometry(), {
+        'basin': ft.get(name_property),
+        'centroid': ft.geometry().centroid(1000),
+    }))
+
+    def reduce_composite(img):
+        value = img.select('value')
+        zonal = value.rename('mean_NIR') \
+            .addBands(value.mask().Not().rename('cc_fraction')) \
+            .updateMask(glacier_mask) \
+            .reduceRegions(collection=basins, reducer=ee.Reducer.mean(), scale=scale, tileScale=tile_scale)
+
+        img_date = ee.Date(img.get('system:time_start'))
+        img_decade = ee.Number(img_date.get('day')).add(2).divide(10).ceil()
+
+        def to_row(ft):
+            mean_NIR = ft.get('mean_NIR')
+            return ee.Feature(ee.Geometry(ft.get('centroid')), {
+                'basin': ft.get('basin'),
+                'Year-Month-Day': img_date.format('YYYY-MM-dd'),
+                'year': img_date.get('year'),
+                'decade': img_decade,
+                # mark by -9999 if mean_NIR is null
+                'mean_NIR': ee.Algorithms.If(ee.Algorithms.IsEqual(mean_NIR, None), -9999, mean_NIR),
+                'cc_fraction': ft.get('cc_fraction'),
+                'cc_fraction2': img.get('cc_fraction2'),
+            })
+
+        return zonal.map(to_row)
+
+    return ee.FeatureCollection(modis_ic.map(reduce_composite)).flatten()
+
+
+def make_nir_export_task(river_basins, glacier_mask, asset_folder, basins=None, scale=250, tile_scale=1,
+                         qa_policy='state_1km', export_layer_name='decadal_meanNIR'):
+    """
+    Task factory exporting the NIR table of all basins for one year (or a range of years)
+    in a single task, with the composites built once for the union of the basins.
+
+    Args:
+        river_basins: FeatureCollection of river basins with a NAME property
+        glacier_mask: Glacier mask image
+        asset_folder: Asset folder of the exported tables
+        basins: Optional list of basin names (default: all river basins)
+        qa_policy: Cloud masking policy of src.qa_bits
+
+    Returns:
+        Function (start_year, end_year=None) -> (task, description)
+    """
+    if basins is not None:
+        river_basins = river_basins.filter(ee.Filter.inList('NAME', list(basins)))
+
+    def make_task(start_year, end_year=None):
+        end_year = start_year if end_year is None else end_year
+        modis_ic = create_decadal_composites_250(river_basins.geometry(), start_year, end_year, agg_interval=10,
+                                                 qa_policy=qa_policy)
+        table_to_export = build_nir_table(modis_ic, river_basins, glacier_mask, 'NAME', scale, tile_scale)
+
+        years = f'{start_year}' if end_year == start_year else f'{start_year}-{end_year}'
+        name = f'{export_layer_name}_allBasins_{years}'
+        task = ee.batch.Export.table.toAsset(
+            collection=table_to_export,
+            description=name,
+            assetId=f'{asset_folder}/{name}',
+            overwrite=True
+        )
+        return task, name
+
+    return make_task
@@ -0,0 +1,166 @@
+import numpy as np
+import pandas as pd
+
+# Gap-filling of the exported FSC/SLA time series (data/fsc_sla_timeseries.csv).
+# All basins are processed at once: the full year/month/decade grid is built for every
+# basin in one step and the interpolation works on whole columns, with group boundaries
+# taken into account, instead of looping over the basins.
+
+DECADE_START_DAYS = {1: 1, 2: 11, 3: 21}
+
+SLA_COLUMNS = ['SLA_East', 'SLA_North', 'SLA_South', 'SLA_West']
+INTERPOLATED_COLUMNS = SLA_COLUMNS + ['fsc', 'gla_area_below_sl50', 'gla_fsc']
+FORWARD_FILLED_COLUMNS = ['Basin', 'Code', '.geo']
+
+
+def prepare_timeseries(df):
+    """
+    Clean the table exported from Google Earth Engine: parse dates, sort by basin and date,
+    drop duplicates and the export bookkeeping columns.
+
+    Args:
+        df: DataFrame as read from fsc_sla_timeseries.csv
+
+    Returns:
+        DataFrame with a 'date' column and a 'time_step' column (days since the previous record)
+    """
+    df = df.copy()
+    df['date'] = pd.to_datetime(df['Year-Month-Day'])
+    df = df.sort_values(by=['Name', 'date'])
+    df = df.drop_duplicates(subset=['Name', 'date'], keep='last')
+    df['time_step'] = df.groupby('Name')['date'].diff().dt.days.fillna(0)
+    return df.drop(columns=[c for c in ['system:index', 'Year-Month-Day'] if c in df.columns])
+
+
+def build_decade_grid(first_years, end_year):
+    """
+    Complete year/month/decade grid for every basin, from the basin's first year to end_year.
+
+    Args:
+        first_years: Series of first years indexed by basin name
+        end_year: Last year of the grid
+
+    Returns:
+        DataFrame with columns 'Name', 'year', 'month', 'decade'
+    """
+    n_rows = (end_year - first_years.to_numpy() + 1).clip(min=0) * 36
+    basin = np.repeat(np.arange(len(first_years)), n_rows)
+    step = np.arange(n_rows.sum()) - np.repeat(np.cumsum(n_rows) - n_rows, n_rows)
+    return pd.DataFrame({
+        'Name': first_years.index.to_numpy()[basin],
+        'year': first_years.to_numpy()[basin] + step // 36,
+        'month': (step % 36) // 3 + 1,
+        'decade': step % 3 + 1,
+    })
+
+
+def interpolate_linear(values, groups):
+    """
+    Linear interpolation within groups, equivalent to Series.interpolate(method='linear')
+    applied to each group: gaps between two values are interpolated, trailing gaps repeat the
+    last value and leading gaps stay NaN.
+
+    Args:
+        values: DataFrame of float columns, ordered by group and time
+        groups: Array of group labels, contiguous per group
+
+    Returns:
+        DataFrame of interpolated columns
+    """
+    position = np.arange(len(values), dtype=np.float64)
+    valid = values.notna().to_numpy()
+    positions = pd.DataFrame(np.where(valid, position[:, np.newaxis], np.nan), index=values.index,
+                             columns=values.columns)
+    grouped = positions.groupby(groups, sort=False)
+    prev_pos = grouped.ffill().to_numpy()
+    next_pos = grouped.bfill().to_numpy()
+
+    data = values.to_numpy(dtype=np.float64)
+    prev_val = np.take_along_axis(data, np.nan_to_num(prev_pos, nan=0).astype(np.int64), axis=0)
+    next_val = np.take_along_axis(data, np.nan_to_num(next_pos, nan=0).astype(np.int64), axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weight = (position[:, np.newaxis] - prev_pos) / (next_pos - prev_pos)
+    filled = np.where(np.isnan(next_pos), prev_val, prev_val + (next_val - prev_val) * weight)
+    filled = np.where(np.isnan(prev_pos), np.nan, filled)
+    return pd.DataFrame(np.where(valid, data, filled), index=values.index, columns=values.columns)
+
+
+def interpolate_neighbours(values, groups):
+    """
+    Fill a missing value with the mean of its neighbours, only when both the previous and the
+    next value of the same group are available (safe_interpolate of the analysis notebook).
+
+    Args:
+        values: DataFrame of float columns, ordered by group and time
+        groups: Array of group labels, contiguous per group
+
+    Returns:
+        DataFrame of interpolated columns
+    """
+    data = values.to_numpy(dtype=np.float64)
+    groups = np.asarray(groups)
+    prev_val = np.full_like(data, np.nan)
+    next_val = np.full_like(data, np.nan)
+    same_prev = groups[1:] == groups[:-1]
+    prev_val[1:] = np.where(same_prev[:, np.newaxis], data[:-1], np.nan)
+    next_val[:-1] = np.where(same_prev[:, np.newaxis], data[1:], np.nan)
+    filled = np.where(np.isnan(data), (prev_val + next_val) / 2, data)
+    return pd.DataFrame(filled, index=values.index, columns=values.columns)
+
+
+def gapfill_timeseries(df, end_year=2024, method='linear'):
+    """
+    Gap-fill the decadal FSC/SLA time series of all basins at once.
+    Missing decades are added for every basin from its first year to end_year, 'Basin', 'Code'
+    and '.geo' are forward-filled, snowline and snow cover columns are interpolated, and the
+    glacier columns are set to 0 where no glacier snow cover is available.
+
+    Args:
+        df: DataFrame as returned by prepare_timeseries
+        end_year: Last year of the gap-filled series
+        method: 'linear' (pandas linear interpolation, as used for the published series) or
+            'neighbours' (fill only when both neighbours exist)
+
+    Returns:
+        DataFrame with one row per basin and decade
+    """
+    if method == 'linear':
+        interpolate = interpolate_linear
+    elif method == 'neighbours':
+        interpolate = interpolate_neighbours
+    else:
+        raise ValueError(f"Unknown interpolation method '{method}'")
+
+    df = df.copy()
+    df['year'] = df['date'].dt.year
+    df['month'] = df['date'].dt.month
+
+    # Full time grid of every basin, merged with the actual data
+    first_years = df.groupby('Name', sort=False)['year'].min()
+    grid = build_decade_grid(first_years, end_year)
+    merged = grid.merge(df, on=['Name', 'year', 'month', 'decade'], how='left')
+    other_columns = [c for c in df.columns if c not in ('year', 'month', 'decade')]
+    merged = merged[['year', 'month', 'decade'] + other_columns]
+
+    # Valid date for each decade
+    month_index = (merged['year'].to_numpy() - 1970) * 12 + merged['month'].to_numpy() - 1
+    start_day = merged['decade'].map(DECADE_START_DAYS).to_numpy()
+    merged['date'] = (month_index.astype('datetime64[M]') + (start_day - 1).astype('timedelta64[D]')) \
+        .astype('datetime64[ns]')
+
+    groups = merged['Name'].to_numpy()
+    fill_columns = [c for c in FORWARD_FILLED_COLUMNS if c in merged.columns]
+    merged[fill_columns] = merged.groupby('Name', sort=False)[fill_columns].ffill()
+
+    columns = [c for c in INTERPOLATED_COLUMNS if c in merged.columns]
+    merged[columns] = interpolate(merged[columns].astype(np.float64), groups)
+
+    # 'gla_fsc_below_sl50' is 1 whenever 'gla_area_below_sl50' is 0
+    below = merged[['gla_fsc_below_sl50']].astype(np.float64).mask(merged[['gla_area_below_sl50']].to_numpy() == 0, 1)
+    merged['gla_fsc_below_sl50'] = interpolate(below, groups)['gla_fsc_below_sl50']
+
+    # Set glacier columns to 0 where gla_fsc is NaN
+    na_mask = merged['gla_fsc'].isna()
+    merged.loc[na_mask, ['gla_area_below_sl50', 'gla_fsc_below_sl50', 'gla_fsc']] = 0
+
+    return merged
@@ -0,0 +1,257 @@
+import datetime
+import hashlib
+import json
+import os
+import time
+
+# On-disk cache of getInfo() results, keyed by the SHA-256 of the serialized expression
+# graph: evaluating the same expression again (in this or a later session) returns the
+# stored result without a request. Entries are evicted least-recently-used when the cache
+# exceeds its size and expire after an optional time-to-live. Expressions that depend on
+# moving targets are evaluated directly: dates close to today (e.g. the current month) and
+# lookups of the latest image of a collection.
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'glaciermapper-ca', 'getinfo')
+
+# Functions that, applied to system:time_start, select the latest images of a collection, and
+# the argument naming the property
+LATEST_FUNCTIONS = {
+    'AggregateFeatureCollection.max': 'property',
+    'Collection.limit': 'key',
+    'Collection.reduceColumns': 'selectors',
+}
+TIME_PROPERTY = 'system:time_start'
+
+
+def expression_key(obj):
+    """
+    Cache key of an Earth Engine object: SHA-256 of its serialized expression graph.
+    """
+    return _serialized_key(obj.serialize())
+
+
+def _serialized_key(serialized):
+    return hashlib.sha256(serialized.encode()).hexdigest()
+
+
+def _date_constants(node):
+    """
+    Constant arguments of the Date, DateRange and Date.fromYMD invocations of a serialized
+    expression (the latter as datetime).
+    """
+    if isinstance(node, dict):
+        invocation = node.get('functionInvocationValue')
+        if invocation:
+            name = invocation.get('functionName')
+            arguments = {k: v.get('constantValue') for k, v in invocation.get('arguments', {}).items()
+                         if isinstance(v, dict)}
+            if name in ('Date', 'DateRange'):
+                yield from (v for v in arguments.values() if v is not None)
+            elif name == 'Date.fromYMD' and all(isinstance(arguments.get(k), int) for k in ('year', 'month', 'day')):
+                try:
+                    yield datetime.datetime(arguments['year'], arguments['month'], arguments['day'],
+                                            tzinfo=datetime.timezone.utc)
+                except ValueError:
+                    # e.g. fromYMD(year, month - 1, 31) as used in the notebook: day overflows
+                    yield datetime.datetime(arguments['year'], arguments['month'], 1, tzinfo=datetime.timezone.utc)
+        for value in node.values():
+            yield from _date_constants(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _date_constants(value)
+
+
+def _invocations(node):
+    """
+    All function invocations ({'functionName', 'arguments'}) of a serialized expression.
+    """
+    if isinstance(node, dict):
+        invocation = node.get('functionInvocationValue')
+        if invocation and 'functionName' in invocation:
+            yield invocation
+        for value in node.values():
+            yield from _invocations(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _invocations(value)
+
+
+def _is_latest_lookup(graph):
+    """
+    True if an invocation of the graph selects images by system:time_start: max or
+    reduceColumns of the property, a limit on a collection sorted by it (limit with key,
+    or limit/first of a sort), as used to find the latest image of a collection.
+    """
+    # Compact serialization: arguments may refer to other entries as {'valueReference': id}
+    values = graph.get('values', {}) if isinstance(graph, dict) else {}
+
+    def resolve(argument):
+        while isinstance(argument, dict) and 'valueReference' in argument:
+            argument = values.get(argument['valueReference'], {})
+        return argument if isinstance(argument, dict) else {}
+
+    def constant(argument):
+        return resolve(argument).get('constantValue')
+
+    def sorted_by_time(argument):
+        invocation = resolve(argument).get('functionInvocationValue') or {}
+        return (invocation.get('functionName') == 'Collection.limit'
+                and constant(invocation.get('arguments', {}).get('key')) == TIME_PROPERTY)
+
+    for invocation in _invocations(graph):
+        name = invocation['functionName']
+        arguments = invocation.get('arguments', {})
+        if name in ('AggregateFeatureCollection.max', 'Collection.reduceColumns'):
+            value = constant(arguments.get(LATEST_FUNCTIONS[name]))
+            if value == TIME_PROPERTY or (isinstance(value, list) and TIME_PROPERTY in value):
+                return True
+        elif name == 'Collection.limit' and 'limit' in arguments:
+            if constant(arguments.get(LATEST_FUNCTIONS[name])) == TIME_PROPERTY or sorted_by_time(arguments.get('collection')):
+                return True
+        elif name == 'Collection.first' and sorted_by_time(arguments.get('collection')):
+            return True
+    return False
+
+
+def _to_datetime(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, (int, float)):
+        return datetime.datetime.fromtimestamp(value / 1000, tz=datetime.timezone.utc)
+    if isinstance(value, str):
+        try:
+            date = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+        return date if date.tzinfo else date.replace(tzinfo=datetime.timezone.utc)
+    return None
+
+
+def is_volatile(serialized, recent_days=31, now=None):
+    """
+    True if a serialized expression depends on moving targets: a date constant within
+    recent_days of now (current month, "until today" ranges) or a latest-image lookup
+    (max/limit/reduceColumns on system:time_start).
+
+    Args:
+        serialized: Result of obj.serialize()
+        recent_days: Dates after now - recent_days count as moving
+        now: Current time as an aware datetime (default: now)
+    """
+    graph = json.loads(serialized)
+    if _is_latest_lookup(graph):
+        return True
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    limit = now - datetime.timedelta(days=recent_days)
+    for value in _date_constants(graph):
+        date = _to_datetime(value)
+        if date is not None and date >= limit:
+            return True
+    return False
+
+
+class GetInfoCache:
+    """
+    Content-addressed cache of getInfo() results stored as one JSON file per expression.
+
+    Args:
+        cache_dir: Directory of the cache files
+        max_bytes: Size limit; least recently used entries are removed beyond it
+        ttl: Default time-to-live of entries in seconds (None: entries do not expire)
+        recent_days: Window of moving dates (see is_volatile)
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=256 * 2 ** 20, ttl=None, recent_days=31):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.recent_days = recent_days
+        self.stats = {'hits': 0, 'misses': 0, 'bypassed': 0}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.json')
+
+    def get_info(self, obj, ttl=None, volatile=None, evaluate=None):
+        """
+        getInfo() of obj, served from the cache when possible.
+
+        Args:
+            obj: Earth Engine object (ee.ComputedObject)
+            ttl: Time-to-live of this entry in seconds (default: the cache's ttl)
+            volatile: True to always evaluate, False to always cache, None to decide with is_volatile
+            evaluate: Function obj -> result used instead of obj.getInfo() on a miss (e.g. an
+                AsyncEEClient compute call)
+
+        Returns:
+            The result of obj.getInfo()
+        """
+        evaluate = evaluate or (lambda o: o.getInfo())
+        serialized = obj.serialize()
+        if volatile is None:
+            volatile = is_volatile(serialized, self.recent_days)
+        if volatile:
+            self.stats['bypassed'] += 1
+            return evaluate(obj)
+
+        path = self._path(_serialized_key(serialized))
+        ttl = self.ttl if ttl is None else ttl
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                entry = None
+            if entry is not None and (ttl is None or time.time() - entry['created'] <= ttl):
+                # Touch the entry for the LRU order
+                os.utime(path)
+                self.stats['hits'] += 1
+                return entry['result']
+
+        self.stats['misses'] += 1
+        result = evaluate(obj)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'created': time.time(), 'result': result}, f)
+        os.replace(tmp_path, path)
+        self.evict()
+        return result
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits in max_bytes.
+
+        Returns:
+            int: Number of removed entries
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.json'):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.cache_dir, name))
+            total -= size
+            removed += 1
+        return removed
+
+    def clear(self):
+        """
+        Remove all entries.
+        """
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.json'):
+                os.remove(os.path.join(self.cache_dir, name))
+
+
+def get_info(obj, cache=None, evaluate=None, **kwargs):
+    """
+    obj.getInfo(), through the cache if one is given, or evaluate(obj) if given.
+    """
+    if cache is None:
+        return evaluate(obj) if evaluate is not None else obj.getInfo()
+    return cache.get_info(obj, evaluate=evaluate, **kwargs)
@@ -0,0 +1,329 @@
+import hashlib
+import json
+import math
+import os
+
+import ee
+import numpy as np
+
+from src.glacier_mask_local import load_glaciers
+
+# Persisted assignment of glaciers to regions (100 km grid tiles and river basins), so that
+# per-tile and per-basin glacier selections become ee.Filter.inList('glac_id', ids) lookups
+# instead of spatial filterBounds calls. Candidates are found with an STR-tree over glacier
+# bounding boxes. Membership follows filterBounds: a glacier belongs to a region when the two
+# intersect, tested with the vertices of both outlines.
+#
+# Index file (JSON): {'glaciers': {glacier id: hash}, 'regions': {key: {'hash': ..., 'glaciers': [...]}}}.
+# update() only recomputes the glaciers and regions whose outlines changed.
+
+DEGREES_PER_METRE = 180 / (math.pi * 6378137)
+
+
+class STRTree:
+    """
+    Sort-Tile-Recursive R-tree over axis-aligned bounding boxes (minx, miny, maxx, maxy).
+    Levels are stored as arrays; entry groups of `node_capacity` consecutive entries form the
+    nodes of the next level.
+    """
+
+    def __init__(self, bounds, node_capacity=16):
+        self.node_capacity = node_capacity
+        bounds = np.asarray(bounds, dtype=np.float64).reshape(-1, 4)
+        self.size = len(bounds)
+        # levels[0] holds the items; refs are item indices (level 0) or node indices
+        self.levels = []
+        refs = np.arange(self.size)
+        while True:
+            order = self._str_order(bounds)
+            bounds, refs = bounds[order], refs[order]
+            self.levels.append((bounds, refs))
+            if len(bounds) <= node_capacity:
+                break
+            starts = np.arange(0, len(bounds), node_capacity)
+            bounds = np.column_stack([
+                np.minimum.reduceat(bounds[:, 0], starts), np.minimum.reduceat(bounds[:, 1], starts),
+                np.maximum.reduceat(bounds[:, 2], starts), np.maximum.reduceat(bounds[:, 3], starts),
+            ])
+            refs = np.arange(len(starts))
+
+    def _str_order(self, bounds):
+        n = len(bounds)
+        if n <= self.node_capacity:
+            return np.arange(n)
+        cx = (bounds[:, 0] + bounds[:, 2]) / 2
+        cy = (bounds[:, 1] + bounds[:, 3]) / 2
+        n_slices = int(math.ceil(math.sqrt(math.ceil(n / self.node_capacity))))
+        slice_size = n_slices * self.node_capacity
+        by_x = np.argsort(cx, kind='stable')
+        slice_of = np.empty(n, dtype=np.int64)
+        slice_of[by_x] = np.arange(n) // slice_size
+        return np.lexsort((cy, slice_of))
+
+    def query(self, bbox):
+        """
+        Indices of the items whose bounding box intersects bbox (minx, miny, maxx, maxy).
+        """
+        if self.size == 0:
+            return np.empty(0, dtype=np.int64)
+        minx, miny, maxx, maxy = bbox
+        # Positions of the candidate entries at the current level
+        candidates = np.arange(len(self.levels[-1][0]))
+        for level in range(len(self.levels) - 1, -1, -1):
+            bounds, refs = self.levels[level]
+            b = bounds[candidates]
+            hit = (b[:, 0] <= maxx) & (b[:, 2] >= minx) & (b[:, 1] <= maxy) & (b[:, 3] >= miny)
+            nodes = refs[candidates[hit]]
+            if level == 0:
+                return np.sort(nodes)
+            # Entries of the hit nodes at the level below
+            size = len(self.levels[level - 1][0])
+            candidates = (nodes[:, np.newaxis] * self.node_capacity + np.arange(self.node_capacity)).ravel()
+            candidates = candidates[candidates < size]
+        return np.empty(0, dtype=np.int64)
+
+
+# ---------------------------------------------------------------------------
+# Geometry helpers
+# ---------------------------------------------------------------------------
+
+def _points_in_rings(points, rings, chunk=2 ** 22):
+    """
+    Even-odd test of points (n, 2) against a polygon given as a list of rings (closed (k, 2) arrays).
+    """
+    edges = np.concatenate([np.column_stack([r[:-1], r[1:]]) for r in rings])
+    inside = np.zeros(len(points), dtype=bool)
+    step = max(1, chunk // max(len(edges), 1))
+    for i in range(0, len(points), step):
+        px = points[i:i + step, 0:1]
+        py = points[i:i + step, 1:2]
+        x1, y1, x2, y2 = edges[:, 0], edges[:, 1], edges[:, 2], edges[:, 3]
+        crosses = (y1 > py) != (y2 > py)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            x_cross = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+        inside[i:i + step] = (np.count_nonzero(crosses & (px < x_cross), axis=1) % 2) == 1
+    return inside
+
+
+def _rings_bbox(rings):
+    coords = np.concatenate(rings)
+    return coords[:, 0].min(), coords[:, 1].min(), coords[:, 0].max(), coords[:, 1].max()
+
+
+def _hash_rings(key, rings):
+    digest = hashlib.sha1(str(key).encode())
+    for ring in rings:
+        digest.update(np.ascontiguousarray(ring, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def glacier_rings(glaciers):
+    """
+    Rings of every glacier of the flat arrays returned by glacier_mask_local.load_glaciers.
+
+    Returns:
+        dict glacier id -> list of closed (k, 2) lon/lat rings
+    """
+    offsets = glaciers['ring_offsets']
+    rings = {}
+    for r, g in enumerate(glaciers['ring_glacier']):
+        rings.setdefault(glaciers['ids'][g], []).append(glaciers['coords'][offsets[r]:offsets[r + 1]])
+    return rings
+
+
+def load_regions(path, key_property='NAME'):
+    """
+    Region outlines (e.g. RiverBasins_CA_Jan2023_simple1000 exported as GeoJSON).
+
+    Returns:
+        dict region key -> list of closed (k, 2) lon/lat rings
+    """
+    with open(path) as f:
+        features = json.load(f)['features']
+    regions = {}
+    for feature in features:
+        geometry = feature.get('geometry')
+        if not geometry:
+            continue
+        polygons = [geometry['coordinates']] if geometry['type'] == 'Polygon' else geometry['coordinates']
+        rings = regions.setdefault(str(feature['properties'][key_property]), [])
+        for polygon in polygons:
+            rings.extend(np.asarray(ring, dtype=np.float64)[:, :2] for ring in polygon)
+    return regions
+
+
+def tile_key(lon, lat, scale=100000):
+    """
+    Key of the grid tile containing a point, for the grid of
+    coveringGrid(ee.Projection('EPSG:4326').atScale(scale)).
+    """
+    size = scale * DEGREES_PER_METRE
+    return f'tile_{int(math.floor(lon / size))}_{int(math.floor(lat / size))}'
+
+
+def tile_regions(bbox, scale=100000):
+    """
+    Tiles of coveringGrid(ee.Projection('EPSG:4326').atScale(scale)) covering a lon/lat bbox.
+
+    Returns:
+        dict tile key -> list with the closed tile ring
+    """
+    size = scale * DEGREES_PER_METRE
+    regions = {}
+    for col in range(int(math.floor(bbox[0] / size)), int(math.floor(bbox[2] / size)) + 1):
+        for row in range(int(math.floor(bbox[1] / size)), int(math.floor(bbox[3] / size)) + 1):
+            x0, y0, x1, y1 = col * size, row * size, (col + 1) * size, (row + 1) * size
+            ring = np.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]])
+            regions[f'tile_{col}_{row}'] = [ring]
+    return regions
+
+
+# ---------------------------------------------------------------------------
+# Index
+# ---------------------------------------------------------------------------
+
+def _region_members(rings, glacier_ids, glacier_bounds, glacier_tree, glacier_outlines):
+    """
+    Glacier ids intersecting a region: STR-tree candidates by bounding box, a point test of
+    the first vertex of every candidate, and a test of all vertices (in both directions) for
+    the candidates near the region boundary.
+    """
+    candidates = glacier_tree.query(_rings_bbox(rings))
+    if len(candidates) == 0:
+        return []
+
+    first_vertex = np.array([glacier_outlines[glacier_ids[i]][0][0] for i in candidates])
+    inside = _points_in_rings(first_vertex, rings)
+    members = [glacier_ids[i] for i in candidates[inside]]
+
+    # Remaining candidates can only intersect the region where they cross its boundary
+    edges = np.concatenate([np.column_stack([r[:-1], r[1:]]) for r in rings])
+    edge_tree = STRTree(np.column_stack([
+        np.minimum(edges[:, 0], edges[:, 2]), np.minimum(edges[:, 1], edges[:, 3]),
+        np.maximum(edges[:, 0], edges[:, 2]), np.maximum(edges[:, 1], edges[:, 3]),
+    ]))
+    for i in candidates[~inside]:
+        near_edges = edge_tree.query(glacier_bounds[i])
+        if len(near_edges) == 0:
+            continue
+        outline = glacier_outlines[glacier_ids[i]]
+        near_points = np.concatenate([edges[near_edges, :2], edges[near_edges, 2:]])
+        if _points_in_rings(np.concatenate(outline), rings).any() or _points_in_rings(near_points, outline).any():
+            members.append(glacier_ids[i])
+    return members
+
+
+class GlacierIndex:
+    """
+    Glacier ids per region key, persisted as JSON and updated incrementally.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.glacier_hashes = {}
+        self.regions = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.glacier_hashes = data['glaciers']
+            self.regions = data['regions']
+
+    def save(self, path=None):
+        path = path or self.path
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'glaciers': self.glacier_hashes, 'regions': self.regions}, f)
+        os.replace(tmp_path, path)
+
+    def update(self, glacier_outlines, region_outlines, save=True):
+        """
+        Bring the index up to date with the given outlines. Regions whose outline did not
+        change are only tested against new or changed glaciers; changed or new regions are
+        tested against all glaciers; removed glaciers and regions are dropped.
+
+        Args:
+            glacier_outlines: dict glacier id -> rings (see glacier_rings)
+            region_outlines: dict region key -> rings (see load_regions and tile_regions)
+            save: Write the index to its path
+
+        Returns:
+            dict with the numbers of changed glaciers and regions
+        """
+        glacier_hashes = {str(g): _hash_rings(g, rings) for g, rings in glacier_outlines.items()}
+        region_hashes = {str(r): _hash_rings(r, rings) for r, rings in region_outlines.items()}
+
+        changed_glaciers = {g for g, h in glacier_hashes.items() if self.glacier_hashes.get(g) != h}
+        stale_glaciers = changed_glaciers | (set(self.glacier_hashes) - set(glacier_hashes))
+        changed_regions = {r for r, h in region_hashes.items() if self.regions.get(r, {}).get('hash') != h}
+
+        outlines = {str(g): rings for g, rings in glacier_outlines.items()}
+        all_ids = list(outlines)
+        changed_ids = [g for g in all_ids if g in changed_glaciers]
+
+        def tree_of(ids):
+            bounds = np.array([_rings_bbox(outlines[g]) for g in ids]).reshape(-1, 4)
+            return bounds, STRTree(bounds)
+
+        all_tree = tree_of(all_ids) if changed_regions else None
+        changed_tree = tree_of(changed_ids) if changed_ids else None
+
+        regions = {}
+        for key, rings in region_outlines.items():
+            key = str(key)
+            if key in changed_regions:
+                members = _region_members(rings, all_ids, all_tree[0], all_tree[1], outlines)
+            else:
+                members = [g for g in self.regions[key]['glaciers'] if g not in stale_glaciers]
+                if changed_tree is not None:
+                    members += _region_members(rings, changed_ids, changed_tree[0], changed_tree[1], outlines)
+            regions[key] = {'hash': region_hashes[key], 'glaciers': sorted(members)}
+
+        summary = {
+            'glaciers_changed': len(changed_glaciers),
+            'glaciers_removed': len(set(self.glacier_hashes) - set(glacier_hashes)),
+            'regions_changed': len(changed_regions),
+            'regions_removed': len(set(self.regions) - set(regions)),
+        }
+        self.glacier_hashes = glacier_hashes
+        self.regions = regions
+        if save and self.path is not None:
+            self.save()
+        return summary
+
+    def glaciers(self, key):
+        """
+        Glacier ids of a region (empty list for unknown regions).
+        """
+        return self.regions.get(str(key), {}).get('glaciers', [])
+
+    def glacier_filter(self, key, id_property='glac_id'):
+        """
+        ee.Filter selecting the glaciers of a region, replacing filterBounds(region).
+        """
+        return ee.Filter.inList(id_property, self.glaciers(key))
+
+
+def build_glacier_index(index_path, glacier_path, basin_path, basin_property='NAME', tile_scale=100000,
+                        id_property='glac_id'):
+    """
+    Create or incrementally update the index of the 100 km tiles and river basins from local
+    GeoJSON exports of GLIMS and RiverBasins_CA_Jan2023_simple1000.
+
+    Args:
+        index_path: JSON file of the index
+        glacier_path: GeoJSON of the glacier outlines
+        basin_path: GeoJSON of the river basins
+        basin_property: Property holding the basin name (region key)
+        tile_scale: Tile size in metres of the coveringGrid
+        id_property: Property holding the glacier id
+
+    Returns:
+        tuple: (GlacierIndex, summary of the update)
+    """
+    glacier_outlines = glacier_rings(load_glaciers(glacier_path, id_property))
+    regions = load_regions(basin_path, basin_property)
+    bbox = np.array([_rings_bbox(rings) for rings in regions.values()])
+    regions.update(tile_regions((bbox[:, 0].min(), bbox[:, 1].min(), bbox[:, 2].max(), bbox[:, 3].max()),
+                                tile_scale))
+    index = GlacierIndex(index_path)
+    return index, index.update(glacier_outlines, regions)
@@ -0,0 +1,350 @@
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from scipy import ndimage
+
+# Offline version of the glacier mask of glacier_mask_tiles: glacier outlines are read from a
+# local GeoJSON file (e.g. the RGI outlines converted with ogr2ogr), buffered with the
+# equal-area buffer of buffer_equal, rasterized at ~30 m and reduced to the MODIS 250 m grid
+# by majority, like reduceResolution(ee.Reducer.mode(), False, 256).mask().round().
+# Tiles of ~100 km are processed in a process pool and written as .npz files holding the
+# mask and its grid.
+#
+# The output grid is the MODIS sinusoidal grid (SR-ORG:6974). The buffer is applied on the
+# ~30 m subpixel raster with a Euclidean distance transform: a subpixel belongs to the
+# buffered outlines when it lies within the buffer distance of the nearest glacier.
+
+EARTH_RADIUS = 6371007.181
+MODIS_CRS = 'SR-ORG:6974'
+MODIS_ORIGIN = (-20015109.354, 10007554.677)
+MODIS_SCALE_250 = 231.65635826395828
+
+# Subpixels per MODIS pixel side (231.66 m / 8 = 29 m, close to the 30 m of the server version)
+SUBPIXELS = 8
+# MODIS pixels per tile side (~100 km)
+TILE_SIZE = 432
+
+
+# ---------------------------------------------------------------------------
+# Glacier outlines
+# ---------------------------------------------------------------------------
+
+def load_glaciers(path, id_property='glac_id', filter_property=None, filter_value=None):
+    """
+    Read glacier polygons from a GeoJSON file into flat ring arrays.
+
+    Args:
+        path: GeoJSON FeatureCollection with Polygon or MultiPolygon geometries (lon/lat)
+        id_property: Property holding the glacier id
+        filter_property: Optional property to filter on (e.g. 'geog_area')
+        filter_value: Value of filter_property of the glaciers to keep
+
+    Returns:
+        dict with 'ids' (glacier ids), 'coords' ((N, 2) lon/lat of all ring vertices),
+        'ring_offsets' (start of every ring in coords, plus the total length),
+        'ring_glacier' (glacier index of every ring) and 'ring_hole' (True for interior rings)
+    """
+    with open(path) as f:
+        features = json.load(f)['features']
+
+    ids, rings, ring_glacier, ring_hole = [], [], [], []
+    for feature in features:
+        properties = feature.get('properties') or {}
+        if filter_property is not None and properties.get(filter_property) != filter_value:
+            continue
+        geometry = feature.get('geometry')
+        if not geometry:
+            continue
+        polygons = [geometry['coordinates']] if geometry['type'] == 'Polygon' else geometry['coordinates']
+        index = len(ids)
+        ids.append(properties.get(id_property, index))
+        for polygon in polygons:
+            for k, ring in enumerate(polygon):
+                ring = np.asarray(ring, dtype=np.float64)[:, :2]
+                if not np.array_equal(ring[0], ring[-1]):
+                    ring = np.vstack([ring, ring[:1]])
+                rings.append(ring)
+                ring_glacier.append(index)
+                ring_hole.append(k > 0)
+
+    lengths = np.array([len(r) for r in rings], dtype=np.int64)
+    return {
+        'ids': ids,
+        'coords': np.concatenate(rings) if rings else np.empty((0, 2)),
+        'ring_offsets': np.concatenate([[0], np.cumsum(lengths)]),
+        'ring_glacier': np.array(ring_glacier, dtype=np.int64),
+        'ring_hole': np.array(ring_hole, dtype=bool),
+    }
+
+
+def _edges(glaciers):
+    """
+    Start and end vertex index of every ring edge, and the ring of every edge.
+    """
+    offsets = glaciers['ring_offsets']
+    n = offsets[-1]
+    ring_of_vertex = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    start = np.arange(n)
+    # The last vertex of a ring closes it and starts no edge
+    keep = np.ones(n, dtype=bool)
+    keep[offsets[1:] - 1] = False
+    start = start[keep]
+    return start, start + 1, ring_of_vertex[start]
+
+
+def glacier_area_perimeter(glaciers):
+    """
+    Area and perimeter in metres of all glaciers at once, in a local equirectangular frame
+    centred on each glacier.
+
+    Returns:
+        tuple: (area, perimeter) arrays, one value per glacier
+    """
+    coords = glaciers['coords']
+    n_glaciers = len(glaciers['ids'])
+    start, end, ring = _edges(glaciers)
+    glacier = glaciers['ring_glacier'][ring]
+
+    lat = np.radians(coords[:, 1])
+    lat0 = np.bincount(glacier, lat[start], n_glaciers) / np.maximum(np.bincount(glacier, None, n_glaciers), 1)
+    x = EARTH_RADIUS * np.radians(coords[:, 0])
+    y = EARTH_RADIUS * lat
+    cos0 = np.cos(lat0[glacier])
+    xa, xb = x[start] * cos0, x[end] * cos0
+    ya, yb = y[start], y[end]
+
+    ring_area = np.abs(np.bincount(ring, xa * yb - xb * ya, len(glaciers['ring_glacier']))) / 2
+    ring_area = np.where(glaciers['ring_hole'], -ring_area, ring_area)
+    area = np.bincount(glaciers['ring_glacier'], ring_area, n_glaciers)
+    perimeter = np.bincount(glacier, np.hypot(xb - xa, yb - ya), n_glaciers)
+    return area, perimeter
+
+
+def equal_area_buffer(area, perimeter):
+    """
+    Buffer distance of buffer_equal for arrays of glacier areas and perimeters (metres).
+    """
+    return (np.sqrt(perimeter ** 2 + 16 * 0.45 * area) - perimeter) / 8
+
+
+def to_sinusoidal(lon, lat):
+    """
+    MODIS sinusoidal coordinates (metres) of lon/lat degrees.
+    """
+    lat = np.radians(lat)
+    return EARTH_RADIUS * np.radians(lon) * np.cos(lat), EARTH_RADIUS * lat
+
+
+# ---------------------------------------------------------------------------
+# Rasterization
+# ---------------------------------------------------------------------------
+
+def rasterize_polygons(rows_a, cols_a, rows_b, cols_b, edge_glacier, shape):
+    """
+    Scanline rasterization of polygon edges given in pixel coordinates: a pixel belongs to a
+    glacier when its centre lies inside the glacier's rings (even-odd rule, so interior rings
+    are holes).
+
+    Args:
+        rows_a, cols_a, rows_b, cols_b: Edge end points in (fractional) pixel coordinates
+        edge_glacier: Glacier index of every edge
+        shape: (height, width) of the raster
+
+    Returns:
+        int array of the given shape with glacier index + 1 inside glaciers and 0 elsewhere
+    """
+    height, width = shape
+    labels = np.zeros(shape, dtype=np.int32)
+
+    vmin = np.minimum(rows_a, rows_b)
+    vmax = np.maximum(rows_a, rows_b)
+    r0 = np.clip(np.ceil(vmin - 0.5), 0, height).astype(np.int64)
+    r1 = np.clip(np.ceil(vmax - 0.5), 0, height).astype(np.int64)
+    n_rows = r1 - r0
+    if n_rows.sum() == 0:
+        return labels
+
+    # One crossing per (edge, scanline)
+    edge = np.repeat(np.arange(len(r0)), n_rows)
+    row = r0[edge] + np.arange(n_rows.sum()) - np.repeat(np.cumsum(n_rows) - n_rows, n_rows)
+    t = (row + 0.5 - rows_a[edge]) / (rows_b[edge] - rows_a[edge])
+    col = cols_a[edge] + t * (cols_b[edge] - cols_a[edge])
+    glacier = edge_glacier[edge]
+
+    # Pair the sorted crossings of every glacier and scanline into spans
+    order = np.lexsort((col, row, glacier))
+    col, row, glacier = col[order], row[order], glacier[order]
+    c0 = np.clip(np.ceil(col[0::2] - 0.5), 0, width).astype(np.int64)
+    c1 = np.clip(np.ceil(col[1::2] - 0.5), 0, width).astype(np.int64)
+    span_row, span_glacier = row[0::2], glacier[0::2]
+    n_cols = np.maximum(c1 - c0, 0)
+
+    span = np.repeat(np.arange(len(c0)), n_cols)
+    cols = c0[span] + np.arange(n_cols.sum()) - np.repeat(np.cumsum(n_cols) - n_cols, n_cols)
+    labels[span_row[span], cols] = span_glacier[span] + 1
+    return labels
+
+
+def buffer_labels(labels, buffer_distance, resolution):
+    """
+    Buffered glacier mask: pixels within the buffer distance of the nearest glacier pixel.
+
+    Args:
+        labels: Glacier index + 1 per pixel, 0 outside glaciers
+        buffer_distance: Buffer distance in metres per glacier index
+        resolution: Pixel size in metres
+
+    Returns:
+        Boolean array
+    """
+    if not labels.any():
+        return np.zeros(labels.shape, dtype=bool)
+    distance, (iy, ix) = ndimage.distance_transform_edt(labels == 0, sampling=resolution, return_indices=True)
+    nearest = labels[iy, ix] - 1
+    return distance <= buffer_distance[nearest]
+
+
+def block_majority(mask, factor):
+    """
+    Majority of True subpixels per block of factor x factor subpixels (fraction >= 0.5).
+    """
+    height, width = mask.shape
+    blocks = mask.reshape(height // factor, factor, width // factor, factor)
+    return blocks.mean(axis=(1, 3)) >= 0.5
+
+
+# ---------------------------------------------------------------------------
+# Tiles
+# ---------------------------------------------------------------------------
+
+def _tile_task(tile, origin, edges, edge_glacier, buffer_distance, tile_size, subpixels, scale):
+    """
+    Glacier mask of one tile (run in a worker process).
+
+    Args:
+        tile: (tile row, tile column)
+        origin: (x, y) of the upper left corner of the tile in sinusoidal metres
+        edges: (n, 4) edge coordinates xa, ya, xb, yb in sinusoidal metres
+        edge_glacier: Local glacier index of every edge
+        buffer_distance: Buffer distance per local glacier index
+        tile_size, subpixels, scale: Grid of the tile
+
+    Returns:
+        tuple: (tile, (tile_size, tile_size) uint8 mask)
+    """
+    resolution = scale / subpixels
+    # Halo of whole MODIS pixels covering the largest buffer
+    halo = int(math.ceil(buffer_distance.max() / scale)) + 1 if len(buffer_distance) else 0
+    size = (tile_size + 2 * halo) * subpixels
+    x0 = origin[0] - halo * scale
+    y0 = origin[1] + halo * scale
+
+    cols_a = (edges[:, 0] - x0) / resolution
+    rows_a = (y0 - edges[:, 1]) / resolution
+    cols_b = (edges[:, 2] - x0) / resolution
+    rows_b = (y0 - edges[:, 3]) / resolution
+    labels = rasterize_polygons(rows_a, cols_a, rows_b, cols_b, edge_glacier, (size, size))
+
+    buffered = buffer_labels(labels, buffer_distance, resolution)
+    mask = block_majority(buffered, subpixels)
+    return tile, mask[halo:halo + tile_size, halo:halo + tile_size].astype(np.uint8)
+
+
+def tile_path(out_dir, tile):
+    return os.path.join(out_dir, 'glacier_mask_tile_{}_{}.npz'.format(*tile))
+
+
+def save_mask_tile(path, mask, origin, scale):
+    """
+    Write a mask tile with its grid (crs and affine transform).
+    """
+    transform = np.array([scale, 0, origin[0], 0, -scale, origin[1]])
+    np.savez_compressed(path, mask=mask, transform=transform, crs=MODIS_CRS)
+
+
+def load_mask_tile(path):
+    """
+    Read a mask tile written by build_glacier_mask_tiles.
+
+    Returns:
+        tuple: (mask, transform, crs)
+    """
+    with np.load(path) as data:
+        return data['mask'], data['transform'], str(data['crs'])
+
+
+def build_glacier_mask_tiles(glaciers, out_dir, tile_size=TILE_SIZE, subpixels=SUBPIXELS, scale=MODIS_SCALE_250,
+                             max_workers=None, verbose=False):
+    """
+    Buffered glacier mask on the MODIS 250 m grid, computed tile by tile in a process pool.
+    Tiles without glaciers are skipped.
+
+    Args:
+        glaciers: Glacier outlines as returned by load_glaciers
+        out_dir: Directory of the .npz tiles
+        tile_size: MODIS pixels per tile side
+        subpixels: Subpixels per MODIS pixel side used for rasterization
+        scale: MODIS pixel size in metres
+        max_workers: Number of worker processes (default: number of CPUs)
+        verbose: Print every written tile
+
+    Returns:
+        dict with 'written' (list of tile paths) and 'skipped' (number of tiles without glaciers)
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    area, perimeter = glacier_area_perimeter(glaciers)
+    buffer_distance = equal_area_buffer(area, perimeter)
+
+    start, end, ring = _edges(glaciers)
+    edge_glacier = glaciers['ring_glacier'][ring]
+    x, y = to_sinusoidal(glaciers['coords'][:, 0], glaciers['coords'][:, 1])
+    edges = np.column_stack([x[start], y[start], x[end], y[end]])
+
+    # Tile range of every glacier, extended by its buffer
+    n_glaciers = len(glaciers['ids'])
+    tile_extent = tile_size * scale
+    reach = buffer_distance[edge_glacier]
+    col_lo = np.full(n_glaciers, np.iinfo(np.int64).max)
+    col_hi = np.full(n_glaciers, np.iinfo(np.int64).min)
+    row_lo, row_hi = col_lo.copy(), col_hi.copy()
+    edge_col = np.floor((np.minimum(edges[:, 0], edges[:, 2]) - reach - MODIS_ORIGIN[0]) / tile_extent).astype(np.int64)
+    np.minimum.at(col_lo, edge_glacier, edge_col)
+    edge_col = np.floor((np.maximum(edges[:, 0], edges[:, 2]) + reach - MODIS_ORIGIN[0]) / tile_extent).astype(np.int64)
+    np.maximum.at(col_hi, edge_glacier, edge_col)
+    edge_row = np.floor((MODIS_ORIGIN[1] - np.maximum(edges[:, 1], edges[:, 3]) - reach) / tile_extent).astype(np.int64)
+    np.minimum.at(row_lo, edge_glacier, edge_row)
+    edge_row = np.floor((MODIS_ORIGIN[1] - np.minimum(edges[:, 1], edges[:, 3]) + reach) / tile_extent).astype(np.int64)
+    np.maximum.at(row_hi, edge_glacier, edge_row)
+
+    tiles = {}
+    for g in np.flatnonzero(col_lo <= col_hi):
+        for tr in range(row_lo[g], row_hi[g] + 1):
+            for tc in range(col_lo[g], col_hi[g] + 1):
+                tiles.setdefault((tr, tc), []).append(g)
+
+    summary = {'written': [], 'skipped': 0}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for tile, tile_glaciers in tiles.items():
+            tile_glaciers = np.array(tile_glaciers)
+            local = np.full(n_glaciers, -1)
+            local[tile_glaciers] = np.arange(len(tile_glaciers))
+            keep = local[edge_glacier] >= 0
+            origin = (MODIS_ORIGIN[0] + tile[1] * tile_extent, MODIS_ORIGIN[1] - tile[0] * tile_extent)
+            future = executor.submit(_tile_task, tile, origin, edges[keep], local[edge_glacier[keep]],
+                                     buffer_distance[tile_glaciers], tile_size, subpixels, scale)
+            futures[future] = origin
+        for future in as_completed(futures):
+            tile, mask = future.result()
+            if not mask.any():
+                summary['skipped'] += 1
+                continue
+            path = tile_path(out_dir, tile)
+            save_mask_tile(path, mask, futures[future], scale)
+            summary['written'].append(path)
+            if verbose:
+                print(f'  Glacier mask tile {tile} written: {int(mask.sum())} glacier pixels')
+    return summary
@@ -1,8 +1,11 @@
+import time
+
 import ee
 
-# Initialize Earth Engine (make sure to authenticate first)
-# ee.Authenticate()  # Run this once if needed
-ee.Initialize()
+from src.ee_async import run
+from src.getinfo_cache import get_info
+from src.glacier_index import tile_key
+from src.task_backend import EETaskBackend, start_tasks
 
 def buffer_equal(feature):
     """
@@ -24,12 +27,144 @@ def buffer_equal(feature):
     
     return ee.Feature(buff, {'featAr': feat_ar, 'bufferAr': buffer_ar, 'ratio': ratio})
 
-def main(export_all=False):
+def _get_info(obj, cache=None, client=None):
+    """
+    getInfo() through the optional GetInfoCache, evaluated through the optional AsyncEEClient
+    (concurrency and rate limits, retries on quota errors).
+    """
+    evaluate = None if client is None else (lambda o: run(client.compute(o)))
+    return get_info(obj, cache, evaluate=evaluate)
+
+def count_glaciers_per_tile(grid, glims, cache=None, client=None):
+    """
+    Number of glaciers in every grid tile, evaluated in a single request.
+    
+    Args:
+        grid: FeatureCollection of grid tiles
+        glims: FeatureCollection of glacier outlines
+        cache: Optional GetInfoCache for the result
+        client: Optional AsyncEEClient making the request
+        
+    Returns:
+        list: Glacier count per tile, in the order of the grid
+    """
+    counts = grid.map(lambda tile: tile.set('n_glaciers', glims.filterBounds(tile.geometry()).size()))
+    return _get_info(counts.aggregate_array('n_glaciers'), cache, client)
+
+def glacier_mask_image(tile_glaciers):
+    """
+    Glacier mask on the MODIS 250 m grid from the buffered outlines of the glaciers in a tile.
+    """
+    # Create buffered glacier outlines
+    def buffer_glacier_geom(ft):
+        glacier = ee.Feature(ft).geometry()
+        return buffer_equal(glacier)
+    
+    glacier_outlines = ee.FeatureCollection(tile_glaciers.map(buffer_glacier_geom))
+    glacier_outline = glacier_outlines.union(100).geometry()
+    
+    # Set up MODIS data
+    date1 = '2024-01-01'
+    date2 = '2024-12-30'
+    
+    modis_refl = (ee.ImageCollection('MODIS/061/MOD09GQ')
+                 .filterDate(ee.Date(date1), ee.Date(date2))
+                 .filter(ee.Filter.dayOfYear(152, 156))  # June-September
+                 .filterBounds(glacier_outline)
+                 .select(['sur_refl_b02'])
+                 .map(lambda image: image.divide(10000)))
+    
+    # Create glacier intersection mask
+    modis_area = modis_refl.first().select('sur_refl_b02')
+    # modis_grid = glacier_outline.coveringGrid(modis_area.projection())
+    
+    # def add_intersection_value(f):
+    #     return f.set('glacier_area', f.intersection(glacier_outline, 100).area(100))
+    
+    # # Select pixels covering at least 65% of the glacier: this code is too heavy for whole of CA
+    # output = modis_grid.map(add_intersection_value)
+    # min_area = ee.Number(0.65).multiply(
+    #     ee.Number(output.sort('glacier_area', False).aggregate_array("glacier_area").get(0))
+    # )
+    # glacier_intersection = output.filter(ee.Filter.gte("glacier_area", min_area)).union(ee.ErrorMargin(100))
+    
+    # Convert to image: select pixels with a majority of (buffered) glacier coverage (i.e., mode of 1)
+    glacier_intersection_fc = glacier_outlines.map(lambda ft: ee.Feature(ft).set('constant', 1))
+    return glacier_intersection_fc.reduceToImage(['constant'], ee.Reducer.first())\
+        .setDefaultProjection(ee.Projection('EPSG:4326').atScale(30))\
+        .reduceResolution(ee.Reducer.mode(),False,256)\
+        .reproject(modis_area.projection()).mask().round().selfMask()
+
+def export_tiles(tile_indices, glacier_counts, make_task, backend=None, max_workers=4, rate=2.0, retries=3,
+                 sleep=None, verbose=False, client=None):
+    """
+    Start the export tasks of all tiles that contain glaciers.
+    
+    Args:
+        tile_indices: Indices of the tiles to process
+        glacier_counts: Glacier count per tile (see count_glaciers_per_tile)
+        make_task: Function i -> export task of tile i
+        backend: Task backend (default: EETaskBackend)
+        max_workers: Number of submission threads
+        rate: Maximum number of task starts per second
+        retries: Number of retries per task
+        sleep: Sleep function used for rate limiting and backoff (default: time.sleep)
+        verbose: Print every started, skipped or failed tile
+        client: Optional AsyncEEClient; tasks are then started through its event loop, with
+            its concurrency limit, rate limits and backoff (backend, max_workers, rate, retries
+            and sleep are not used)
+        
+    Returns:
+        dict with 'started' (description -> task id), 'skipped' (tile indices without glaciers)
+        and 'failed' (description -> error message)
+    """
+    skipped = [i for i in tile_indices if glacier_counts[i] == 0]
+    if verbose:
+        for i in skipped:
+            print(f"  No glaciers in tile {i}, skipping")
+    
+    jobs = [(f'glacier_intersection_tile_{i}', lambda i=i: make_task(i))
+            for i in tile_indices if glacier_counts[i] > 0]
+    if client is not None:
+        summary = run(client.start_tasks(jobs, verbose=verbose))
+    else:
+        summary = start_tasks(jobs, backend or EETaskBackend(), max_workers=max_workers, rate=rate, retries=retries,
+                              sleep=sleep or time.sleep, verbose=verbose)
+    summary['skipped'] = skipped
+    return summary
+
+def tile_keys(grid, cache=None, client=None):
+    """
+    GlacierIndex keys of the tiles of a covering grid, in the order of the grid (one request,
+    through the optional GetInfoCache and AsyncEEClient).
+    """
+    keys = []
+    for tile in _get_info(grid, cache, client)['features']:
+        ring = tile['geometry']['coordinates'][0]
+        lon = sum(c[0] for c in ring[:-1]) / (len(ring) - 1)
+        lat = sum(c[1] for c in ring[:-1]) / (len(ring) - 1)
+        keys.append(tile_key(lon, lat))
+    return keys
+
+def main(export_all=False, backend=None, max_workers=4, rate=2.0, retries=3, glacier_index=None, cache=None,
+         client=None):
     """
     Main function to export glacier mask tiles
     
     Args:
         export_all (bool): If True, export all tiles. If False, only export first 10 tiles for testing.
+        backend: Task backend (default: EETaskBackend)
+        max_workers: Number of threads submitting export tasks
+        rate: Maximum number of task starts per second
+        retries: Number of retries per task on Earth Engine errors
+        glacier_index: Optional GlacierIndex with the 100 km tiles as regions; tiles then select
+            their glaciers by id instead of filterBounds
+        cache: Optional GetInfoCache; reruns then reuse the grid and glacier counts
+        client: Optional AsyncEEClient evaluating the grid or glacier counts and starting the
+            export tasks (see export_tiles)
+        
+    Returns:
+        dict: Summary of started, skipped and failed tiles
     """
     # Load river basins
     river_basins_2023 = ee.FeatureCollection('users/hydrosolutions/RiverBasins_CA_Jan2023_simple1000')
@@ -48,80 +183,37 @@ def main(export_all=False):
         geometry = ee.Geometry.Point([71.5564668249662, 39.62409902124268])
         grid = grid.filterBounds(geometry)
     
-    print('Number of grids:', grid.size().getInfo())
+    if glacier_index is not None:
+        # Glaciers of every tile from the index
+        keys = tile_keys(grid, cache, client)
+        glacier_counts = [len(glacier_index.glaciers(key)) for key in keys]
+    else:
+        # Glacier counts of all tiles in one request
+        glacier_counts = count_glaciers_per_tile(grid, glims, cache, client)
+    total_tiles = len(glacier_counts)
+    print('Number of grids:', total_tiles)
 
     # Get the grid tiles as a list
-    grid_list = grid.toList(grid.size())
+    grid_list = grid.toList(total_tiles)
     
     # Determine number of tiles to process
-    total_tiles = grid.size().getInfo()
-    num_tiles_to_process = 10 if not export_all else total_tiles
+    num_tiles_to_process = min(10, total_tiles) if not export_all else total_tiles
     
     print(f"Processing {'all' if export_all else 'first 10'} tiles ({num_tiles_to_process} total)...")
     
-    for i in range(num_tiles_to_process):
-        # Progress reporting
-        if export_all and i % 10 == 0:
-            print(f"Processing tile {i}/{total_tiles}")
-        elif not export_all:
-            print(f"\nProcessing tile {i}...")
-        
+    def make_task(i):
         # Get this grid tile geometry
         this_grid = ee.Feature(grid_list.get(i)).geometry()
         
-        # Filter glaciers within this tile
-        tile_glaciers = glims.filterBounds(this_grid)
-        glacier_count = tile_glaciers.size().getInfo()
-        
-        if glacier_count == 0:
-            if not export_all:
-                print(f"  No glaciers in tile {i}, skipping")
-            continue
-            
-        if not export_all:
-            print(f"  Found {glacier_count} glaciers in tile {i}")
+        # Glacier mask from the glaciers within this tile
+        if glacier_index is not None:
+            tile_glaciers = glims.filter(glacier_index.glacier_filter(keys[i]))
+        else:
+            tile_glaciers = glims.filterBounds(this_grid)
+        glacier_intersection_img = glacier_mask_image(tile_glaciers)
         
-        # Create buffered glacier outlines
-        def buffer_glacier_geom(ft):
-            glacier = ee.Feature(ft).geometry()
-            return buffer_equal(glacier)
-        
-        glacier_outlines = ee.FeatureCollection(tile_glaciers.map(buffer_glacier_geom))
-        glacier_outline = glacier_outlines.union(100).geometry()
-        
-        # Set up MODIS data
-        date1 = '2024-01-01'
-        date2 = '2024-12-30'
-        
-        modis_refl = (ee.ImageCollection('MODIS/061/MOD09GQ')
-                     .filterDate(ee.Date(date1), ee.Date(date2))
-                     .filter(ee.Filter.dayOfYear(152, 156))  # June-September
-                     .filterBounds(glacier_outline)
-                     .select(['sur_refl_b02'])
-                     .map(lambda image: image.divide(10000)))
-        
-        # Create glacier intersection mask
-        modis_area = modis_refl.first().select('sur_refl_b02')
-        # modis_grid = glacier_outline.coveringGrid(modis_area.projection())
-        
-        # def add_intersection_value(f):
-        #     return f.set('glacier_area', f.intersection(glacier_outline, 100).area(100))
-        
-        # # Select pixels covering at least 65% of the glacier: this code is too heavy for whole of CA
-        # output = modis_grid.map(add_intersection_value)
-        # min_area = ee.Number(0.65).multiply(
-        #     ee.Number(output.sort('glacier_area', False).aggregate_array("glacier_area").get(0))
-        # )
-        # glacier_intersection = output.filter(ee.Filter.gte("glacier_area", min_area)).union(ee.ErrorMargin(100))
-        
-        # Convert to image: select pixels with a majority of (buffered) glacier coverage (i.e., mode of 1)
-        glacier_intersection_fc = glacier_outlines.map(lambda ft: ee.Feature(ft).set('constant', 1))
-        glacier_intersection_img = glacier_intersection_fc.reduceToImage(['constant'], ee.Reducer.first())\
-            .setDefaultProjection(ee.Projection('EPSG:4326').atScale(30))\
-            .reduceResolution(ee.Reducer.mode(),False,256)\
-            .reproject(modis_area.projection()).mask().round().selfMask()
         # Export to asset
-        task = ee.batch.Export.image.toAsset(
+        return ee.batch.Export.image.toAsset(
             image=glacier_intersection_img,
             description=f'glacier_intersection_tile_{i}',
             assetId=f'projects/ee-hydro4u/assets/snow_CentralAsia/glacier_mask_collection/glacier_intersection_tile_{i}',
@@ -129,15 +221,23 @@ def main(export_all=False):
             scale=250,
             maxPixels=1e13
         )
-        
-        task.start()
-        if not export_all:
-            print(f"  Export task started for tile {i}: glacier_intersection_tile_{i}")
     
-    print(f"\nAll {num_tiles_to_process} export tasks have been started!")
+    summary = export_tiles(range(num_tiles_to_process), glacier_counts, make_task, backend,
+                           max_workers=max_workers, rate=rate, retries=retries, verbose=not export_all,
+                           client=client)
+    
+    print(f"\nExport tasks started: {len(summary['started'])}, "
+          f"skipped (no glaciers): {len(summary['skipped'])}, failed: {len(summary['failed'])}")
+    for description, error in summary['failed'].items():
+        print(f"  {description}: {error}")
     print("Monitor progress at: https://code.earthengine.google.com/tasks")
+    return summary
 
 if __name__ == "__main__":
+    # Initialize Earth Engine (make sure to authenticate first)
+    # ee.Authenticate()  # Run this once if needed
+    ee.Initialize()
+    
     # Run main function for testing (processes first 10 tiles)
     main(export_all=False)
     
@@ -1,5 +1,12 @@
+import calendar
+import datetime
+import functools
+import math
+
 import ee
 
+from src.qa_bits import qa_cloud_mask
+
 # functions to load and process MODIS 500 m data: 
 # - MOD10A1.061 Terra Snow Cover Daily Global 500m for NDSI snow cover
 # - MYD10A1.061 Aqua Snow Cover Daily Global 500m for NDSI snow cover
@@ -48,9 +55,53 @@ def fill_modis_with_aqua(terra_img):
     filled = terra_ndsi.where(terra_class.gte(200), aqua_ndsi)
     return filled.set('system:time_start', terra_img.get('system:time_start'))
 
-def fill_modis_with_aqua_250(terra_img,aoi,glacier_mask):
+def load_modis_aqua(aoi):
+    """
+    Load MODIS Aqua snow cover image collection filtered by AOI.
+    """
+    aqua = ee.ImageCollection("MODIS/061/MYD10A1") \
+        .filterBounds(aoi)
+
+    return aqua
+
+def pair_terra_aqua(terra_coll, aqua_coll):
+    """
+    Attach to every Terra image the Aqua image of the same day, as property 'aqua', in one join.
+    MOD10A1 and MYD10A1 daily images are stamped at 00:00 UTC, so matching system:time_start
+    selects the same Aqua image as filterDate(date, date + 1 day). Terra images without an
+    Aqua image of the same day are kept without the property.
+    """
+    same_day = ee.Filter.equals(leftField='system:time_start', rightField='system:time_start')
+    return ee.ImageCollection(ee.Join.saveFirst(matchKey='aqua', outer=True).apply(terra_coll, aqua_coll, same_day))
+
+def fill_modis_with_aqua_paired(terra_img):
+    """
+    Fill gaps in MODIS Terra NDSI snow cover using the Aqua image attached by pair_terra_aqua.
+    Gives the same result as fill_modis_with_aqua without a per-image collection lookup.
+    """
+    aqua_img = terra_img.get('aqua')
+    aqua_ndsi = ee.Image(ee.Algorithms.If(
+        aqua_img,
+        ee.Image(aqua_img).select('NDSI_Snow_Cover'),
+        ee.Image.constant(0).rename('NDSI_Snow_Cover')
+    ))
+
+    terra_ndsi = terra_img.select('NDSI_Snow_Cover')
+    terra_class = terra_img.select('NDSI_Snow_Cover_Class')
+
+    filled = terra_ndsi.where(terra_class.gte(200), aqua_ndsi)
+    return filled.set('system:time_start', terra_img.get('system:time_start'))
+
+def fill_modis_with_aqua_250(terra_img,aoi,glacier_mask,qa_policy='state_1km'):
     """
     Fill gaps in MODIS Terra NDSI snow cover using Aqua image of the same day.
+
+    Args:
+        terra_img: MODIS Terra MOD09GQ image
+        aoi: Area of interest as an ee.Geometry
+        glacier_mask: Glacier mask used for the cloud cover fractions
+        qa_policy: 'state_1km' (cloud state of MOD09GA/MYD09GA) or 'qc_250m' (cloud state and
+            cloud shadow of the QC_250m band of the MOD09GQ/MYD09GQ images themselves)
     """
     date = terra_img.date()
 
@@ -59,67 +110,23 @@ def fill_modis_with_aqua_250(terra_img,aoi,glacier_mask):
     
 
     terra_reflectance = terra_img.select('sur_refl_b02')
-    
-    def get_qa_bits(image, start, end, new_name):
-        """
-        Extract QA bits from a quality band.
-        
-        Args:
-            image: Input image
-            start: Start bit position
-            end: End bit position
-            new_name: Name for the output band
-            
-        Returns:
-            Image with extracted QA bits
-        """
-        pattern = 0
-        for i in range(start, end + 1):
-            pattern += 2 ** i
-        
-        return (image.select([0], [new_name])
-                .bitwiseAnd(pattern)
-                .rightShift(start))
 
-    """
-    Create cloud mask using MODIS MOD09GA state_1km band.
-    
-    Args:
-        terra_img: MODIS Terra image
-        
-    Returns:
-        Cloud mask image
-    """
-
-    modis_cloud = (ee.ImageCollection('MODIS/061/MOD09GA')
-                .filterDate(terra_img.date(), terra_img.date().advance(1, 'day'))
-                .filterBounds(aoi)
-                .first())
-    
-    # Mask cloudy pixels with state_1km, leave pixels marked clear, mixed and undecided
-    cloud = get_qa_bits(modis_cloud.select('state_1km'), 0, 1, 'Clouds').expression("b(0) == 1")
-    cloud_mask = cloud.unmask(0).eq(1)
-
-    myd_cloud = (ee.ImageCollection('MODIS/061/MYD09GA')
-                .filterDate(terra_img.date(), terra_img.date().advance(1, 'day'))
-                .filterBounds(aoi)
-                .first())    
-    
-    # modis_cloud = (ee.ImageCollection('MODIS/061/MOD09GQ')
-    #             .filterDate(terra_img.date(), terra_img.date().advance(1, 'day'))
-    #             .filterBounds(aoi)
-    #             .first()).select('QC_250m')
-
-    # myd_cloud = (ee.ImageCollection('MODIS/061/MYD09GQ')
-    #             .filterDate(terra_img.date(), terra_img.date().advance(1, 'day'))
-    #             .filterBounds(aoi)
-    #             .first()).select('QC_250m')
-        
-    # # Mask cloudy pixels with QC_250m
-    # cloud_state = get_qa_bits(modis_cloud, 2, 3, 'cloud_state')
-    # cloud_shadow = get_qa_bits(modis_cloud, 4, 4, 'cloud_shadow')
-    # cloud = cloud_state.eq(1).Or(cloud_shadow.eq(1))
-    # cloud_mask = cloud.unmask(-9999).eq(1)
+    if qa_policy == 'qc_250m':
+        # Mask cloudy pixels with QC_250m
+        cloud_mask = qa_cloud_mask(terra_img, qa_policy).unmask(-9999).eq(1)
+        myd_cloud = ee.Image(aqua_col.first())
+    else:
+        # Mask cloudy pixels with state_1km, leave pixels marked clear, mixed and undecided
+        modis_cloud = (ee.ImageCollection('MODIS/061/MOD09GA')
+                    .filterDate(terra_img.date(), terra_img.date().advance(1, 'day'))
+                    .filterBounds(aoi)
+                    .first())
+        cloud_mask = qa_cloud_mask(modis_cloud, qa_policy).unmask(0).eq(1)
+
+        myd_cloud = (ee.ImageCollection('MODIS/061/MYD09GA')
+                    .filterDate(terra_img.date(), terra_img.date().advance(1, 'day'))
+                    .filterBounds(aoi)
+                    .first())    
 
     # Calculate cloud cover over glacier area
     cc_fraction = cloud_mask.updateMask(glacier_mask).reduceRegion(
@@ -135,8 +142,7 @@ def fill_modis_with_aqua_250(terra_img,aoi,glacier_mask):
         aqua_col.size().gt(0),
         ee.Image(ee.Algorithms.If(
             myd_cloud.bandNames().size().gt(0),
-            get_qa_bits(myd_cloud.select('state_1km'), 0, 1, 'Clouds').expression("b(0) == 1").unmask(0).eq(1),
-            # get_qa_bits(myd_cloud, 2, 3, 'cloud_state').eq(1).Or(get_qa_bits(myd_cloud, 4, 4, 'cloud_shadow').eq(1)),
+            qa_cloud_mask(myd_cloud, qa_policy).unmask(0).eq(1),
             ee.Image.constant(1).rename('cloud_mask')  # Assume cloudy if no QA data
         )),
         ee.Image.constant(1).rename('cloud_mask')  # No Aqua data available
@@ -157,61 +163,40 @@ def fill_modis_with_aqua_250(terra_img,aoi,glacier_mask):
         tileScale=1
     ).values()
 
-    # cloud = get_qa_bits(myd_cloud.select('state_1km'), 0, 1, 'Clouds').expression("b(0) == 1")
-    # cloud_mask_myd = myd_cloud.select('sur_refl_b02').updateMask(cloud).unmask(-9999).gte(0)
-
     filled = aqua_reflectance.blend(terra_reflectance.updateMask(cloud_mask.neq(1))).divide(10000)##10000 is the scale factor for MOD09GQ
     return filled.set('system:time_start', terra_img.get('system:time_start')) \
         .set('cc_fraction', cc_fraction.get(0)) \
         .set('cc_fraction2', cc_fraction2.get(0))
         # .addBands(terra_reflectance.where(cloud_mask.eq(1), aqua_ndsi).mask().rename('cloud_mask')) \
 
-def modis_cloud_masking_250(terra_img, aoi):
+def modis_cloud_masking_250(terra_img, aoi, qa_policy='state_1km'):
     """
-    Fill gaps in MODIS Terra NDSI snow cover using Aqua image of the same day.
+    Mask cloudy pixels of a MODIS Terra MOD09GQ reflectance image.
+
+    Args:
+        terra_img: MODIS Terra MOD09GQ image
+        aoi: Area of interest as an ee.Geometry
+        qa_policy: 'state_1km' (cloud state of MOD09GA) or 'qc_250m' (cloud state and cloud
+            shadow of the QC_250m band of terra_img)
+
+    Returns:
+        Masked sur_refl_b02 reflectance
     """
     date = terra_img.date()
 
     terra_reflectance = terra_img.select('sur_refl_b02')
 
-    def get_qa_bits(image, start, end, new_name):
-        """
-        Extract QA bits from a quality band.
-        
-        Args:
-            image: Input image
-            start: Start bit position
-            end: End bit position
-            new_name: Name for the output band
-            
-        Returns:
-            Image with extracted QA bits
-        """
-        pattern = 0
-        for i in range(start, end + 1):
-            pattern += 2 ** i
-        
-        return (image.select([0], [new_name])
-                .bitwiseAnd(pattern)
-                .rightShift(start))
-
-    """
-    Create cloud mask using MODIS MOD09GA state_1km band.
-    
-    Args:
-        terra_img: MODIS Terra image
-        
-    Returns:
-        Cloud mask image
-    """
-    modis_cloud = (ee.ImageCollection('MODIS/061/MOD09GA')
-                .filterDate(terra_img.date(), terra_img.date().advance(1, 'day'))
-                .filterBounds(aoi)
-                .first())
-    
-    # Mask cloudy pixels with state_1km, leave pixels marked clear, mixed and undecided
-    cloud = get_qa_bits(modis_cloud.select('state_1km'), 0, 1, 'Clouds').expression("b(0) == 1")
-    cloud_mask = modis_cloud.select('sur_refl_b02').updateMask(cloud).unmask(-9999).gte(0)
+    if qa_policy == 'qc_250m':
+        # Mask cloudy and cloud shadow pixels with QC_250m
+        cloud_mask = qa_cloud_mask(terra_img, qa_policy).unmask(-9999).eq(1)
+    else:
+        # Mask cloudy pixels with state_1km, leave pixels marked clear, mixed and undecided
+        modis_cloud = (ee.ImageCollection('MODIS/061/MOD09GA')
+                    .filterDate(terra_img.date(), terra_img.date().advance(1, 'day'))
+                    .filterBounds(aoi)
+                    .first())
+        cloud = qa_cloud_mask(modis_cloud, qa_policy)
+        cloud_mask = modis_cloud.select('sur_refl_b02').updateMask(cloud).unmask(-9999).gte(0)
         
     masked = terra_reflectance.updateMask(cloud_mask.neq(1)).divide(10000)##10000 is the scale factor for MOD09GQ
     return masked.set('system:time_start', terra_img.get('system:time_start'))
@@ -304,8 +289,103 @@ def extract_year_ranges(year_range, agg_interval):
     intervals_per_year = ee.List(ee.List(year_range).iterate(iterate_years, ee.List([])))
     return intervals_per_year
 
+def _advance_months(date, months):
+    """
+    Advance a datetime by whole months, clamping the day to the length of the target month
+    (as ee.Date.advance with unit 'month').
+    """
+    month_index = date.month - 1 + months
+    year = date.year + month_index // 12
+    month = month_index % 12 + 1
+    day = min(date.day, calendar.monthrange(year, month)[1])
+    return date.replace(year=year, month=month, day=day)
+
+
+@functools.lru_cache(maxsize=None)
+def decadal_intervals(start_year, end_year, agg_interval=10):
+    """
+    Client-side equivalent of extract_year_ranges (flattened): the same interval boundaries,
+    computed in Python and memoized per (start_year, end_year, agg_interval).
+
+    Args:
+        start_year: First year
+        end_year: Last year (inclusive)
+        agg_interval: Aggregation interval in days (e.g., 10 for decadal)
+
+    Returns:
+        tuple: (start, end) pairs in milliseconds since the epoch (UTC), as used by ee.Date
+    """
+    ms_per_day = 86400000
+    month_check = math.ceil(30 / agg_interval)
+    intervals = []
+    for year in range(start_year, end_year + 1):
+        start_date = datetime.datetime(year, 1, 1, tzinfo=datetime.timezone.utc)
+        end_date = datetime.datetime(year, 12, 31, tzinfo=datetime.timezone.utc)
+        n_days = (end_date - start_date).days
+        interval_no = math.floor(n_days / agg_interval + 0.5)
+        rel_delta = math.ceil(n_days / (30.5 * interval_no))
+
+        date = start_date
+        for _ in range(max(interval_no, 1)):
+            month_ms = (_advance_months(date, rel_delta) - date) // datetime.timedelta(milliseconds=1)
+            next_date = date + datetime.timedelta(milliseconds=round(month_ms / month_check))
+            intervals.append((round(date.timestamp() * 1000), round(next_date.timestamp() * 1000)))
+            date = next_date
+    return tuple(intervals)
+
+
+def time_intervals_to_ee(time_intervals):
+    """
+    Convert client-side intervals (see decadal_intervals) to an ee.List of [start, end] pairs.
+    An ee.List is returned unchanged, so server-side intervals can be passed as well.
+    """
+    if isinstance(time_intervals, ee.List):
+        return time_intervals
+    return ee.List([[start, end] for start, end in time_intervals])
+
+
+def interpolate_window(mscf, start, end, window_days=5):
+    """
+    Temporal interpolation of the images of an interval: every pixel is the mean of its
+    nearest valid observation at or before and at or after the image date, looking up to
+    window_days beyond the interval bounds. Pixels without a valid observation on both sides
+    stay masked.
+    The collection is filtered once to the extended window and the backward/forward
+    neighbours of all images are attached with two joins, instead of filtering and sorting
+    the whole collection for every image.
+
+    Args:
+        mscf: ee.ImageCollection of daily images
+        start: ee.Date, start of the interval
+        end: ee.Date, end of the interval
+        window_days: Days searched before the start and after the end of the interval
+
+    Returns:
+        ee.ImageCollection of interpolated images of the interval
+    """
+    window = mscf.filterDate(start.advance(-window_days, 'day'), end.advance(window_days, 'day'))
+    interval = window.filterDate(start, end)
+
+    before = ee.Join.saveAll(matchesKey='before', ordering='system:time_start', ascending=False).apply(
+        interval, window,
+        ee.Filter.greaterThanOrEquals(leftField='system:time_start', rightField='system:time_start'))
+    paired = ee.Join.saveAll(matchesKey='after', ordering='system:time_start', ascending=True).apply(
+        before, window,
+        ee.Filter.lessThanOrEquals(leftField='system:time_start', rightField='system:time_start'))
+
+    def interpolate(img):
+        bwd_nonnull = ee.ImageCollection.fromImages(img.get('before')).reduce(ee.Reducer.firstNonNull())
+        fwd_nonnull = ee.ImageCollection.fromImages(img.get('after')).reduce(ee.Reducer.firstNonNull())
+
+        imgs4avg = ee.ImageCollection([fwd_nonnull, bwd_nonnull])
+        mean_img = imgs4avg.mean().updateMask(imgs4avg.count().eq(2))  # Require both sides for interpolation
+        return mean_img.set('system:time_start', img.get('system:time_start'))
+
+    return ee.ImageCollection(paired).map(interpolate)
+
+
 # Create composites for each interval
-def process_interval(mscf,date_range):
+def process_interval(mscf,date_range,compositing='mean'):
     date_range= ee.List(date_range)
     start = ee.Date(date_range.get(0))
     end = ee.Date(date_range.get(1))
@@ -313,27 +393,15 @@ def process_interval(mscf,date_range):
     month = start.get('month')
     day = start.get('day')
 
-    def interpolate(img):
-        date = ee.Date(img.get('system:time_start'))
-
-        # Look forward and backward ±5 days to find nearest images
-        mscf_fwd = mscf.filterDate(date, end.advance(5, 'day')).sort('system:time_start')
-        mscf_bwd = mscf.filterDate(start.advance(-5, 'day'), date.advance(0.1, 'day')).sort('system:time_start', False)
-
-        mscf_fwd_nonnull = mscf_fwd.reduce(ee.Reducer.firstNonNull())
-        mscf_bwd_nonnull = mscf_bwd.reduce(ee.Reducer.firstNonNull())
-
-        imgs4avg = ee.ImageCollection([mscf_fwd_nonnull, mscf_bwd_nonnull])
-        mean_img = imgs4avg.mean().updateMask(imgs4avg.count().eq(2))  # Require both sides for interpolation
-
-        return mean_img
-    
-    # Interpolate over the month
-    mscf_month = mscf.filterDate(start, end)
-    # mscf_interpolated = mscf_month.map(interpolate)
-    # img2return = mscf_interpolated.mean().rename('value')
-    # Simple mean composite without the complex interpolation
-    img2return = mscf_month.mean().rename('value')
+    if compositing == 'interpolate':
+        # Mean of the images interpolated from their nearest valid observations (±5 days)
+        img2return = interpolate_window(mscf, start, end).mean().rename('value')
+    elif compositing == 'mean':
+        # Simple mean composite without the interpolation
+        mscf_month = mscf.filterDate(start, end)
+        img2return = mscf_month.mean().rename('value')
+    else:
+        raise ValueError(f"Unknown compositing '{compositing}'")
 
     # Smooth and blend for filling gaps
     img2return = img2return.focal_mean(radius=2, kernelType='circle', units='pixels', iterations=1).blend(img2return)
@@ -384,7 +452,8 @@ def process_interval_250_with_with_cc_info(mscf,date_range):
         'cc_fraction2': mscf_month.aggregate_mean('cc_fraction2')
     })
 
-def create_decadal_composites(aoi, start_year, end_year, agg_interval=10):
+def create_decadal_composites(aoi, start_year, end_year, agg_interval=10, time_intervals=None, pairing='join',
+                              compositing='mean'):
     """
     Create decadal (or other interval) composites from MODIS snow cover data.
     
@@ -393,15 +462,20 @@ def create_decadal_composites(aoi, start_year, end_year, agg_interval=10):
         start_year: Starting year for processing
         end_year: Ending year for processing
         agg_interval: Aggregation interval in days (default: 10 for decadal)
+        time_intervals: Optional (start, end) pairs in milliseconds or ee.List of intervals
+            (default: decadal_intervals(start_year, end_year, agg_interval))
+        pairing: How Aqua images are matched to Terra images for gap filling: 'join' (one bulk
+            join by acquisition day) or 'lookup' (filterDate on MYD10A1 for every Terra image)
+        compositing: 'mean' (mean of the daily images) or 'interpolate' (mean of the daily
+            images with gaps filled from the nearest valid observations, see interpolate_window)
         
     Returns:
         An ee.ImageCollection of composites
     """
-    # Generate time intervals
-    year_range = ee.List.sequence(start_year, end_year)
-    # First get all intervals and flatten the list
-    time_intervals_all = ee.List(extract_year_ranges(year_range, agg_interval)
-        .iterate(lambda list, previous: ee.List(previous).cat(ee.List(list)), ee.List([])))
+    # Generate time intervals on the client unless given
+    if time_intervals is None:
+        time_intervals = decadal_intervals(start_year, end_year, agg_interval)
+    time_intervals_all = time_intervals_to_ee(time_intervals)
     
     # Load all MODIS data for the entire time span
     start_date = ee.Date.fromYMD(start_year, 1, 1)
@@ -409,10 +483,22 @@ def create_decadal_composites(aoi, start_year, end_year, agg_interval=10):
     terra_coll = load_modis(aoi)#start_date, end_date
     
     # Create filled MODIS snow cover fraction collection
-    mscf = terra_coll.map(lambda img: fill_modis_with_aqua(img))
+    if pairing == 'join':
+        aqua_coll = load_modis_aqua(aoi)
+        if not isinstance(time_intervals, ee.List) and len(time_intervals) > 0:
+            # Restrict the join to the days covered by the intervals
+            span_start = min(start for start, _ in time_intervals)
+            span_end = max(end for _, end in time_intervals)
+            terra_coll = terra_coll.filterDate(span_start, span_end)
+            aqua_coll = aqua_coll.filterDate(span_start, span_end)
+        mscf = pair_terra_aqua(terra_coll, aqua_coll).map(fill_modis_with_aqua_paired)
+    elif pairing == 'lookup':
+        mscf = terra_coll.map(lambda img: fill_modis_with_aqua(img))
+    else:
+        raise ValueError(f"Unknown pairing '{pairing}'")
     
     # time_intervals_all should be an ee.List of [start, end] ee.Date pairs
-    modis_ic = ee.ImageCollection(time_intervals_all.map(lambda list:process_interval(mscf, list)))
+    modis_ic = ee.ImageCollection(time_intervals_all.map(lambda list:process_interval(mscf, list, compositing)))
         
     # Tag images with band count and filter out empty images
     tagged = modis_ic.map(lambda img: img.set('band_count', img.bandNames().size()))
@@ -420,7 +506,8 @@ def create_decadal_composites(aoi, start_year, end_year, agg_interval=10):
     
     return modis_ic
 
-def create_decadal_composites_250(aoi, start_year, end_year, agg_interval=10, glacier_mask=None):
+def create_decadal_composites_250(aoi, start_year, end_year, agg_interval=10, glacier_mask=None, time_intervals=None,
+                                  qa_policy='state_1km'):
     """
     Create decadal (or other interval) composites from MODIS reflectance data.
     Two option to fill gaps: 1) with Aqua data, 2) with cloud masking only.
@@ -431,15 +518,17 @@ def create_decadal_composites_250(aoi, start_year, end_year, agg_interval=10, gl
         start_year: Starting year for processing
         end_year: Ending year for processing
         agg_interval: Aggregation interval in days (default: 10 for decadal)
+        time_intervals: Optional (start, end) pairs in milliseconds or ee.List of intervals
+            (default: decadal_intervals(start_year, end_year, agg_interval))
+        qa_policy: Cloud masking policy of src.qa_bits ('state_1km' or 'qc_250m')
         
     Returns:
         An ee.ImageCollection of composites
     """
-    # Generate time intervals
-    year_range = ee.List.sequence(start_year, end_year)
-    # First get all intervals and flatten the list
-    time_intervals_all = ee.List(extract_year_ranges(year_range, agg_interval)
-        .iterate(lambda list, previous: ee.List(previous).cat(ee.List(list)), ee.List([])))
+    # Generate time intervals on the client unless given
+    if time_intervals is None:
+        time_intervals = decadal_intervals(start_year, end_year, agg_interval)
+    time_intervals_all = time_intervals_to_ee(time_intervals)
     
     # Load all MODIS data for the entire time span
     start_date = ee.Date.fromYMD(start_year, 1, 1)
@@ -447,8 +536,8 @@ def create_decadal_composites_250(aoi, start_year, end_year, agg_interval=10, gl
     terra_coll = load_modis_250(aoi).filterDate(start_date, end_date)
     
     # Create filled MODIS snow cover fraction collection
-    mscf = terra_coll.map(lambda img: modis_cloud_masking_250(img,aoi))
-    # mscf = terra_coll.map(lambda img: fill_modis_with_aqua_250(img,aoi,glacier_mask))
+    mscf = terra_coll.map(lambda img: modis_cloud_masking_250(img,aoi,qa_policy))
+    # mscf = terra_coll.map(lambda img: fill_modis_with_aqua_250(img,aoi,glacier_mask,qa_policy))
     
     # time_intervals_all should be an ee.List of [start, end] ee.Date pairs
     modis_ic = ee.ImageCollection(time_intervals_all.map(lambda list:process_interval_250(mscf, list)))
@@ -0,0 +1,177 @@
+import functools
+
+import numpy as np
+
+# Decoding of the MODIS quality bands used for cloud masking:
+# - state_1km of MOD09GA/MYD09GA (bits 0-1 cloud state, bit 2 cloud shadow)
+# - QC_250m of MOD09GQ/MYD09GQ (bits 2-3 cloud state, bit 4 cloud shadow)
+# A policy names the QA band, the bit ranges of the cloud and shadow flags, the flag values
+# counted as cloud/shadow, and whether shadow pixels are masked in addition to clouds.
+# Earth Engine images are decoded with get_qa_bits; local uint16 arrays are decoded through
+# 65536-entry lookup tables, i.e. one table read per pixel for all masks.
+
+QA_POLICIES = {
+    # Mask cloudy pixels with state_1km, leave pixels marked clear, mixed and undecided
+    'state_1km': {
+        'band': 'state_1km',
+        'cloud': (0, 1, (1,)),
+        'shadow': (2, 2, (1,)),
+        'mask_shadow': False,
+    },
+    # Mask cloudy and cloud shadow pixels with QC_250m
+    'qc_250m': {
+        'band': 'QC_250m',
+        'cloud': (2, 3, (1,)),
+        'shadow': (4, 4, (1,)),
+        'mask_shadow': True,
+    },
+}
+
+# Bits of the packed lookup table entries
+CLOUD = 1
+SHADOW = 2
+CLEAR = 4
+
+
+def get_policy(policy):
+    """
+    Return the policy dictionary for a policy name (or a policy dictionary).
+    """
+    if isinstance(policy, dict):
+        return policy
+    if policy not in QA_POLICIES:
+        raise ValueError(f"Unknown QA policy '{policy}', expected one of {sorted(QA_POLICIES)}")
+    return QA_POLICIES[policy]
+
+
+def bit_pattern(start, end):
+    """
+    Integer with bits start..end (inclusive) set.
+    """
+    return ((1 << (end - start + 1)) - 1) << start
+
+
+# ---------------------------------------------------------------------------
+# Earth Engine
+# ---------------------------------------------------------------------------
+
+def get_qa_bits(image, start, end, new_name):
+    """
+    Extract QA bits from a quality band.
+
+    Args:
+        image: Input image
+        start: Start bit position
+        end: End bit position
+        new_name: Name for the output band
+
+    Returns:
+        Image with extracted QA bits
+    """
+    return (image.select([0], [new_name])
+            .bitwiseAnd(bit_pattern(start, end))
+            .rightShift(start))
+
+
+def _flag(qa_image, rule, name):
+    start, end, values = rule
+    bits = get_qa_bits(qa_image, start, end, name)
+    flag = bits.eq(values[0])
+    for value in values[1:]:
+        flag = flag.Or(bits.eq(value))
+    return flag
+
+
+def qa_cloud_mask(image, policy='state_1km'):
+    """
+    Cloud mask (1 = masked, 0 = usable) of a MODIS image following a QA policy.
+
+    Args:
+        image: Image containing the QA band of the policy (e.g. a MOD09GA or MOD09GQ image)
+        policy: Policy name in QA_POLICIES or policy dictionary
+
+    Returns:
+        Single band image 'cloud_mask'
+    """
+    policy = get_policy(policy)
+    qa_image = image.select(policy['band'])
+    mask = _flag(qa_image, policy['cloud'], 'cloud')
+    if policy['mask_shadow']:
+        mask = mask.Or(_flag(qa_image, policy['shadow'], 'cloud_shadow'))
+    return mask.rename('cloud_mask')
+
+
+# ---------------------------------------------------------------------------
+# Local arrays
+# ---------------------------------------------------------------------------
+
+def _rule_table(codes, rule):
+    start, end, values = rule
+    bits = (codes & bit_pattern(start, end)) >> start
+    return np.isin(bits, values)
+
+
+def _build_table(policy):
+    codes = np.arange(1 << 16, dtype=np.uint32)
+    cloud = _rule_table(codes, policy['cloud'])
+    shadow = _rule_table(codes, policy['shadow'])
+    masked = cloud | shadow if policy['mask_shadow'] else cloud
+    table = np.zeros(1 << 16, dtype=np.uint8)
+    table[cloud] |= CLOUD
+    table[shadow] |= SHADOW
+    table[~masked] |= CLEAR
+    table.setflags(write=False)
+    return table
+
+
+@functools.lru_cache(maxsize=None)
+def _named_table(policy_name):
+    return _build_table(QA_POLICIES[policy_name])
+
+
+def qa_lookup_table(policy='state_1km'):
+    """
+    65536-entry uint8 table giving, for every 16-bit QA value, the CLOUD, SHADOW and CLEAR
+    bits of the policy. Tables of named policies are built once per process.
+    """
+    if isinstance(policy, dict):
+        return _build_table(policy)
+    get_policy(policy)
+    return _named_table(policy)
+
+
+def decode_qa(qa, policy='state_1km', nodata=None):
+    """
+    Decode a uint16 QA array (e.g. a daily stack of shape (T, H, W)) into cloud, cloud shadow
+    and clear masks with one table lookup per pixel.
+
+    Args:
+        qa: Array of QA values (any integer dtype, values in 0..65535)
+        policy: Policy name in QA_POLICIES or policy dictionary
+        nodata: Optional QA fill value; such pixels are neither cloud, shadow nor clear
+
+    Returns:
+        tuple: (cloud, shadow, clear) boolean arrays of the shape of qa
+    """
+    qa = np.asarray(qa)
+    codes = qa_lookup_table(policy)[qa.astype(np.uint16, copy=False)]
+    if nodata is not None:
+        codes[qa == nodata] = 0
+    return (codes & CLOUD).astype(bool), (codes & SHADOW).astype(bool), (codes & CLEAR).astype(bool)
+
+
+def mask_clouds(values, qa, policy='state_1km', nodata=None):
+    """
+    Replace the values of cloudy (and, depending on the policy, shadowed) pixels with NaN.
+
+    Args:
+        values: Array of values, e.g. sur_refl_b02 of a daily stack
+        qa: QA array of the same shape
+        policy: Policy name in QA_POLICIES or policy dictionary
+        nodata: Optional QA fill value, treated as not clear
+
+    Returns:
+        float array with NaN where the pixel is not clear
+    """
+    _, _, clear = decode_qa(qa, policy, nodata)
+    return np.where(clear, values, np.nan)
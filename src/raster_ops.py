@@ -0,0 +1,149 @@
+import numpy as np
+from scipy import ndimage
+
+# NumPy counterparts of the Earth Engine neighbourhood operations used in the
+# processing modules. All functions accept single rasters (y, x) or stacks
+# (..., y, x); neighbourhoods only ever span the last two axes, so a whole
+# (time, y, x) stack is processed in one call without mixing time steps.
+
+
+def disk_footprint(radius):
+    """
+    Circular kernel in pixels, equivalent to ee.Kernel.circle(radius, 'pixels').
+    """
+    r = int(np.floor(radius))
+    yy, xx = np.mgrid[-r:r + 1, -r:r + 1]
+    return (xx ** 2 + yy ** 2) <= radius ** 2
+
+
+def _plane(kernel, ndim):
+    """
+    Expand a 2D kernel so that it only acts on the last two axes of an ndim array.
+    """
+    return kernel.reshape((1,) * (ndim - 2) + kernel.shape)
+
+
+def _four_connected(ndim):
+    """
+    Structuring element with 4-connectivity in the y/x plane and none across time.
+    """
+    cross = ndimage.generate_binary_structure(2, 1)
+    structure = np.zeros((3,) * (ndim - 2) + cross.shape, dtype=bool)
+    structure[(1,) * (ndim - 2)] = cross
+    return structure
+
+
+def focal_min(mask, radius):
+    """
+    Erode a boolean mask with a circular kernel (focal_min of a 0/1 mask).
+    Pixels outside the array are treated as masked, as outside a clipped AOI.
+
+    Args:
+        mask: Boolean array (..., y, x)
+        radius: Kernel radius in pixels
+
+    Returns:
+        Boolean array of the same shape
+    """
+    mask = np.asarray(mask, dtype=bool)
+    return ndimage.binary_erosion(mask, structure=_plane(disk_footprint(radius), mask.ndim), border_value=0)
+
+
+def focal_mean(values, valid, radius):
+    """
+    Mean over a circular kernel that ignores masked pixels, like focal_mean on a masked image.
+
+    Args:
+        values: Array (..., y, x)
+        valid: Boolean array of the same shape, False for masked pixels
+        radius: Kernel radius in pixels
+
+    Returns:
+        float array with NaN where the kernel holds no valid pixel
+    """
+    kernel = _plane(disk_footprint(radius).astype(np.float64), np.ndim(values))
+    valid = np.asarray(valid, dtype=bool)
+    sums = ndimage.correlate(np.where(valid, values, 0).astype(np.float64), kernel, mode='constant', cval=0)
+    counts = ndimage.correlate(valid.astype(np.float64), kernel, mode='constant', cval=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def connected_pixel_count(binary, max_size=None):
+    """
+    Size of the 4-connected cluster each True pixel belongs to (connectedPixelCount with
+    eightConnected=False). Background pixels get 0.
+
+    Args:
+        binary: Boolean array (..., y, x)
+        max_size: Optional cap on the reported size, like the maxSize argument in EE
+
+    Returns:
+        int array of the same shape
+    """
+    binary = np.asarray(binary, dtype=bool)
+    labels, _ = ndimage.label(binary, structure=_four_connected(binary.ndim))
+    sizes = np.bincount(labels.ravel())
+    sizes[0] = 0
+    count = sizes[labels]
+    if max_size is not None:
+        count = np.minimum(count, max_size)
+    return count
+
+
+def sieve(binary, valid, ppha):
+    """
+    Remove snow patches and fill non-snow holes of at most ppha pixels, as in the
+    pre-processing of get_snowline_elevation.
+
+    Args:
+        binary: Boolean snow array (..., y, x)
+        valid: Boolean array, False where the input image is masked
+        ppha: Maximum size (in pixels) of patches to remove
+
+    Returns:
+        Boolean array, False outside valid
+    """
+    snow = np.asarray(binary, dtype=bool) & valid
+    snow = snow & ~(connected_pixel_count(snow, ppha + 1) <= ppha)
+    holes = valid & ~snow
+    return snow | (holes & (connected_pixel_count(holes, ppha + 1) <= ppha))
+
+
+def canny_edges(image, threshold, sigma):
+    """
+    Canny edge detector on the last two axes: Gaussian smoothing, Sobel gradient and
+    non-maximum suppression, keeping pixels whose gradient magnitude exceeds threshold
+    (single threshold as in ee.Algorithms.CannyEdgeDetector).
+
+    Args:
+        image: Array (..., y, x)
+        threshold: Minimum gradient magnitude of an edge pixel
+        sigma: Standard deviation of the Gaussian pre-filter in pixels
+
+    Returns:
+        float array holding the gradient magnitude on edge pixels and 0 elsewhere
+    """
+    image = np.asarray(image, dtype=np.float64)
+    ndim = image.ndim
+    if sigma > 0:
+        image = ndimage.gaussian_filter(image, sigma=(0,) * (ndim - 2) + (sigma, sigma))
+
+    # Sobel along one spatial axis, smoothing along the other spatial axis only
+    gx = ndimage.correlate1d(ndimage.correlate1d(image, [-1, 0, 1], axis=-1), [1, 2, 1], axis=-2)
+    gy = ndimage.correlate1d(ndimage.correlate1d(image, [-1, 0, 1], axis=-2), [1, 2, 1], axis=-1)
+    magnitude = np.hypot(gx, gy)
+
+    # Quantize the gradient direction to 0, 45, 90 and 135 degrees
+    direction = np.round(np.arctan2(gy, gx) / (np.pi / 4)).astype(np.int8) % 4
+    offsets = {0: (0, 1), 1: (1, 1), 2: (1, 0), 3: (1, -1)}
+
+    padded = np.pad(magnitude, [(0, 0)] * (ndim - 2) + [(1, 1), (1, 1)])
+    ny, nx = magnitude.shape[-2:]
+    is_max = np.zeros(magnitude.shape, dtype=bool)
+    for code, (dy, dx) in offsets.items():
+        ahead = padded[..., 1 + dy:1 + dy + ny, 1 + dx:1 + dx + nx]
+        behind = padded[..., 1 - dy:1 - dy + ny, 1 - dx:1 - dx + nx]
+        is_max |= (direction == code) & (magnitude >= ahead) & (magnitude >= behind)
+
+    return np.where(is_max & (magnitude > threshold), magnitude, 0.0)
@@ -118,35 +118,41 @@ def get_snowline_elevation(modis_img=None, dem=None, aspect_coded=None, aoi=None
             dropNulls=True
         )
 
+    # Median, 10th percentile and count of elevations for all aspect classes in one grouped pass
+    grouped_stats = ee.List(sample_points.reduceColumns(
+        reducer=ee.Reducer.median()
+            .combine(ee.Reducer.percentile([10]), '', True)
+            .combine(ee.Reducer.count(), '', True)
+            .group(groupField=1, groupName='mixed'),
+        selectors=['DSM', 'mixed']
+    ).get('groups'))
+
+    # Index the groups by aspect class code; aspects without samples get null statistics and a count of 0
+    stats_by_class = ee.Dictionary.fromLists(
+        grouped_stats.map(lambda group: ee.Number(ee.Dictionary(group).get('mixed')).int().format()),
+        grouped_stats
+    )
+    empty_stats = ee.Dictionary({'median': None, 'p10': None, 'count': 0})
+
+    def stats_by_aspect(stat):
+        return ee.Feature(ee.List.sequence(0, 4).iterate(
+            lambda x, previous: ee.Feature(previous).set(
+                ee.List(aspectKeys).get(ee.Number(x)),
+                empty_stats.combine(ee.Dictionary(
+                    stats_by_class.get(ee.Number(x).add(1).int().format(), ee.Dictionary())
+                )).get(stat)
+            ),
+            ee.Feature(None)
+        )).toDictionary()
+
     # Median elevation by aspect
-    rr2 = ee.Feature(ee.List.sequence(0, 4).iterate(
-        lambda x, previous: ee.Feature(previous).set(
-            ee.List(aspectKeys).get(ee.Number(x)),
-            sample_points.filter(ee.Filter.eq('mixed', ee.Number(x).add(1)))
-                .aggregate_array('DSM').reduce(ee.Reducer.median())
-        ),
-        ee.Feature(None)
-    )).toDictionary()
+    rr2 = stats_by_aspect('median')
 
     # 10th percentile elevation by aspect
-    rr1 = ee.Feature(ee.List.sequence(0, 4).iterate(
-        lambda x, previous: ee.Feature(previous).set(
-            ee.List(aspectKeys).get(ee.Number(x)),
-            sample_points.filter(ee.Filter.eq('mixed', ee.Number(x).add(1)))
-                .aggregate_array('DSM').reduce(ee.Reducer.percentile([10]))
-        ),
-        ee.Feature(None)
-    )).toDictionary()
+    rr1 = stats_by_aspect('p10')
 
     # Count of points per aspect
-    rr2_count = ee.Feature(ee.List.sequence(0, 4).iterate(
-        lambda x, previous: ee.Feature(previous).set(
-            ee.List(aspectKeys).get(ee.Number(x)),
-            sample_points.filter(ee.Filter.eq('mixed', ee.Number(x).add(1)))
-                .aggregate_array('DSM').reduce(ee.Reducer.count())
-        ),
-        ee.Feature(None)
-    )).toDictionary()
+    rr2_count = stats_by_aspect('count')
 
     # -------------------------------------
     # FRACTIONAL SNOW COVER OVER AOI
@@ -220,9 +226,29 @@ def get_snowline_elevation(modis_img=None, dem=None, aspect_coded=None, aoi=None
 
     return rr2,fsc
 
-def calculate_glacier_metrics(glims, aoi, modis_img,sc_th, rr2, dem, aspectKeys, tileScaleValue, aspects):
+def glacier_raster(glims, aoi, glacier_filter=None):
+    """
+    Glacier label raster of an AOI (1 on glaciers, masked elsewhere). Build it once per basin
+    and pass it to calculate_glacier_metrics for every image.
+
+    Args:
+        glims: Earth Engine FeatureCollection of glaciers
+        aoi: Area of interest as an Earth Engine Geometry
+        glacier_filter: Optional ee.Filter selecting the glaciers of the AOI by id (see
+            GlacierIndex.glacier_filter), used instead of glims.filterBounds(aoi)
+
+    Returns:
+        ee.Image with the band 'glacier'
+    """
+    glims_aoi = glims.filter(glacier_filter) if glacier_filter is not None else glims.filterBounds(aoi)
+    return glims_aoi.reduceToImage(['area'], ee.Reducer.first()).gt(0).selfMask().rename('glacier')
+
+def calculate_glacier_metrics(glims, aoi, modis_img,sc_th, rr2, dem, aspectKeys, tileScaleValue, aspects, glacier_filter=None,
+                              glacier_image=None, scale=30):
     """
     Calculate glacier snow cover fraction and area metrics.
+    All metrics come from a single reduction: sums of glacier pixels, snow pixels, pixels below
+    the snowline, snow pixels below the snowline and area below the snowline, then ratios.
     
     Args:
         glims: Earth Engine FeatureCollection of glaciers
@@ -234,75 +260,68 @@ def calculate_glacier_metrics(glims, aoi, modis_img,sc_th, rr2, dem, aspectKeys,
         aspectKeys: List of aspect categories (e.g., ['North', 'East', 'South', 'West', 'mixed'])
         tileScaleValue: Value for tileScale parameter to handle computation
         aspects: Image with aspect classifications
+        glacier_filter: Optional ee.Filter selecting the glaciers of the AOI by id (see
+            GlacierIndex.glacier_filter), used instead of glims.filterBounds(aoi)
+        glacier_image: Glacier raster of the AOI from glacier_raster (default: built here)
+        scale: Scale of the reduction in meters
         
     Returns:
         Dictionary with glacier metrics
     """
+    if glacier_image is None:
+        glacier_image = glacier_raster(glims, aoi, glacier_filter)
+
     # Convert fractional snow cover to binary using threshold
     binarySnow = modis_img.gt(sc_th).rename('value')
-
-    # Create glacier snow cover fraction image
-    glims_scf_image = glims.filterBounds(aoi).reduceToImage(['area'], ee.Reducer.first()) \
-                           .gt(0).multiply(binarySnow)
     
-    # Iterate through aspect categories to identify areas below snowline
+    # Iterate through aspect categories to flag glacier pixels above the snowline
     def process_aspect(item, previous):
         item = ee.String(item)
         threshold = rr2.get(item)
-        img = ee.Image(ee.Algorithms.If(
+        return ee.Image(ee.Algorithms.If(
             ee.Algorithms.IsEqual(threshold, None),
             previous,
-            ee.Image(previous).where(
-                dem.gt(ee.Number(threshold)).And(aspects.select(item).eq(1)),
-                -1
-            )
+            # Unmasked test: where the aspect band is masked the pixel keeps its previous flag
+            ee.Image(previous).Or(dem.gt(ee.Number(threshold)).And(aspects.select(item).eq(1)).unmask(0))
         ))
-        return img.updateMask(img.neq(-1))
-    
-    glims_scf_below_sl_img = ee.Image(ee.List(aspectKeys).iterate(process_aspect, glims_scf_image))
     
-    # Calculate area below snowline in square kilometers
-    glims_area_below_SL_img = glims_scf_below_sl_img.gte(0).multiply(ee.Image.pixelArea()).multiply(1e-6)
+    # Pixels without DEM or aspect count as below the snowline, as in the where() of the aspects
+    above_sl = ee.Image(ee.List(aspectKeys).iterate(process_aspect, ee.Image(0))).unmask(0)
+    below_sl = above_sl.Not()
     
-    # Calculate glacier snow cover fraction
-    glims_fsc = glims_scf_image.reduceRegion(
-        reducer=ee.Reducer.mean(),
+    # Glacier pixels with a snow observation, one band per summed quantity
+    valid = glacier_image.mask().And(binarySnow.mask())
+    sums = ee.Image.cat([
+        ee.Image(1).rename('count'),
+        binarySnow.rename('snow'),
+        below_sl.rename('below'),
+        below_sl.And(binarySnow).rename('below_snow'),
+        below_sl.multiply(ee.Image.pixelArea()).multiply(1e-6).rename('area_below'),
+    ]).updateMask(valid).reduceRegion(
+        reducer=ee.Reducer.sum(),
         geometry=aoi,
-        scale=30,
+        scale=scale,
         tileScale=tileScaleValue,
         maxPixels=1e13
-    ).values().get(0)
+    )
+    count = ee.Number(sums.get('count'))
+    below = ee.Number(sums.get('below'))
     
-    # Calculate glacier snow cover fraction below snowline
-    glims_fsc_below_sl = glims_scf_below_sl_img.reduceRegion(
-        reducer=ee.Reducer.mean(),
-        geometry=aoi,
-        scale=30,
-        tileScale=tileScaleValue,
-        maxPixels=1e13
-    ).values().get(0)
+    # Calculate glacier snow cover fraction (null without glacier pixels)
+    glims_fsc = ee.Algorithms.If(count.gt(0), ee.Number(sums.get('snow')).divide(count), None)
     
-    # If North aspect threshold is null, set below snowline metrics to null
+    # Glacier snow cover fraction below snowline; null if the North aspect threshold is null
     glims_fsc_below_sl = ee.Number(ee.Algorithms.If(
         ee.Algorithms.IsEqual(rr2.get('North'), None),
         None,
-        glims_fsc_below_sl
+        ee.Algorithms.If(below.gt(0), ee.Number(sums.get('below_snow')).divide(below), None)
     ))
     
-    # Calculate glacier area below snowline
-    glims_area_below_sl = glims_area_below_SL_img.reduceRegion(
-        reducer=ee.Reducer.sum(),
-        geometry=aoi,
-        scale=30,
-        tileScale=tileScaleValue,
-        maxPixels=1e13
-    ).values().get(0)
-    
-    # If North aspect threshold is null, set area below snowline to null
+    # Glacier area below snowline in square kilometers; null if the North aspect threshold is null
     glims_area_below_sl = ee.Number(ee.Algorithms.If(
         ee.Algorithms.IsEqual(rr2.get('North'), None),
         None,
-        glims_area_below_sl
+        sums.get('area_below')
     ))
     
     # Return results as a dictionary
@@ -0,0 +1,453 @@
+import numpy as np
+
+from src.compact import PackedMask, dem_valid, pack_snow, scf_above, scf_valid
+from src.raster_ops import canny_edges, focal_min, sieve
+from src.tiling import canny_edges_tiled, focal_min_tiled, sieve_tiled
+
+# Local NumPy engine for the snowline analysis in src/snowline.py.
+# Works on in-memory (time, y, x) stacks of snow cover fraction on the same grid
+# as the DEM and the coded aspect image, and processes all time steps at once.
+# Two methods: 'edge' follows the Earth Engine version (Canny edges and sampled edge
+# elevations), 'hypsometry' uses per-basin pixel counts by elevation bin and aspect
+# (Hypsometry) and only needs a snow histogram per time step.
+# Snow cover may be given as uint8 codes and the DEM as int16 (see compact.py); only the
+# sampled pixels are then converted to float.
+
+
+def _aspect_values(value, aspect_keys, default):
+    """
+    Accept a scalar, a per-aspect dictionary (as returned by reproject_and_analyze_dem)
+    or None and return one value per aspect key.
+    """
+    if value is None:
+        value = default
+    if isinstance(value, dict):
+        return np.array([value[key] for key in aspect_keys], dtype=np.float64)
+    return np.full(len(aspect_keys), value, dtype=np.float64)
+
+
+def _group_stats(group, values, n_groups, point2sample, rng):
+    """
+    Median and count of values per group, after drawing at most point2sample random
+    samples per group (the local analogue of stratifiedSample with numPoints).
+    """
+    # Random draw per group: order by group, then by a random priority
+    order = np.lexsort((rng.random(group.size), group))
+    group, values = group[order], values[order]
+    starts = np.searchsorted(group, np.arange(n_groups))
+    rank = np.arange(group.size) - starts[group]
+    keep = rank < point2sample
+    group, values = group[keep], values[keep]
+
+    # Median from the sorted samples of each group
+    order = np.lexsort((values, group))
+    group, values = group[order], values[order]
+    count = np.bincount(group, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(count)[:-1]))
+    median = np.full(n_groups, np.nan)
+    has = count > 0
+    lo = starts[has] + (count[has] - 1) // 2
+    hi = starts[has] + count[has] // 2
+    median[has] = (values[lo] + values[hi]) / 2
+    return median, count
+
+
+# ---------------------------------------------------------------------------
+# Hypsometry method
+# ---------------------------------------------------------------------------
+
+class Hypsometry:
+    """
+    Pixel counts of a basin by aspect class and elevation bin, computed once from the
+    (cached) reprojected DEM and aspect_coded. The snowline of an aspect is the bin edge
+    that minimises the misclassified pixels: snow below plus snow-free above the line.
+
+    Args:
+        dem: Elevation (y, x), NaN where missing
+        aspect_coded: Coded aspect (y, x): 1-East, 2-North, 3-South, 4-West, 5-mixed
+        aoi: Optional boolean (y, x) array of the area of interest (default: finite DEM)
+        bin_size: Height of the elevation bins in meters
+        n_aspects: Number of aspect classes
+    """
+
+    def __init__(self, dem, aspect_coded, aoi=None, bin_size=50, n_aspects=5):
+        dem = np.asarray(dem)
+        aspect_coded = np.asarray(aspect_coded)
+        has_dem = dem_valid(dem)
+        aoi = has_dem if aoi is None else np.asarray(aoi, dtype=bool)
+        domain = aoi & has_dem & (aspect_coded >= 1) & (aspect_coded <= n_aspects)
+
+        self.shape = dem.shape
+        self.bin_size = bin_size
+        self.n_aspects = n_aspects
+        self.pixels = np.flatnonzero(domain)
+        elevation = dem.ravel()[self.pixels].astype(np.float64)
+        low = np.floor(elevation.min() / bin_size) * bin_size if elevation.size else 0.0
+        high = elevation.max() if elevation.size else bin_size
+        n_bins = max(1, int(np.ceil((high - low) / bin_size + 1e-9)))
+        self.edges = low + bin_size * np.arange(n_bins + 1)
+
+        bins = np.clip(((elevation - low) // bin_size).astype(np.int64), 0, n_bins - 1)
+        aspect = aspect_coded.ravel()[self.pixels].astype(np.int64) - 1
+        self.group = (aspect * n_bins + bins).astype(np.int32)
+        self.counts = np.bincount(self.group, minlength=n_aspects * n_bins).reshape(n_aspects, n_bins)
+
+    @property
+    def n_bins(self):
+        return len(self.edges) - 1
+
+    def save(self, path):
+        np.savez(path, shape=self.shape, bin_size=self.bin_size, n_aspects=self.n_aspects, pixels=self.pixels,
+                 edges=self.edges, group=self.group, counts=self.counts)
+
+    @classmethod
+    def load(cls, path):
+        hypsometry = cls.__new__(cls)
+        with np.load(path) as data:
+            hypsometry.shape = tuple(int(n) for n in data['shape'])
+            hypsometry.bin_size = float(data['bin_size'])
+            hypsometry.n_aspects = int(data['n_aspects'])
+            for name in ('pixels', 'edges', 'group', 'counts'):
+                setattr(hypsometry, name, data[name])
+        return hypsometry
+
+    def _histogram(self, selected):
+        # Counts of the selected basin pixels per (time, aspect, bin)
+        n_groups = self.n_aspects * self.n_bins
+        if isinstance(selected, PackedMask):
+            # One time step unpacked at a time
+            counts = [np.bincount(self.group[selected[t].ravel()[self.pixels]], minlength=n_groups)
+                      for t in range(len(selected))]
+            return np.array(counts, dtype=np.int64).reshape(len(selected), self.n_aspects, self.n_bins)
+        t_idx, p_idx = np.nonzero(selected.reshape(selected.shape[0], -1)[:, self.pixels])
+        counts = np.bincount(t_idx * n_groups + self.group[p_idx], minlength=selected.shape[0] * n_groups)
+        return counts.reshape(selected.shape[0], self.n_aspects, self.n_bins)
+
+    def histograms(self, binary_snow, valid):
+        """
+        Snow and valid pixel counts per (time, aspect, bin) of a binary snow stack. Valid
+        counts are the precomputed counts minus the invalid (cloudy) pixels.
+
+        Args:
+            binary_snow: Boolean (time, y, x) snow stack, or a PackedMask
+            valid: Boolean (time, y, x) mask of valid observations, or a PackedMask
+
+        Returns:
+            tuple: (snow, n_valid) integer arrays of shape (time, aspects, bins)
+        """
+        snow = self._histogram(binary_snow & valid)
+        n_valid = self.counts - self._histogram(~valid)
+        return snow, n_valid
+
+    def snowline(self, snow, n_valid, return_support=False):
+        """
+        Snowline elevation per time step and aspect from the histograms: the bin edge with the
+        fewest snow pixels below and snow-free pixels above (middle of tied edges). O(bins).
+
+        Args:
+            snow, n_valid: Histograms from histograms()
+            return_support: Also return the support of every snowline: the smaller of the
+                snow-free pixels below and the snow pixels above the (tied) edges, i.e. the
+                pixels that confirm the line on both sides. It plays the role of the number
+                of sampled edge pixels of the edge method in the fallback logic; a line without
+                snow above or without snow-free pixels below has support 0.
+
+        Returns:
+            (time, aspects) array of elevations, NaN for aspects without valid pixels, and
+            with return_support the (time, aspects) support counts
+        """
+        bare = n_valid - snow
+        zeros = np.zeros(snow.shape[:-1] + (1,), dtype=snow.dtype)
+        snow_below = np.concatenate((zeros, np.cumsum(snow, axis=-1)), axis=-1)
+        bare_below = np.concatenate((zeros, np.cumsum(bare, axis=-1)), axis=-1)
+        errors = snow_below + (bare_below[..., -1:] - bare_below)
+
+        first = np.argmin(errors, axis=-1)
+        last = errors.shape[-1] - 1 - np.argmin(errors[..., ::-1], axis=-1)
+        elevation = (self.edges[first] + self.edges[last]) / 2
+        elevation = np.where(n_valid.sum(axis=-1) > 0, elevation, np.nan)
+        if not return_support:
+            return elevation
+        # Snow above the first and snow-free pixels below the last of the tied edges
+        snow_above = snow_below[..., -1] - np.take_along_axis(snow_below, first[..., np.newaxis], axis=-1)[..., 0]
+        bare_below_line = np.take_along_axis(bare_below, last[..., np.newaxis], axis=-1)[..., 0]
+        return elevation, np.minimum(snow_above, bare_below_line)
+
+
+def _replace_missing(rr2, rr2_count, fsc, has_snow, has_bare, min_dem, max_dem, n_grid):
+    """
+    Fallback logic of get_snowline_elevation for (time, aspects) snowlines.
+    """
+    # Choose fallback DEM elevation based on snow coverage
+    n_sampled = (~np.isnan(rr2)).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rr2_mean = np.where(n_sampled > 0, np.nansum(rr2, axis=1) / n_sampled, np.nan)
+    replacement_value = np.where(fsc >= 0.9, min_dem.min(), np.where(fsc <= 0.1, max_dem.max(), rr2_mean))
+    replacement_value[np.isnan(fsc)] = np.nan
+
+    # Use minDEM or maxDEM if only one class exists, else use rr2
+    only_snow = has_snow & ~has_bare
+    only_bare = has_bare & ~has_snow
+    rr2 = np.where(only_snow[:, np.newaxis], min_dem, np.where(only_bare[:, np.newaxis], max_dem, rr2))
+
+    # Replace nulls and poorly sampled aspects with the fallback value
+    replace = np.isnan(rr2) | ((rr2_count < 10) & (rr2_count / n_grid < 0.01))
+    return np.where(replace, replacement_value[:, np.newaxis], rr2)
+
+
+# ---------------------------------------------------------------------------
+# Snowline elevation
+# ---------------------------------------------------------------------------
+
+def get_snowline_elevation_local(scf_stack=None, dem=None, aspect_coded=None, aoi=None, min_dem=None, max_dem=None,
+                                 n_grid=None, scale=500, scale_dem=500, sc_th=50, canny_threshold=0.7,
+                                 canny_sigma=0.7, ppha=10, point2sample=1000,
+                                 aspectKeys=['East', 'North', 'South', 'West', 'mixed'], seed=123,
+                                 method='edge', hypsometry=None, bin_size=50, tile_size=None, max_workers=None):
+    """
+    Estimate snowline elevation by aspect for a whole stack of snow cover images.
+    With method='edge', follows get_snowline_elevation step by step (erosion of the valid
+    mask, sieving, Canny edges, sampling of edge elevations per aspect and the fallback
+    logic), but runs locally on arrays. With method='hypsometry', the snowline of every
+    aspect is located on the basin hypsometry (see Hypsometry) from the thresholded snow
+    cover of the valid pixels, with the same fallback logic (the support of the line stands
+    in for the sampled edge pixel count, see Hypsometry.snowline).
+
+    Args:
+        scf_stack: Snow cover fraction (0-100) as (time, y, x) or (y, x) array, NaN where masked,
+            or uint8 codes with SCF_NODATA (compact.encode_scf)
+        dem: Elevation (y, x) on the same grid, NaN where missing, or int16 with DEM_NODATA
+        aspect_coded: Coded aspect (y, x): 1-East, 2-North, 3-South, 4-West, 5-mixed
+        aoi: Optional boolean (y, x) array of the area of interest (default: finite DEM)
+        min_dem: Minimum elevation, scalar or per-aspect dictionary (default: from dem over aoi)
+        max_dem: Maximum elevation, scalar or per-aspect dictionary (default: from dem over aoi)
+        n_grid: Number of grid cells in the AOI (default: from dem over aoi)
+        scale: Scale of the MODIS image in meters
+        scale_dem: Pixel size of the arrays in meters
+        sc_th: Snow cover threshold for binary classification (0-100)
+        canny_threshold: Threshold for Canny edge detector
+        canny_sigma: Sigma parameter for Canny edge detector
+        ppha: Minimum patch size (in pixels)
+        point2sample: Maximum number of snowline points per aspect
+        aspectKeys: List of aspect categories, in the order of the aspect codes
+        seed: Seed for the random sampling of snowline points
+        method: 'edge' or 'hypsometry'
+        hypsometry: Precomputed Hypsometry of the basin (method='hypsometry'; default: built
+            from dem, aspect_coded and aoi)
+        bin_size: Elevation bin size in meters when the hypsometry is built here
+        tile_size: Run the neighbourhood operations of method='edge' in tiles of this size
+            with halos (see tiling.py; same result, for rasters too large for one pass)
+        max_workers: Number of threads processing the tiles
+
+    Returns:
+        tuple: (sla, fsc) where sla maps each aspect key to a (time,) array of snowline
+        elevations (NaN where the Earth Engine version returns null) and fsc is a (time,)
+        array of fractional snow cover
+    """
+    if scf_stack is None:
+        raise ValueError("The 'scf_stack' parameter must be provided.")
+
+    # uint8 codes and int16 elevations stay compact; float input is used as given
+    scf = np.asarray(scf_stack)
+    if scf.dtype != np.uint8:
+        scf = scf.astype(np.float64, copy=False)
+    if scf.ndim == 2:
+        scf = scf[np.newaxis]
+    dem = np.asarray(dem)
+    has_dem = dem_valid(dem)
+    aspect_coded = np.asarray(aspect_coded)
+    aoi = has_dem if aoi is None else np.asarray(aoi, dtype=bool)
+    n_time = scf.shape[0]
+    n_aspects = len(aspectKeys)
+
+    dem_aoi = dem[aoi & has_dem]
+    min_dem = _aspect_values(min_dem, aspectKeys, float(dem_aoi.min()) if dem_aoi.size else np.nan)
+    max_dem = _aspect_values(max_dem, aspectKeys, float(dem_aoi.max()) if dem_aoi.size else np.nan)
+    if n_grid is None:
+        n_grid = dem_aoi.size
+
+    if method == 'hypsometry':
+        if hypsometry is None:
+            hypsometry = Hypsometry(dem, aspect_coded, aoi, bin_size, n_aspects)
+        if scf.dtype == np.uint8:
+            # Bit-packed snow and valid masks, built one time step at a time
+            binary_snow, valid = pack_snow(scf, sc_th, aoi)
+        else:
+            valid = scf_valid(scf) & aoi
+            binary_snow = scf_above(scf, sc_th)
+        snow, n_valid = hypsometry.histograms(binary_snow, valid)
+        # The support of the line (pixels confirming it on both sides) stands in for the sampled
+        # edge pixel count of the edge method, so that the same fallback rule applies
+        rr2, rr2_count = hypsometry.snowline(snow, n_valid, return_support=True)
+
+        n_snow = snow.sum(axis=(1, 2))
+        n_total = n_valid.sum(axis=(1, 2))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fsc = np.where(n_total > 0, n_snow / n_total, np.nan)
+        rr2 = _replace_missing(rr2, rr2_count, fsc, n_snow > 0, n_total > n_snow, min_dem, max_dem, n_grid)
+        return {key: rr2[:, i] for i, key in enumerate(aspectKeys)}, fsc
+    if method != 'edge':
+        raise ValueError(f"Unknown snowline method '{method}'")
+
+    # -------------------------------------
+    # PRE-PROCESSING: CLEAN MASK AND BINARY SNOW IMAGE
+    # -------------------------------------
+
+    # Valid pixels inside the AOI, eroded to avoid edge effects
+    valid = scf_valid(scf) & aoi
+    # Neighbourhood operations in tiles with halos for large rasters (identical results)
+    tiling = {'tile_size': tile_size, 'max_workers': max_workers}
+    radius = 2 * scale / scale_dem
+    mask = focal_min_tiled(valid, radius, **tiling) if tile_size else focal_min(valid, radius)
+
+    # Binary snow with small snow patches removed and small holes filled
+    if tile_size:
+        binary_snow = sieve_tiled(scf_above(scf, sc_th), valid, ppha, **tiling)
+    else:
+        binary_snow = sieve(scf_above(scf, sc_th), valid, ppha)
+
+    # -------------------------------------
+    # EDGE DETECTION (SNOWLINE)
+    # -------------------------------------
+
+    if tile_size:
+        edge = canny_edges_tiled(binary_snow, canny_threshold, canny_sigma, **tiling)
+    else:
+        edge = canny_edges(binary_snow, canny_threshold, canny_sigma)
+    edge = (edge > 0) & mask
+
+    # -------------------------------------
+    # CHECK WHETHER BOTH CLASSES ARE PRESENT
+    # -------------------------------------
+
+    has_snow = (binary_snow & mask).any(axis=(1, 2))
+    has_bare = (~binary_snow & mask).any(axis=(1, 2))
+
+    # -------------------------------------
+    # MAIN ANALYSIS: ELEVATION AT SNOWLINE BY ASPECT
+    # -------------------------------------
+
+    sampleable = aoi & has_dem & (aspect_coded >= 1) & (aspect_coded <= n_aspects)
+    t_idx, y_idx, x_idx = np.nonzero(edge & sampleable)
+    group = t_idx * n_aspects + (aspect_coded[y_idx, x_idx].astype(np.int64) - 1)
+    rr2, rr2_count = _group_stats(group, dem[y_idx, x_idx].astype(np.float64), n_time * n_aspects, point2sample,
+                                  np.random.default_rng(seed))
+    rr2 = rr2.reshape(n_time, n_aspects)
+    rr2_count = rr2_count.reshape(n_time, n_aspects)
+
+    # -------------------------------------
+    # FRACTIONAL SNOW COVER OVER AOI
+    # -------------------------------------
+
+    n_valid = valid.sum(axis=(1, 2))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fsc = np.where(n_valid > 0, binary_snow.sum(axis=(1, 2)) / n_valid, np.nan)
+
+    # -------------------------------------
+    # REPLACEMENT LOGIC FOR MISSING VALUES
+    # -------------------------------------
+
+    rr2 = _replace_missing(rr2, rr2_count, fsc, has_snow, has_bare, min_dem, max_dem, n_grid)
+
+    sla = {key: rr2[:, i] for i, key in enumerate(aspectKeys)}
+    return sla, fsc
+
+
+def calculate_glacier_metrics_local(scf_stack, sla, dem, aspect_coded, glacier, aoi=None, sc_th=50, scale=500,
+                                    aspectKeys=['East', 'North', 'South', 'West', 'mixed']):
+    """
+    Glacier snow cover fraction and area below the snowline per time step, the local
+    analogue of snowline.calculate_glacier_metrics. Only the glacier pixels are read from
+    the stack, so uint8 codes are never widened to a full float array.
+
+    Args:
+        scf_stack: Snow cover fraction (0-100) as (time, y, x) or (y, x) array, NaN where masked,
+            or uint8 codes with SCF_NODATA
+        sla: Snowline elevation per aspect key, (time,) arrays as returned by
+            get_snowline_elevation_local
+        dem: Elevation (y, x), NaN (float) or DEM_NODATA (int16) where missing
+        aspect_coded: Aspect category (y, x), 1..len(aspectKeys) in the order of aspectKeys
+        glacier: Boolean (y, x) glacier mask
+        aoi: Optional boolean (y, x) area of interest
+        sc_th: Snow cover threshold for binary classification (0-100)
+        scale: Pixel size in meters
+        aspectKeys: List of aspect categories
+
+    Returns:
+        dict: 'glims_fsc', 'glims_fsc_below_sl' and 'glims_area_below_sl' (km2) as (time,)
+        arrays, NaN where undefined
+    """
+    scf = np.asarray(scf_stack)
+    if scf.ndim == 2:
+        scf = scf[np.newaxis]
+    dem = np.asarray(dem)
+    aspect_coded = np.asarray(aspect_coded)
+    glacier = np.asarray(glacier, dtype=bool)
+    if aoi is not None:
+        glacier = glacier & np.asarray(aoi, dtype=bool)
+
+    # Glacier pixels only: (time, n_glacier) subsets of the stack
+    y_idx, x_idx = np.nonzero(glacier)
+    values = scf[:, y_idx, x_idx]
+    valid = scf_valid(values)
+    snow = scf_above(values, sc_th) & valid
+
+    # Pixels above the snowline of their aspect; no DEM, no aspect or no snowline counts as below
+    thresholds = np.column_stack([np.asarray(sla[key], dtype=np.float64) for key in aspectKeys])
+    aspect = aspect_coded[y_idx, x_idx].astype(np.int64) - 1
+    has_aspect = (aspect >= 0) & (aspect < len(aspectKeys)) & dem_valid(dem[y_idx, x_idx])
+    elevation = dem[y_idx, x_idx].astype(np.float64)
+    pixel_threshold = np.full((scf.shape[0], y_idx.size), np.nan)
+    pixel_threshold[:, has_aspect] = thresholds[:, aspect[has_aspect]]
+    with np.errstate(invalid='ignore'):
+        below = ~(elevation > pixel_threshold) & valid
+
+    count = valid.sum(axis=1)
+    n_below = below.sum(axis=1)
+    no_north = np.isnan(np.asarray(sla['North'], dtype=np.float64))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        glims_fsc = np.where(count > 0, snow.sum(axis=1) / count, np.nan)
+        fsc_below = np.where(n_below > 0, (below & snow).sum(axis=1) / n_below, np.nan)
+    return {
+        'glims_fsc': glims_fsc,
+        'glims_fsc_below_sl': np.where(no_north, np.nan, fsc_below),
+        'glims_area_below_sl': np.where(no_north, np.nan, n_below * scale ** 2 * 1e-6),
+    }
+
+
+def compare_snowline_methods(scf_stack, dem, aspect_coded, aoi=None, hypsometry=None,
+                             aspectKeys=['East', 'North', 'South', 'West', 'mixed'], **kwargs):
+    """
+    Cross-validate the hypsometry method against the edge method on the same stack.
+
+    Args:
+        scf_stack, dem, aspect_coded, aoi: As in get_snowline_elevation_local
+        hypsometry: Optional precomputed Hypsometry
+        aspectKeys: List of aspect categories
+        **kwargs: Further parameters of get_snowline_elevation_local (sc_th, bin_size, ...)
+
+    Returns:
+        dict: Per aspect key and 'all', the number of compared time steps ('n'), mean
+        difference hypsometry - edge ('bias'), mean absolute and root mean square differences
+        ('mae', 'rmse') and the correlation ('r'), plus the difference in fsc ('fsc_mae')
+    """
+    edge_sla, edge_fsc = get_snowline_elevation_local(scf_stack, dem, aspect_coded, aoi, aspectKeys=aspectKeys,
+                                                      method='edge', **kwargs)
+    hyps_sla, hyps_fsc = get_snowline_elevation_local(scf_stack, dem, aspect_coded, aoi, aspectKeys=aspectKeys,
+                                                      method='hypsometry', hypsometry=hypsometry, **kwargs)
+
+    def scores(edge, hyps):
+        both = np.isfinite(edge) & np.isfinite(hyps)
+        diff = hyps[both] - edge[both]
+        if not both.any():
+            return {'n': 0, 'bias': np.nan, 'mae': np.nan, 'rmse': np.nan, 'r': np.nan}
+        r = np.corrcoef(edge[both], hyps[both])[0, 1] if both.sum() > 1 and np.ptp(edge[both]) > 0 \
+            and np.ptp(hyps[both]) > 0 else np.nan
+        return {'n': int(both.sum()), 'bias': float(diff.mean()), 'mae': float(np.abs(diff).mean()),
+                'rmse': float(np.sqrt((diff ** 2).mean())), 'r': float(r)}
+
+    result = {key: scores(edge_sla[key], hyps_sla[key]) for key in aspectKeys}
+    result['all'] = scores(np.concatenate([edge_sla[key] for key in aspectKeys]),
+                           np.concatenate([hyps_sla[key] for key in aspectKeys]))
+    result['fsc_mae'] = float(np.nanmean(np.abs(hyps_fsc - edge_fsc)))
+    return result
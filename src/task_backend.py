@@ -0,0 +1,165 @@
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import ee
+
+# Task backends used by the export pipelines. A backend starts export tasks and reports
+# their state with the Earth Engine state names (READY, RUNNING, COMPLETED, FAILED,
+# CANCELLED). EETaskBackend talks to Earth Engine; LocalTaskBackend is an in-memory
+# stand-in to run the pipelines without Earth Engine.
+
+ACTIVE_STATES = ('UNSUBMITTED', 'READY', 'RUNNING', 'CANCEL_REQUESTED')
+FINAL_STATES = ('COMPLETED', 'FAILED', 'CANCELLED')
+
+
+class EETaskBackend:
+    """
+    Start ee.batch tasks and poll their state on Earth Engine.
+    """
+
+    def start(self, task, description=None):
+        """
+        Start a task and return its id.
+        """
+        task.start()
+        return task.id
+
+    def status(self, task_ids):
+        """
+        Return a dictionary task id -> state for the given task ids (one request).
+        """
+        if not task_ids:
+            return {}
+        return {s['id']: s['state'] for s in ee.data.getTaskStatus(list(task_ids))}
+
+
+class LocalTaskBackend:
+    """
+    In-memory task backend. Every started task becomes COMPLETED after `polls_to_complete`
+    status calls, unless its description is listed in `fail` (FAILED) or `start_errors`
+    (start() raises, as on a quota error; a dictionary gives the number of failing
+    attempts per description). Records all started tasks in `started`.
+    """
+
+    def __init__(self, polls_to_complete=1, fail=(), start_errors=()):
+        self.polls_to_complete = polls_to_complete
+        self.fail = set(fail)
+        # description -> number of start() calls that still raise
+        if isinstance(start_errors, dict):
+            self.start_errors = dict(start_errors)
+        else:
+            self.start_errors = dict.fromkeys(start_errors, 1)
+        self.started = []
+        self._ids = itertools.count(1)
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Picklable for process pools; every process continues with its own copy
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def start(self, task, description=None):
+        description = description or getattr(task, 'config', {}).get('description', repr(task))
+        with self._lock:
+            if self.start_errors.get(description, 0) > 0:
+                self.start_errors[description] -= 1
+                raise ee.EEException(f'Too many tasks already in the queue: {description}')
+            task_id = f'LOCAL{next(self._ids):06d}'
+            self._tasks[task_id] = {'description': description, 'polls': 0}
+            self.started.append(description)
+        return task_id
+
+    def status(self, task_ids):
+        states = {}
+        with self._lock:
+            for task_id in task_ids:
+                task = self._tasks.get(task_id)
+                if task is None:
+                    states[task_id] = 'UNKNOWN'
+                    continue
+                task['polls'] += 1
+                if task['polls'] < self.polls_to_complete:
+                    states[task_id] = 'RUNNING'
+                elif task['description'] in self.fail:
+                    states[task_id] = 'FAILED'
+                else:
+                    states[task_id] = 'COMPLETED'
+        return states
+
+
+class RateLimiter:
+    """
+    Thread-safe limiter allowing at most `rate` calls per second.
+    """
+
+    def __init__(self, rate, clock=time.monotonic, sleep=time.sleep):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.clock = clock
+        self.sleep = sleep
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = self.clock()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            self.sleep(start - now)
+
+
+def start_tasks(jobs, backend=None, max_workers=4, rate=2.0, retries=3, backoff=5.0, sleep=time.sleep,
+                verbose=False):
+    """
+    Start many export tasks concurrently through a thread pool, with rate limiting and
+    retries with exponential backoff on Earth Engine errors (e.g. too many queued tasks).
+
+    Args:
+        jobs: Iterable of (description, make_task) pairs; make_task() builds the task
+        backend: Task backend (default: EETaskBackend)
+        max_workers: Number of submission threads
+        rate: Maximum number of task starts per second
+        retries: Number of retries per task after the first failed attempt
+        backoff: Delay in seconds before the first retry, doubled for every further retry
+        sleep: Sleep function, replaceable when running against a local backend
+        verbose: Print every started or failed task
+
+    Returns:
+        dict with 'started' (description -> task id) and 'failed' (description -> error message)
+    """
+    backend = backend or EETaskBackend()
+    limiter = RateLimiter(rate, sleep=sleep)
+
+    def submit(description, make_task):
+        task = make_task()
+        for attempt in range(retries + 1):
+            limiter.wait()
+            try:
+                return backend.start(task, description)
+            except ee.EEException:
+                if attempt == retries:
+                    raise
+                sleep(backoff * 2 ** attempt)
+
+    summary = {'started': {}, 'failed': {}}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(submit, description, make_task): description for description, make_task in jobs}
+        for future in as_completed(futures):
+            description = futures[future]
+            try:
+                summary['started'][description] = future.result()
+                if verbose:
+                    print(f'  Export task started: {description}')
+            except Exception as e:
+                summary['failed'][description] = str(e)
+                if verbose:
+                    print(f'  Export task failed: {description}: {e}')
+    return summary
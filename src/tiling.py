@@ -0,0 +1,272 @@
+import functools
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import numpy as np
+from scipy import ndimage
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from src.raster_ops import _four_connected, canny_edges, focal_mean, focal_min
+
+# Tiled execution of the raster_ops neighbourhood operations for basins too large to process
+# as one array. The (..., y, x) rasters are split into tiles along y and x; every tile is read
+# with a halo as wide as the footprint of the operation (focal kernel radius, Gaussian +
+# Sobel + non-maximum suppression reach of Canny), processed in a thread or process pool and
+# its core written to the output, which can be a np.memmap. Within the halo every core pixel
+# sees exactly the neighbourhood of the untiled run, and tiles touching the raster edge see
+# the same edge, so the stitched result is identical.
+#
+# Connected components have no bounded footprint: they are labelled per tile, merged across
+# tile edges with a connected-components pass over the graph of touching labels, and sized
+# globally, so sieving gives the same result as raster_ops.sieve.
+
+DEFAULT_TILE_SIZE = 512
+
+
+def focal_halo(radius):
+    """
+    Halo in pixels of a circular focal operation (focal_min, focal_mean) of radius pixels.
+    """
+    return int(np.floor(radius))
+
+
+def canny_halo(sigma, truncate=4.0):
+    """
+    Halo in pixels of canny_edges: Gaussian kernel radius (as in ndimage.gaussian_filter),
+    one pixel for the Sobel gradient and one for the non-maximum suppression.
+    """
+    gaussian = int(truncate * float(sigma) + 0.5) if sigma > 0 else 0
+    return gaussian + 2
+
+
+class Tile:
+    """
+    One tile of a raster: core (y, x) slices written to the output, window (y, x) slices
+    read with the halo, and inner (y, x) slices of the core within the window.
+    """
+
+    def __init__(self, index, core, window):
+        self.index = index
+        self.core = core
+        self.window = window
+        self.inner = tuple(slice(c.start - w.start, c.stop - w.start) for c, w in zip(core, window))
+
+    def __repr__(self):
+        return f'Tile({self.index}, core={self.core}, window={self.window})'
+
+
+def _starts(size, tile_size):
+    return list(range(0, size, tile_size))
+
+
+def tile_grid(shape, tile_size=DEFAULT_TILE_SIZE, halo=0):
+    """
+    Tiles covering a (y, x) raster shape, row by row.
+
+    Args:
+        shape: (y, x) shape, or the shape of a (..., y, x) array
+        tile_size: Core size of the tiles in pixels (int or (y, x) pair)
+        halo: Halo width in pixels, clipped at the raster edges
+
+    Returns:
+        list of Tile
+    """
+    height, width = shape[-2:]
+    tile_y, tile_x = (tile_size, tile_size) if np.isscalar(tile_size) else tile_size
+    tiles = []
+    for i, y0 in enumerate(_starts(height, tile_y)):
+        for j, x0 in enumerate(_starts(width, tile_x)):
+            y1, x1 = min(y0 + tile_y, height), min(x0 + tile_x, width)
+            core = (slice(y0, y1), slice(x0, x1))
+            window = (slice(max(y0 - halo, 0), min(y1 + halo, height)),
+                      slice(max(x0 - halo, 0), min(x1 + halo, width)))
+            tiles.append(Tile((i, j), core, window))
+    return tiles
+
+
+def _pool(executor, max_workers):
+    if executor == 'thread':
+        return ThreadPoolExecutor(max_workers=max_workers)
+    if executor == 'process':
+        return ProcessPoolExecutor(max_workers=max_workers)
+    raise ValueError(f"Unknown executor '{executor}'")
+
+
+def _run_tiles(function, tiles, arrays, max_workers, executor, consume):
+    """
+    Run function(*chunks) on the window of every tile and pass (tile, result) to consume in
+    the main thread. At most 2 * max_workers tiles are read and in flight at a time.
+    """
+    def chunks(tile):
+        return [np.asarray(a[(Ellipsis,) + tile.window]) for a in arrays]
+
+    if max_workers == 1:
+        for tile in tiles:
+            consume(tile, function(*chunks(tile)))
+        return
+
+    max_workers = max_workers or os.cpu_count()
+    with _pool(executor, max_workers) as pool:
+        max_in_flight = 2 * max_workers
+        pending = iter(tiles)
+        in_flight = {}
+        while True:
+            for tile in pending:
+                in_flight[pool.submit(function, *chunks(tile))] = tile
+                if len(in_flight) >= max_in_flight:
+                    break
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                consume(in_flight.pop(future), future.result())
+
+
+def map_tiles(function, arrays, halo, tile_size=DEFAULT_TILE_SIZE, max_workers=None, executor='thread', out=None):
+    """
+    Apply a neighbourhood function tile by tile and stitch the tile cores.
+
+    Args:
+        function: function(*chunks) -> array (..., wy, wx) for chunks (..., wy, wx) of the
+            arrays; must only look halo pixels far (picklable for executor='process')
+        arrays: Arrays (..., y, x) with the same y and x size
+        halo: Halo width in pixels (see focal_halo, canny_halo)
+        tile_size: Core size of the tiles in pixels
+        max_workers: Number of workers (1: sequential in the calling thread)
+        executor: 'thread' or 'process'
+        out: Optional output array (e.g. a np.memmap); default: allocated from the first tile
+
+    Returns:
+        Array (..., y, x)
+    """
+    if not isinstance(arrays, (list, tuple)):
+        arrays = [arrays]
+    shape = np.shape(arrays[0])
+    result = {'out': out}
+
+    def consume(tile, values):
+        if result['out'] is None:
+            result['out'] = np.empty(values.shape[:-2] + shape[-2:], dtype=values.dtype)
+        result['out'][(Ellipsis,) + tile.core] = values[(Ellipsis,) + tile.inner]
+
+    _run_tiles(function, tile_grid(shape, tile_size, halo), arrays, max_workers, executor, consume)
+    return result['out']
+
+
+# ---------------------------------------------------------------------------
+# Focal operations
+# ---------------------------------------------------------------------------
+
+def focal_min_tiled(mask, radius, **kwargs):
+    """
+    Tiled raster_ops.focal_min (keyword arguments: see map_tiles).
+    """
+    return map_tiles(functools.partial(focal_min, radius=radius), [mask], focal_halo(radius), **kwargs)
+
+
+def focal_mean_tiled(values, valid, radius, **kwargs):
+    """
+    Tiled raster_ops.focal_mean (keyword arguments: see map_tiles).
+    """
+    return map_tiles(functools.partial(focal_mean, radius=radius), [values, valid], focal_halo(radius), **kwargs)
+
+
+def canny_edges_tiled(image, threshold, sigma, **kwargs):
+    """
+    Tiled raster_ops.canny_edges (keyword arguments: see map_tiles).
+    """
+    return map_tiles(functools.partial(canny_edges, threshold=threshold, sigma=sigma), [image], canny_halo(sigma),
+                     **kwargs)
+
+
+# ---------------------------------------------------------------------------
+# Connected components
+# ---------------------------------------------------------------------------
+
+def _label_tile(binary):
+    binary = binary.astype(bool)
+    labels, n = ndimage.label(binary, structure=_four_connected(binary.ndim))
+    return labels, n
+
+
+def _edge_pairs(labels, tiles):
+    """
+    Pairs of labels touching across the tile edges (4-connectivity, same leading index).
+    """
+    ys = sorted({t.core[0].start for t in tiles} - {0})
+    xs = sorted({t.core[1].start for t in tiles} - {0})
+    pairs = []
+    for y in ys:
+        pairs.append((labels[..., y - 1, :], labels[..., y, :]))
+    for x in xs:
+        pairs.append((labels[..., :, x - 1], labels[..., :, x]))
+    left, right = [], []
+    for a, b in pairs:
+        a, b = np.asarray(a).ravel(), np.asarray(b).ravel()
+        both = (a > 0) & (b > 0)
+        left.append(a[both])
+        right.append(b[both])
+    if not left:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(left), np.concatenate(right)
+
+
+def connected_pixel_count_tiled(binary, max_size=None, tile_size=DEFAULT_TILE_SIZE, max_workers=None,
+                                executor='thread', out=None):
+    """
+    Tiled raster_ops.connected_pixel_count, identical to the untiled result: labels per
+    tile, merged across tile edges, sized globally.
+
+    Args:
+        binary: Boolean array (..., y, x)
+        max_size: Optional cap on the reported size
+        tile_size, max_workers, executor: See map_tiles
+        out: Optional int64 output array (e.g. a np.memmap), also used for the labels
+
+    Returns:
+        int64 array of the same shape
+    """
+    shape = np.shape(binary)
+    tiles = tile_grid(shape, tile_size)
+    labels = np.zeros(shape, dtype=np.int64) if out is None else out
+    n_labels = [0]
+
+    def consume(tile, result):
+        tile_labels, n = result
+        # Offset the tile labels to make them unique over the raster
+        labels[(Ellipsis,) + tile.core] = np.where(tile_labels > 0, tile_labels + n_labels[0], 0)
+        n_labels[0] += n
+
+    _run_tiles(_label_tile, tiles, [binary], max_workers, executor, consume)
+    n = n_labels[0]
+
+    # Merge the labels touching across tile edges into components
+    left, right = _edge_pairs(labels, tiles)
+    graph = coo_matrix((np.ones(len(left), dtype=np.int8), (left, right)), shape=(n + 1, n + 1))
+    _, component = connected_components(graph, directed=False)
+
+    # Component size of every label; background (label 0) stays 0
+    label_sizes = np.zeros(n + 1, dtype=np.int64)
+    for tile in tiles:
+        label_sizes += np.bincount(labels[(Ellipsis,) + tile.core].ravel(), minlength=n + 1)
+    label_sizes[0] = 0
+    sizes = np.bincount(component, weights=label_sizes).astype(np.int64)[component]
+    sizes[0] = 0
+    if max_size is not None:
+        sizes = np.minimum(sizes, max_size)
+
+    for tile in tiles:
+        index = (Ellipsis,) + tile.core
+        labels[index] = sizes[labels[index]]
+    return labels
+
+
+def sieve_tiled(binary, valid, ppha, **kwargs):
+    """
+    Tiled raster_ops.sieve (keyword arguments: see connected_pixel_count_tiled).
+    """
+    snow = np.asarray(binary, dtype=bool) & valid
+    snow = snow & ~(connected_pixel_count_tiled(snow, ppha + 1, **kwargs) <= ppha)
+    holes = valid & ~snow
+    return snow | (holes & (connected_pixel_count_tiled(holes, ppha + 1, **kwargs) <= ppha))
@@ -0,0 +1,357 @@
+import contextlib
+import functools
+import importlib
+import inspect
+import json
+import sys
+import threading
+import time
+import tracemalloc
+
+import ee
+
+# Opt-in stage tracing. Inside `with tracing() as tracer:` every public function of the
+# instrumented modules runs in a span recording its wall time, the number of client
+# round-trips made during the span (getInfo, task starts and status requests), the node
+# count of the Earth Engine expression graph it returns (count_nodes=True) and the peak of
+# the Python memory allocated during the span (memory=True, for the local NumPy path).
+# Spans nest along the call stack; traces export as JSON and as folded stacks for
+# flame graph tools (flamegraph.pl, speedscope, inferno).
+#
+# On the Earth Engine path the functions only build the expression graph: their wall time
+# is the client-side graph construction, the server time shows up in the spans that make
+# the round-trips.
+
+DEFAULT_MODULES = ('src.modis_processing', 'src.dem_processing', 'src.snowline', 'src.glacier_mask_tiles')
+
+# earthengine-api functions that each make one request
+EE_REQUEST_FUNCTIONS = ('computeValue', 'getTaskStatus', 'getTaskList', 'listOperations', 'exportImage',
+                        'exportTable', 'exportMap', 'exportVideo', 'getList', 'getInfo')
+
+
+class Span:
+    """
+    One timed call: name, parent span id, start offset and wall time in seconds, round-trips,
+    graph nodes of the result and peak memory in bytes above the memory at the start.
+    """
+
+    def __init__(self, span_id, name, parent, thread, start):
+        self.id = span_id
+        self.name = name
+        self.parent = parent
+        self.thread = thread
+        self.start = start
+        self.wall = None
+        self.round_trips = 0
+        self.nodes = None
+        self.peak_bytes = None
+        self.error = None
+        self._start_memory = 0
+        self._peak = 0
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'parent': self.parent,
+            'thread': self.thread,
+            'start': self.start,
+            'wall': self.wall,
+            'round_trips': self.round_trips,
+            'nodes': self.nodes,
+            'peak_bytes': self.peak_bytes,
+            'error': self.error,
+        }
+
+
+def count_nodes(result):
+    """
+    Number of nodes of the Earth Engine expression graphs in a result (an ee object, or a
+    tuple, list or dictionary of them); None if the result holds no ee object.
+    """
+    if isinstance(result, (tuple, list)):
+        counts = [count_nodes(r) for r in result]
+    elif isinstance(result, dict):
+        counts = [count_nodes(r) for r in result.values()]
+    elif hasattr(result, 'serialize') and not isinstance(result, type):
+        try:
+            graph = json.loads(result.serialize())
+        except Exception:
+            return None
+        # Compact Earth Engine serialization: one entry per distinct node
+        if isinstance(graph, dict) and isinstance(graph.get('values'), dict):
+            return len(graph['values'])
+        return _count_invocations(graph)
+    else:
+        return None
+    counts = [c for c in counts if c is not None]
+    return sum(counts) if counts else None
+
+
+def _count_invocations(graph):
+    if isinstance(graph, dict):
+        own = 1 if ('functionInvocationValue' in graph or 'op' in graph) else 0
+        return own + sum(_count_invocations(v) for v in graph.values())
+    if isinstance(graph, list):
+        return sum(_count_invocations(v) for v in graph)
+    return 0
+
+
+class Tracer:
+    """
+    Collects the spans of all threads.
+
+    Args:
+        count_nodes: Count the expression graph nodes of every result (serializes the results)
+        memory: Record peak memory with tracemalloc (slows allocations down)
+    """
+
+    def __init__(self, count_nodes=False, memory=False):
+        self.count_nodes = count_nodes
+        self.memory = memory
+        self.spans = []
+        # Round-trips of all threads, inside spans or not
+        self.round_trips = 0
+        self._origin = time.perf_counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def _update_peaks(self, stack):
+        # Every open span keeps the highest peak seen since it started; the tracemalloc peak is
+        # reset at every span boundary so that spans starting later measure from their start
+        current, peak = tracemalloc.get_traced_memory()
+        for span in stack:
+            span._peak = max(span._peak, peak)
+        tracemalloc.reset_peak()
+        return current
+
+    @contextlib.contextmanager
+    def span(self, name):
+        """
+        Context manager recording a span; yields the Span.
+        """
+        stack = self._stack()
+        with self._lock:
+            span_id = self._next_id
+            self._next_id += 1
+        span = Span(span_id, name, stack[-1].id if stack else None, threading.get_ident(),
+                    time.perf_counter() - self._origin)
+        if self.memory and tracemalloc.is_tracing():
+            span._start_memory = span._peak = self._update_peaks(stack)
+        stack.append(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f'{type(e).__name__}: {e}'
+            raise
+        finally:
+            span.wall = time.perf_counter() - start
+            if self.memory and tracemalloc.is_tracing():
+                self._update_peaks(stack)
+                span.peak_bytes = span._peak - span._start_memory
+            stack.pop()
+            with self._lock:
+                self.spans.append(span)
+
+    def record_round_trip(self):
+        """
+        Count one client round-trip for all open spans of the calling thread.
+        """
+        with self._lock:
+            self.round_trips += 1
+        for span in self._stack():
+            span.round_trips += 1
+
+    def wrap(self, function, name=None):
+        """
+        function wrapped to run in a span named name (default: module.function).
+        """
+        name = name or f'{function.__module__}.{function.__qualname__}'
+
+        @functools.wraps(function)
+        def traced(*args, **kwargs):
+            with self.span(name) as span:
+                result = function(*args, **kwargs)
+            # Counted after the span, so that serializing does not add to its wall time
+            if self.count_nodes:
+                span.nodes = count_nodes(result)
+            return result
+
+        return traced
+
+    # -----------------------------------------------------------------------
+    # Export
+    # -----------------------------------------------------------------------
+
+    def _sorted_spans(self):
+        with self._lock:
+            return sorted(self.spans, key=lambda s: (s.start, s.id))
+
+    def self_times(self):
+        """
+        Dictionary span id -> wall time minus the wall time of the child spans.
+        """
+        spans = self._sorted_spans()
+        own = {s.id: s.wall for s in spans}
+        for s in spans:
+            if s.parent in own:
+                own[s.parent] -= s.wall
+        return {k: max(v, 0.0) for k, v in own.items()}
+
+    def to_json(self, path=None):
+        """
+        Trace as a JSON-serializable dictionary (written to path if given).
+        """
+        own = self.self_times()
+        spans = []
+        for s in self._sorted_spans():
+            entry = s.to_dict()
+            entry['self'] = own[s.id]
+            spans.append(entry)
+        trace = {'round_trips': self.round_trips, 'spans': spans, 'summary': self.summary()}
+        if path is not None:
+            with open(path, 'w') as f:
+                json.dump(trace, f, indent=2)
+        return trace
+
+    def to_folded(self, path=None, unit=1e-6):
+        """
+        Folded stacks ("outer;inner <self time>" per line, self time in units of `unit`
+        seconds, microseconds by default), the input format of flamegraph.pl and speedscope.
+        """
+        spans = {s.id: s for s in self._sorted_spans()}
+        own = self.self_times()
+        totals = {}
+        for s in spans.values():
+            names = []
+            node = s
+            while node is not None:
+                names.append(node.name)
+                node = spans.get(node.parent)
+            stack = ';'.join(reversed(names))
+            totals[stack] = totals.get(stack, 0.0) + own[s.id]
+        lines = [f'{stack} {int(round(t / unit))}' for stack, t in sorted(totals.items())]
+        text = '\n'.join(lines) + '\n'
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+    def summary(self):
+        """
+        Aggregates per span name: calls, total and self wall time, round-trips, maximum
+        node count and maximum peak memory, slowest (total) first.
+        """
+        own = self.self_times()
+        stats = {}
+        for s in self._sorted_spans():
+            entry = stats.setdefault(s.name, {'calls': 0, 'total': 0.0, 'self': 0.0, 'round_trips': 0,
+                                              'max_nodes': None, 'max_peak_bytes': None})
+            entry['calls'] += 1
+            entry['total'] += s.wall
+            entry['self'] += own[s.id]
+            entry['round_trips'] += s.round_trips
+            if s.nodes is not None:
+                entry['max_nodes'] = max(entry['max_nodes'] or 0, s.nodes)
+            if s.peak_bytes is not None:
+                entry['max_peak_bytes'] = max(entry['max_peak_bytes'] or 0, s.peak_bytes)
+        return dict(sorted(stats.items(), key=lambda item: -item[1]['total']))
+
+    def print_summary(self, limit=20):
+        """
+        Print the slowest span names.
+        """
+        print(f"{'span':60s} {'calls':>6s} {'total s':>9s} {'self s':>9s} {'trips':>6s} {'nodes':>7s} {'peak MB':>8s}")
+        for name, s in list(self.summary().items())[:limit]:
+            nodes = '' if s['max_nodes'] is None else str(s['max_nodes'])
+            peak = '' if s['max_peak_bytes'] is None else f"{s['max_peak_bytes'] / 2 ** 20:.1f}"
+            print(f"{name:60s} {s['calls']:6d} {s['total']:9.3f} {s['self']:9.3f} {s['round_trips']:6d} "
+                  f"{nodes:>7s} {peak:>8s}")
+
+
+# ---------------------------------------------------------------------------
+# Instrumentation
+# ---------------------------------------------------------------------------
+
+def public_functions(module):
+    """
+    Names of the public functions defined in a module (not imported into it).
+    """
+    return [name for name, value in vars(module).items()
+            if not name.startswith('_') and inspect.isfunction(value) and value.__module__ == module.__name__]
+
+
+def _round_trip_targets():
+    # (owner, attribute) of the functions that make one client request
+    targets = [(ee.data, name) for name in EE_REQUEST_FUNCTIONS if hasattr(ee.data, name)]
+    emulator = sys.modules.get('src.ee_emulator')
+    if emulator is not None:
+        targets += [(getattr(emulator, cls), 'getInfo') for cls in ('ComputedObject', 'ImageCollection',
+                                                                    'FeatureCollection')]
+    return targets
+
+
+@contextlib.contextmanager
+def tracing(modules=DEFAULT_MODULES, count_nodes=False, memory=False, tracer=None):
+    """
+    Trace the public functions of the given modules and the client round-trips inside the
+    block. References to the functions imported into other src modules are replaced too, so
+    calls such as export_pipeline -> snowline.get_snowline_elevation are traced.
+
+    Args:
+        modules: Names of the modules to instrument
+        count_nodes: Count the expression graph nodes of every result
+        memory: Record the peak memory of every span with tracemalloc
+        tracer: Tracer to add the spans to (default: a new one)
+
+    Yields:
+        Tracer
+    """
+    tracer = tracer or Tracer(count_nodes=count_nodes, memory=memory)
+    replaced = []
+
+    def replace(owner, name, value):
+        replaced.append((owner, name, getattr(owner, name)))
+        setattr(owner, name, value)
+
+    started_tracemalloc = False
+    try:
+        wrapped = {}
+        for module_name in modules:
+            module = importlib.import_module(module_name)
+            for name in public_functions(module):
+                function = getattr(module, name)
+                wrapped[id(function)] = (function, tracer.wrap(function))
+        # Replace the functions wherever the src modules refer to them
+        for module_name, module in list(sys.modules.items()):
+            if module is None or not (module_name == 'src' or module_name.startswith('src.')):
+                continue
+            for name, value in list(vars(module).items()):
+                if id(value) in wrapped and wrapped[id(value)][0] is value:
+                    replace(module, name, wrapped[id(value)][1])
+
+        for owner, name in _round_trip_targets():
+            original = getattr(owner, name)
+
+            def counted(*args, _original=original, **kwargs):
+                tracer.record_round_trip()
+                return _original(*args, **kwargs)
+
+            replace(owner, name, functools.wraps(original)(counted))
+
+        if tracer.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            started_tracemalloc = True
+        yield tracer
+    finally:
+        for owner, name, original in reversed(replaced):
+            setattr(owner, name, original)
+        if started_tracemalloc:
+            tracemalloc.stop()